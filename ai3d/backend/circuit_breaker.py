@@ -0,0 +1,176 @@
+"""
+Per-provider circuit breakers with adaptive timeouts.
+
+A breaker trips OPEN after CB_FAILURE_THRESHOLD consecutive bad calls, where
+a bad call is an error, a timeout, or a success slower than the provider's
+latency SLO. While open, callers skip the provider and go straight to their
+local fallback. After the reset delay one probe call is let through
+(HALF_OPEN): success closes the circuit, failure re-opens it with the delay
+doubled (up to CB_RESET_MAX_S).
+
+timeout_s() adapts to the provider's recent latency: a multiple of the p95 of
+recent successful calls, clamped between a floor and the caller's ceiling.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD  = int(os.getenv("CB_FAILURE_THRESHOLD", "5"))
+RESET_S            = float(os.getenv("CB_RESET_S", "30"))
+RESET_MAX_S        = float(os.getenv("CB_RESET_MAX_S", "300"))
+TIMEOUT_MULTIPLIER = float(os.getenv("CB_TIMEOUT_MULTIPLIER", "2.0"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(Exception):
+    """Raised (or signalled) when a provider's circuit is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} circuit is open, next probe in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, slo_s: float, min_timeout_s: float = 2.0, window: int = 50,
+                 kind: str = None):
+        self.name = name
+        self.slo_s = float(os.getenv(f"CB_{(kind or name).upper()}_SLO_S", slo_s))
+        self.min_timeout_s = min_timeout_s
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._reset_s = RESET_S
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now. In HALF_OPEN only one probe is let through."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self._reset_s:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+                logger.info(f"[Circuit:{self.name}] Half-open, probing")
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def is_open(self) -> bool:
+        """True while calls are being refused; does not use up the half-open probe."""
+        with self._lock:
+            return self.state == OPEN and time.monotonic() - self._opened_at < self._reset_s
+
+    def check(self):
+        """allow(), raising CircuitOpen instead of returning False."""
+        if not self.allow():
+            raise CircuitOpen(self.name, self.retry_in())
+
+    def retry_in(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._reset_s - (time.monotonic() - self._opened_at))
+
+    def record_success(self, latency_s: float):
+        if latency_s > self.slo_s:
+            logger.info(f"[Circuit:{self.name}] Call took {latency_s:.1f}s, over the {self.slo_s:g}s SLO")
+            self.record_failure()
+            return
+        with self._lock:
+            self._latencies.append(latency_s)
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                logger.info(f"[Circuit:{self.name}] Closed")
+            self.state = CLOSED
+            self._reset_s = RESET_S
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                self._reset_s = min(self._reset_s * 2, RESET_MAX_S)
+                self._trip()
+            elif self.state == CLOSED and self.consecutive_failures >= FAILURE_THRESHOLD:
+                self._trip()
+
+    def release(self):
+        """The call was abandoned (e.g. lost a hedged race) without telling us anything."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _trip(self):
+        # Called with the lock held
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self.trips += 1
+        logger.warning(
+            f"[Circuit:{self.name}] Open after {self.consecutive_failures} bad calls; "
+            f"probing again in {self._reset_s:.0f}s"
+        )
+
+    def timeout_s(self, ceiling_s: float) -> float:
+        """Adaptive per-call timeout: TIMEOUT_MULTIPLIER x recent p95, within [min_timeout_s, ceiling_s]."""
+        with self._lock:
+            lat = sorted(self._latencies)
+        if len(lat) < 5:
+            return ceiling_s
+        p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+        return max(self.min_timeout_s, min(ceiling_s, p95 * TIMEOUT_MULTIPLIER))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lat = sorted(self._latencies)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "retry_in_s": round(self.retry_in(), 1),
+                "slo_s": self.slo_s,
+                "p95_s": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 2) if lat else None,
+            }
+
+
+# Latency SLOs per provider; override with CB_<NAME>_SLO_S
+_DEFAULT_SLO_S = {
+    "gemini": 15,
+    "gemini_image": 45,
+    "veo": 240,
+    "huggingface": 120,
+    "horde": 100,
+}
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get(name: str, kind: str = None) -> CircuitBreaker:
+    """
+    The breaker called `name`. `kind` (default: name) picks the SLO defaults
+    and CB_<KIND>_SLO_S, so several breakers can share one provider's settings.
+    """
+    kind = kind or name
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, _DEFAULT_SLO_S.get(kind, 30), kind=kind)
+        return breaker
+
+
+def stats() -> dict:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.stats() for b in breakers}
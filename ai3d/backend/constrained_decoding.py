@@ -0,0 +1,227 @@
+"""
+Schema-constrained decoding for DiagnosisOutput.
+
+Instead of letting MedGemma free-run and grepping a JSON object out of the
+completion, the decoder walks a fixed JSON skeleton:
+- keys and punctuation are fed to the model, never sampled
+- enum fields (artery_id, urgency) pick the best-scoring allowed option
+- string fields may only sample tokens that cannot break out of the string
+- confidence may only sample digits / '.'
+Decoding stops at the closing brace, so the output is always exactly one
+valid JSON object with no surrounding prose.
+Requires: torch (the model's own forward pass, no extra libraries).
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+ARTERY_IDS = ("LAD", "RCA", "LCX")
+URGENCY_LEVELS = ("Immediate", "Urgent", "Routine")
+
+# (field, kind, arg) — arg is the token budget for strings/numbers, the options for enums
+SCHEMA = [
+    ("diagnosis",                "string", 48),
+    ("affected_region",          "string", 48),
+    ("artery_id",                "enum",   ARTERY_IDS),
+    ("urgency",                  "enum",   URGENCY_LEVELS),
+    ("recommended_intervention", "string", 64),
+    ("reasoning",                "string", 160),
+    ("confidence",               "number", 4),
+]
+
+
+class _VocabMasks:
+    """Per-tokenizer boolean masks over the vocabulary, built once (a few seconds for large vocabularies)."""
+
+    def __init__(self, tokenizer):
+        special = set(tokenizer.all_special_ids)
+        self.size = len(tokenizer)
+        self.string_ids = []
+        self.number_ids = []
+        self.quote_ids = []
+        self.close_ids = []
+        for i in range(self.size):
+            if i in special:
+                continue
+            text = tokenizer.decode([i])
+            if not text:
+                continue
+            if text == '"':
+                self.quote_ids.append(i)
+            elif text == "}":
+                self.close_ids.append(i)
+            if not any(c in '"\\' or c < " " for c in text):
+                self.string_ids.append(i)
+            if all(c.isdigit() or c == "." for c in text):
+                self.number_ids.append(i)
+        self._tensors = {}
+
+    def mask(self, name: str, width: int, device, extra=()):
+        """Boolean mask of `width` (the logits size) allowing the named id list plus `extra`."""
+        import torch
+        key = (name, width, str(device))
+        base = self._tensors.get(key)
+        if base is None:
+            base = torch.zeros(width, dtype=torch.bool, device=device)
+            ids = getattr(self, name) if name else []
+            if ids:
+                base[torch.tensor(ids, device=device)] = True
+            self._tensors[key] = base
+        if not extra:
+            return base
+        mask = base.clone()
+        mask[torch.tensor(list(extra), device=device)] = True
+        return mask
+
+
+class _Session:
+    """Incremental forward passes over one sequence, carrying the KV cache."""
+
+    def __init__(self, model, input_ids, past_key_values=None):
+        self.model = model
+        self.cache = past_key_values
+        self.logits = None
+        cached = past_key_values.get_seq_length() if past_key_values is not None else 0
+        self._forward(input_ids[:, cached:])
+
+    def _forward(self, input_ids):
+        import torch
+        with torch.no_grad():
+            out = self.model(input_ids=input_ids, past_key_values=self.cache, use_cache=True)
+        self.cache = out.past_key_values
+        self.logits = out.logits[0, -1]
+
+    def feed(self, ids):
+        import torch
+        if ids:
+            self._forward(torch.tensor([ids], device=self.model.device))
+
+    def pick(self, mask) -> int:
+        return int(self.logits.masked_fill(~mask, float("-inf")).argmax())
+
+
+def _clamp_confidence(text: str) -> str:
+    """Digits-only sampling can still yield '93' or '1.2.'; coerce to a float in [0, 1]."""
+    try:
+        value = float(text)
+    except ValueError:
+        head = text.split(".")
+        try:
+            value = float(".".join(head[:2]))
+        except ValueError:
+            return "0.5"
+    if value > 1:
+        # "93" reads as a percentage; anything else above 1 is just capped
+        value = value / 100 if value <= 100 and value.is_integer() else 1.0
+    return f"{value:.2f}"
+
+
+class ConstrainedDecoder:
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.masks = _VocabMasks(tokenizer)
+        self._literal_ids = {}
+        if not self.masks.quote_ids:
+            logger.warning("[Constrained] Tokenizer has no bare '\"' token; strings close only at their budget")
+
+    def _ids(self, text: str) -> list:
+        ids = self._literal_ids.get(text)
+        if ids is None:
+            ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+            self._literal_ids[text] = ids
+        return ids
+
+    def decode(self, model, input_ids, past_key_values=None, on_text=None):
+        """
+        Decode one DiagnosisOutput JSON object after `input_ids` (shape [1, n]).
+        Returns (json_text, tokens_generated) where tokens_generated counts only
+        model-chosen tokens, not the forced skeleton.
+        """
+        session = _Session(model, input_ids, past_key_values)
+        width = session.logits.shape[-1]
+        device = session.logits.device
+        pieces = []
+        generated = 0
+
+        def emit(text):
+            pieces.append(text)
+            if on_text:
+                on_text(text)
+
+        def force(text):
+            session.feed(self._ids(text))
+            emit(text)
+
+        for idx, (field, kind, arg) in enumerate(SCHEMA):
+            opener = "{" if idx == 0 else ", "
+            force(f'{opener}"{field}": ' + ('"' if kind != "number" else ""))
+
+            if kind == "string":
+                ids, shown = [], 0
+                closed = False
+                for step in range(arg):
+                    mask = self.masks.mask("string_ids", width, device, self.masks.quote_ids if step else ())
+                    tid = session.pick(mask)
+                    generated += 1
+                    session.feed([tid])
+                    if tid in self.masks.quote_ids:
+                        closed = True
+                        break
+                    ids.append(tid)
+                    text = self.tokenizer.decode(ids)
+                    if len(text) > shown and not text.endswith("\ufffd"):
+                        emit(text[shown:])
+                        shown = len(text)
+                text = self.tokenizer.decode(ids)
+                if len(text) > shown:
+                    emit(text[shown:])
+                if closed:
+                    emit('"')
+                else:
+                    force('"')
+
+            elif kind == "enum":
+                options = [(opt, self._ids(opt)) for opt in arg]
+                pos = 0
+                while len(options) > 1 and all(len(ids) > pos for _, ids in options):
+                    firsts = {ids[pos] for _, ids in options}
+                    tid = session.pick(self.masks.mask(None, width, device, firsts))
+                    generated += 1
+                    session.feed([tid])
+                    options = [(opt, ids) for opt, ids in options if ids[pos] == tid]
+                    pos += 1
+                choice, ids = options[0]
+                session.feed(ids[pos:])
+                emit(choice)
+                force('"')
+
+            else:  # number
+                ids = []
+                for step in range(arg):
+                    mask = self.masks.mask("number_ids", width, device, self.masks.close_ids if step else ())
+                    tid = session.pick(mask)
+                    generated += 1
+                    if tid in self.masks.close_ids:
+                        break
+                    session.feed([tid])
+                    ids.append(tid)
+                emit(_clamp_confidence(self.tokenizer.decode(ids)))
+                # The closing brace ends decoding; it never needs a forward pass
+                emit("}")
+
+        return "".join(pieces), generated
+
+
+_decoders = {}
+_decoders_lock = threading.Lock()
+
+
+def get_decoder(tokenizer) -> ConstrainedDecoder:
+    """One decoder (and vocabulary mask set) per tokenizer instance."""
+    with _decoders_lock:
+        decoder = _decoders.get(id(tokenizer))
+        if decoder is None:
+            decoder = ConstrainedDecoder(tokenizer)
+            _decoders[id(tokenizer)] = decoder
+        return decoder
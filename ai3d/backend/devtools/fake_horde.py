@@ -0,0 +1,110 @@
+"""
+Stand-in AI Horde server for exercising horde_client offline.
+
+Implements the four endpoints the client uses (submit, check, status, cancel)
+plus image downloads. Every job waits in a simulated queue for a random
+FAKE_HORDE_MIN_S..FAKE_HORDE_MAX_S seconds; FAKE_HORDE_FAIL_RATE of jobs
+fault instead of finishing, and FAKE_HORDE_NO_ID_RATE of submits are
+accepted without a job id. GET /stats reports submits, polls and cancels.
+
+    uvicorn devtools.fake_horde:app --port 7001
+    HORDE_BASE_URL=http://127.0.0.1:7001/api/v2 uvicorn main:app
+"""
+import os
+import io
+import time
+import uuid
+import random
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response
+
+MIN_S = float(os.getenv("FAKE_HORDE_MIN_S", "3"))
+MAX_S = float(os.getenv("FAKE_HORDE_MAX_S", "12"))
+FAIL_RATE = float(os.getenv("FAKE_HORDE_FAIL_RATE", "0"))
+NO_ID_RATE = float(os.getenv("FAKE_HORDE_NO_ID_RATE", "0"))
+
+app = FastAPI(title="Fake AI Horde")
+
+_jobs = {}      # id -> {"ready_at", "faulted", "size", "cancelled"}
+_stats = {"submitted": 0, "checks": 0, "status": 0, "downloads": 0, "cancelled": 0}
+
+
+def _png(size, seed: str) -> bytes:
+    from PIL import Image
+    rnd = random.Random(seed)
+    img = Image.new("RGB", size, color=(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@app.post("/api/v2/generate/async", status_code=202)
+async def submit(body: dict):
+    _stats["submitted"] += 1
+    if random.random() < NO_ID_RATE:
+        return {"message": "Request accepted without an id", "kudos": 10}
+    job_id = str(uuid.uuid4())
+    params = body.get("params") or {}
+    _jobs[job_id] = {
+        "ready_at": time.time() + random.uniform(MIN_S, MAX_S),
+        "faulted": random.random() < FAIL_RATE,
+        "size": (int(params.get("width", 512)), int(params.get("height", 512))),
+        "cancelled": False,
+    }
+    return {"id": job_id, "kudos": 10}
+
+
+def _job(job_id: str) -> dict:
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/api/v2/generate/check/{job_id}")
+async def check(job_id: str):
+    job = _job(job_id)
+    _stats["checks"] += 1
+    remaining = max(0.0, job["ready_at"] - time.time())
+    waiting = sum(1 for j in _jobs.values() if j["ready_at"] > time.time() and not j["cancelled"])
+    return {
+        "done": remaining == 0 and not job["faulted"],
+        "faulted": remaining == 0 and job["faulted"],
+        "finished": int(remaining == 0),
+        "processing": 0,
+        "waiting": int(remaining > 0),
+        "queue_position": waiting,
+        "wait_time": int(remaining),
+        "is_possible": True,
+    }
+
+
+@app.get("/api/v2/generate/status/{job_id}")
+async def status(job_id: str, request: Request):
+    job = _job(job_id)
+    _stats["status"] += 1
+    if job["ready_at"] > time.time() or job["faulted"]:
+        return {"done": False, "generations": []}
+    return {
+        "done": True,
+        "generations": [{"img": str(request.url_for("image", job_id=job_id)), "seed": job_id}],
+    }
+
+
+@app.delete("/api/v2/generate/status/{job_id}")
+async def cancel(job_id: str):
+    _job(job_id)["cancelled"] = True
+    _stats["cancelled"] += 1
+    return {"done": False, "generations": []}
+
+
+@app.get("/img/{job_id}.png", name="image")
+async def image(job_id: str):
+    job = _job(job_id)
+    _stats["downloads"] += 1
+    return Response(_png(job["size"], job_id), media_type="image/png")
+
+
+@app.get("/stats")
+async def stats():
+    return _stats
@@ -0,0 +1,107 @@
+"""
+Response cache for the LLM-backed teaching routes (/api/mentor, /api/explain).
+
+A class of students produces only a few dozen distinct clinical contexts, so
+most prompts repeat verbatim. Two tiers, both LRU with TTL (see ttl_cache.py):
+- memory: small and hot
+- disk  : optional warm tier (GUIDANCE_CACHE_DIR) that survives restarts and
+          refills the memory tier on first use
+Keys hash every prompt input plus the provider/model. Free-text questions are
+folded (case, whitespace, punctuation) so "What size balloon?" and
+"what size balloon" share an entry; they are counted as a separate layer.
+Each entry remembers how long the upstream call took, so hits report the
+latency they saved.
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+GUIDANCE_CACHE_SIZE      = int(os.getenv("GUIDANCE_CACHE_SIZE", "256"))      # 0 disables
+GUIDANCE_CACHE_DISK_SIZE = int(os.getenv("GUIDANCE_CACHE_DISK_SIZE", "2048"))
+GUIDANCE_CACHE_TTL_S     = float(os.getenv("GUIDANCE_CACHE_TTL_S", "86400"))
+GUIDANCE_CACHE_DIR       = os.getenv("GUIDANCE_CACHE_DIR") or None          # e.g. cache/guidance
+
+_PUNCT = re.compile(r"[^\w\s]")
+
+
+def normalise_question(question: Optional[str]) -> str:
+    """Fold case, punctuation and whitespace out of a free-text question."""
+    return " ".join(_PUNCT.sub(" ", (question or "").casefold()).split())
+
+
+class GuidanceCache:
+    def __init__(self, name: str):
+        self.name = name
+        self.memory = TTLCache(max_entries=GUIDANCE_CACHE_SIZE, ttl_s=GUIDANCE_CACHE_TTL_S)
+        self.disk = None
+        if GUIDANCE_CACHE_DIR and GUIDANCE_CACHE_SIZE > 0:
+            self.disk = TTLCache(
+                max_entries=GUIDANCE_CACHE_DISK_SIZE,
+                ttl_s=GUIDANCE_CACHE_TTL_S,
+                persist_path=os.path.join(GUIDANCE_CACHE_DIR, f"{name}.json"),
+            )
+        self._lock = threading.Lock()
+        self._layers = {"exact": {"hits": 0, "misses": 0}, "question": {"hits": 0, "misses": 0}}
+        self.disk_hits = 0
+        self.saved_upstream_s = 0.0
+
+    @staticmethod
+    def key(**fields) -> str:
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str, layer: str = "exact") -> Optional[str]:
+        entry = self.memory.get(key)
+        from_disk = False
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                from_disk = True
+                self.memory.set(key, entry)
+        with self._lock:
+            counts = self._layers[layer]
+            if entry is None:
+                counts["misses"] += 1
+                return None
+            counts["hits"] += 1
+            self.disk_hits += from_disk
+            self.saved_upstream_s += entry.get("latency_s") or 0.0
+        return entry["text"]
+
+    def set(self, key: str, text: str, latency_s: float):
+        entry = {"text": text, "latency_s": round(latency_s, 3)}
+        self.memory.set(key, entry)
+        if self.disk is not None:
+            self.disk.set(key, entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = sum(c["hits"] for c in self._layers.values())
+            lookups = hits + sum(c["misses"] for c in self._layers.values())
+            layers = {
+                name: {**c, "hit_ratio": round(c["hits"] / (c["hits"] + c["misses"]), 3) if c["hits"] + c["misses"] else None}
+                for name, c in self._layers.items()
+            }
+            return {
+                "hit_ratio": round(hits / lookups, 3) if lookups else None,
+                "layers": layers,
+                "memory_entries": self.memory.stats()["entries"],
+                "disk_entries": self.disk.stats()["entries"] if self.disk is not None else None,
+                "disk_hits": self.disk_hits,
+                "saved_upstream_s": round(self.saved_upstream_s, 2),
+            }
+
+
+mentor_cache = GuidanceCache("mentor")
+explain_cache = GuidanceCache("explain")
+
+
+def stats() -> dict:
+    return {"mentor": mentor_cache.stats(), "explain": explain_cache.stats()}
@@ -0,0 +1,140 @@
+"""
+Hedged execution: race several strategies for the same result, first success wins.
+
+Each contender starts after its own delay (0 = immediately). If every running
+contender has failed, the next waiting one starts at once instead of sitting
+out its delay. The first usable result is returned and every other contender
+is cancelled. Per-contender outcomes and latencies are kept so hedge delays
+can be tuned from /health.
+"""
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Contender:
+    def __init__(self, name: str, start: Callable[[], Awaitable[Any]], delay_s: float = 0.0):
+        self.name = name
+        self.start = start          # coroutine factory, called when the contender launches
+        self.delay_s = delay_s
+
+
+class _ContenderStats:
+    OUTCOMES = ("won", "failed", "late", "cancelled")
+
+    def __init__(self, window: int = 100):
+        self.started = 0
+        self.counts = {k: 0 for k in self.OUTCOMES}
+        self.latencies = {"won": deque(maxlen=window), "failed": deque(maxlen=window)}
+
+    def snapshot(self) -> dict:
+        out = {"started": self.started, **self.counts}
+        for outcome, values in self.latencies.items():
+            lat = sorted(values)
+            out[f"{outcome}_p50_s"] = round(lat[len(lat) // 2], 2) if lat else None
+        return out
+
+
+class HedgedRace:
+    def __init__(self, name: str, deadline_s: Optional[float] = None):
+        self.name = name
+        self.deadline_s = deadline_s
+        self.races = 0
+        self.no_winner = 0
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _record(self, contender: str, outcome: str, latency_s: Optional[float] = None):
+        with self._lock:
+            entry = self._stats.setdefault(contender, _ContenderStats())
+            if outcome == "started":
+                entry.started += 1
+                return
+            entry.counts[outcome] += 1
+            if latency_s is not None and outcome in entry.latencies:
+                entry.latencies[outcome].append(latency_s)
+
+    async def run(
+        self, contenders: List[Contender], accept: Callable[[Any], bool] = lambda r: r is not None
+    ) -> Tuple[Optional[str], Any]:
+        """Returns (winner name, result), or (None, None) if nobody succeeded before the deadline."""
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        waiting = sorted(contenders, key=lambda c: c.delay_s)
+        running = {}            # task -> (contender, started_at)
+        winner = None
+        with self._lock:
+            self.races += 1
+
+        try:
+            while waiting or running:
+                elapsed = loop.time() - t0
+                while waiting and (waiting[0].delay_s <= elapsed or not running):
+                    c = waiting.pop(0)
+                    running[asyncio.ensure_future(c.start())] = (c, loop.time())
+                    self._record(c.name, "started")
+                    logger.info(f"[Hedge:{self.name}] Started {c.name} at +{elapsed:.1f}s")
+
+                timeout = waiting[0].delay_s - elapsed if waiting else None
+                if self.deadline_s is not None:
+                    remaining = self.deadline_s - elapsed
+                    if remaining <= 0:
+                        logger.warning(f"[Hedge:{self.name}] Deadline of {self.deadline_s:g}s reached")
+                        break
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    c, started_at = running.pop(task)
+                    latency = loop.time() - started_at
+                    ok = not task.cancelled() and task.exception() is None and accept(task.result())
+                    if not ok:
+                        reason = task.exception() if not task.cancelled() else "cancelled"
+                        logger.info(f"[Hedge:{self.name}] {c.name} failed after {latency:.1f}s: {reason or 'no result'}")
+                        self._record(c.name, "failed", latency)
+                    elif winner is None:
+                        winner = (c.name, task.result())
+                        logger.info(f"[Hedge:{self.name}] {c.name} won after {latency:.1f}s")
+                        self._record(c.name, "won", latency)
+                    else:
+                        self._record(c.name, "late", latency)
+                if winner is not None:
+                    break
+        finally:
+            for task, (c, _) in running.items():
+                task.cancel()
+                self._record(c.name, "cancelled")
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        if winner is None:
+            with self._lock:
+                self.no_winner += 1
+            return None, None
+        return winner
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "races": self.races,
+                "no_winner": self.no_winner,
+                "contenders": {name: s.snapshot() for name, s in self._stats.items()},
+            }
+
+
+_races = {}
+
+
+def get_race(name: str, deadline_s: Optional[float] = None) -> HedgedRace:
+    race = _races.get(name)
+    if race is None:
+        race = _races[name] = HedgedRace(name, deadline_s)
+    return race
+
+
+def stats() -> dict:
+    return {name: race.stats() for name, race in _races.items()}
@@ -0,0 +1,231 @@
+"""
+Async AI Horde (Stable Horde) client.
+
+One pooled httpx.AsyncClient is shared by every request, so job submits,
+status checks and image downloads reuse keep-alive connections instead of
+opening a fresh TLS session each time. All jobs of a batch are submitted
+together, polled concurrently with jittered backoff (honouring the Horde's
+own wait_time hint), and each image is downloaded the moment its job is done.
+The whole batch is bounded by one deadline (adapted to recent batch times by
+the "horde" circuit breaker); unfinished jobs are cancelled on the Horde and
+come back as None. While the circuit is open no jobs are submitted at all.
+Submits take a token from the "horde" rate-limit bucket (rate_limiter.py);
+a 429 pauses the bucket and the submit is retried up to HORDE_SUBMIT_ATTEMPTS.
+
+tests/test_horde_client.py runs it against devtools/fake_horde.py on a local
+port. Point HORDE_BASE_URL at the same stand-in to exercise it by hand:
+    uvicorn devtools.fake_horde:app --port 7001
+    HORDE_BASE_URL=http://127.0.0.1:7001/api/v2 python horde_client.py
+Requires: httpx.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+from typing import Callable, List, Optional
+
+import circuit_breaker
+import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+HORDE_BASE_URL   = os.getenv("HORDE_BASE_URL", "https://aihorde.net/api/v2").rstrip("/")
+HORDE_API_KEY    = os.getenv("HORDE_API_KEY", "0000000000")       # anonymous key
+HORDE_MODEL      = os.getenv("HORDE_MODEL", "Deliberate")
+HORDE_DEADLINE_S = float(os.getenv("HORDE_DEADLINE_S", "120"))
+HORDE_POLL_MIN_S = float(os.getenv("HORDE_POLL_MIN_S", "2"))
+HORDE_POLL_MAX_S = float(os.getenv("HORDE_POLL_MAX_S", "10"))
+HORDE_MAX_CONNECTIONS = int(os.getenv("HORDE_MAX_CONNECTIONS", "20"))
+HORDE_SUBMIT_ATTEMPTS = int(os.getenv("HORDE_SUBMIT_ATTEMPTS", "3"))    # tries per frame when rate-limited
+
+
+class HordeClient:
+    def __init__(self, base_url: str = HORDE_BASE_URL, api_key: str = HORDE_API_KEY):
+        self.base_url = base_url
+        self.api_key = api_key
+        self._client = None
+        self._loop = None
+
+    def _http(self):
+        import httpx
+        # An AsyncClient is bound to the loop it was first used on
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            if self._client is not None and not self._client.is_closed:
+                self._retire(self._client, self._loop)
+            self._client = httpx.AsyncClient(
+                headers={"apikey": self.api_key},
+                timeout=httpx.Timeout(30.0, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=HORDE_MAX_CONNECTIONS,
+                    max_keepalive_connections=HORDE_MAX_CONNECTIONS,
+                ),
+                follow_redirects=True,
+            )
+            self._loop = loop
+        return self._client
+
+    @staticmethod
+    def _retire(client, loop):
+        # The old client's connections belong to its own loop; close them there if it still runs
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            logger.warning("[AI Horde] Event loop changed; dropping the previous HTTP client without closing it")
+
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    async def generate_images(
+        self, prompts: List[str], deadline_s: float = HORDE_DEADLINE_S, width: int = 512, height: int = 512,
+        on_image: Optional[Callable[[int, int], None]] = None,
+    ) -> List[Optional[bytes]]:
+        """
+        Generate one image per prompt. Returns encoded image bytes in prompt
+        order, with None for any job that failed or missed the deadline.
+        on_image(finished, total) is called as each job settles, successful or not.
+        """
+        breaker = circuit_breaker.get("horde")
+        if not breaker.allow():
+            logger.warning(f"[AI Horde] Circuit open, skipping {len(prompts)} jobs")
+            return [None] * len(prompts)
+        # Healthy Horde batches finish well inside the configured window; shrink it to match
+        deadline_s = breaker.timeout_s(deadline_s)
+
+        started = time.perf_counter()
+        deadline = started + deadline_s
+        finished = 0
+
+        async def tracked(i: int, prompt: str):
+            nonlocal finished
+            try:
+                return await self._generate_one(i, prompt, deadline, width, height)
+            finally:
+                finished += 1
+                if on_image is not None:
+                    on_image(finished, len(prompts))
+
+        results = await asyncio.gather(
+            *(tracked(i, prompt) for i, prompt in enumerate(prompts)),
+            return_exceptions=True,
+        )
+        images = []
+        for i, result in enumerate(results):
+            if isinstance(result, BaseException):
+                logger.warning(f"[AI Horde] Frame {i + 1} failed: {result}")
+                result = None
+            images.append(result)
+        ok = sum(img is not None for img in images)
+        took = time.perf_counter() - started
+        logger.info(f"[AI Horde] {ok}/{len(prompts)} images in {took:.1f}s")
+        if ok:
+            breaker.record_success(took)
+        else:
+            breaker.record_failure()
+        return images
+
+    async def _generate_one(self, idx: int, prompt: str, deadline: float, width: int, height: int) -> Optional[bytes]:
+        job = {"id": None, "done": False}
+        try:
+            return await asyncio.wait_for(
+                self._run_job(job, idx, prompt, width, height),
+                timeout=max(0.0, deadline - time.perf_counter()),
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"[AI Horde] Frame {idx + 1} missed the deadline")
+            if job["id"] and not job["done"]:
+                await self._cancel_job(job["id"])
+            return None
+        except asyncio.CancelledError:
+            # Caller went away: free the Horde slot without holding up the cancellation
+            if job["id"] and not job["done"]:
+                asyncio.ensure_future(self._cancel_job(job["id"]))
+            raise
+
+    async def _run_job(self, job: dict, idx: int, prompt: str, width: int, height: int) -> Optional[bytes]:
+        http = self._http()
+        bucket = rate_limiter.get("horde")
+        for _ in range(HORDE_SUBMIT_ATTEMPTS):
+            # Submits share the anonymous key's quota; 429s pause the bucket and we go round again
+            await bucket.acquire("video")
+            r = await http.post(f"{self.base_url}/generate/async", json={
+                "prompt": prompt,
+                "params": {
+                    "width": width, "height": height, "steps": 25,
+                    "n": 1, "cfg_scale": 7.5, "sampler_name": "k_euler_a",
+                },
+                "nsfw": False,
+                "models": [HORDE_MODEL],
+                "r2": True,
+            })
+            if r.status_code != 429:
+                break
+            bucket.throttle(rate_limiter.retry_after(r))
+        if r.status_code != 202:
+            logger.warning(f"[AI Horde] Frame {idx + 1} submit failed: {r.status_code}")
+            return None
+        job["id"] = r.json().get("id")
+        if not job["id"]:
+            raise RuntimeError(f"submit for frame {idx + 1} returned no job id: {r.text[:200]}")
+        logger.info(f"[AI Horde] Frame {idx + 1} submitted: {job['id']}")
+
+        delay = HORDE_POLL_MIN_S
+        while True:
+            # Full jitter keeps a batch of jobs from polling in lock-step
+            await asyncio.sleep(random.uniform(HORDE_POLL_MIN_S, max(HORDE_POLL_MIN_S, delay)))
+            try:
+                check = (await http.get(f"{self.base_url}/generate/check/{job['id']}")).json()
+            except Exception as e:
+                logger.warning(f"[AI Horde] Poll error frame {idx + 1}: {e}")
+                check = {}
+            if check.get("faulted"):
+                job["done"] = True
+                logger.warning(f"[AI Horde] Frame {idx + 1} faulted on the Horde")
+                return None
+            if check.get("done"):
+                job["done"] = True
+                break
+            # Exponential backoff, jumping straight to the Horde's own estimate when that is longer
+            hint = check.get("wait_time") or 0
+            delay = min(HORDE_POLL_MAX_S, max(delay * 2, min(hint, HORDE_POLL_MAX_S)))
+
+        status = (await http.get(f"{self.base_url}/generate/status/{job['id']}")).json()
+        generations = status.get("generations") or []
+        if not generations:
+            return None
+        img = await http.get(generations[0]["img"])
+        img.raise_for_status()
+        logger.info(f"[AI Horde] ✓ Frame {idx + 1} done")
+        return img.content
+
+    async def _cancel_job(self, job_id: str):
+        # Frees the anonymous queue slot on the Horde; best effort
+        try:
+            await self._http().delete(f"{self.base_url}/generate/status/{job_id}", timeout=5)
+        except Exception as e:
+            logger.debug(f"[AI Horde] Cancel of {job_id} failed: {e}")
+
+
+_client = HordeClient()
+
+
+def get_client() -> HordeClient:
+    return _client
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+
+    async def _main():
+        t0 = time.perf_counter()
+        images = await _client.generate_images([f"test frame {i}" for i in range(n)])
+        await _client.aclose()
+        sizes = [len(img) if img else None for img in images]
+        print(f"{n} jobs against {HORDE_BASE_URL} in {time.perf_counter() - t0:.1f}s: {sizes}")
+
+    asyncio.run(_main())
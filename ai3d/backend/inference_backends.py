@@ -0,0 +1,176 @@
+"""
+Inference backends for medgemma_engine.
+
+A backend only knows how to load a (tokenizer, model) pair for its hardware;
+batching, prompting, parsing and caching stay in medgemma_engine. Every
+backend returns a model exposing the Hugging Face generate()/forward API.
+
+MEDGEMMA_BACKEND:
+- auto (default): cuda if a GPU is visible, else cpu
+- cuda : 4-bit NF4 via bitsandbytes (requires GPU)
+- cpu  : fp32 weights with int8 dynamic quantisation of Linear layers
+- onnx : ONNX Runtime CPU execution via optimum
+"""
+import os
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceBackend:
+    name = "base"
+    quantization = None
+    # Whether the model accepts and returns a reusable KV cache object (prefix cache, constrained decoding)
+    supports_kv_reuse = True
+
+    def __init__(self):
+        self.model_id = os.getenv("MEDGEMMA_MODEL_ID", "google/medgemma-4b-it")
+        self.hf_token = os.getenv("HF_TOKEN", None)
+
+    def load(self):
+        """Return (tokenizer, model). Raises on failure."""
+        raise NotImplementedError
+
+    def info(self) -> dict:
+        return {"backend": self.name, "model_id": self.model_id, "quantization": self.quantization}
+
+
+class CudaNF4Backend(InferenceBackend):
+    """MedGemma with 4-bit NF4 quantisation. Requires: transformers, accelerate, bitsandbytes, torch (GPU)."""
+
+    name = "cuda"
+    quantization = "4-bit NF4"
+
+    def load(self):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+
+        logger.info(f"Loading {self.model_id} (cuda, 4-bit NF4)...")
+
+        bnb_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.bfloat16,
+            bnb_4bit_use_double_quant=True,
+        )
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_id, token=self.hf_token)
+        model = AutoModelForCausalLM.from_pretrained(
+            self.model_id,
+            quantization_config=bnb_config,
+            device_map="auto",
+            torch_dtype=torch.bfloat16,
+            token=self.hf_token,
+            trust_remote_code=True,
+        )
+        model.eval()
+
+        vram_gb = torch.cuda.memory_allocated() / 1e9 if torch.cuda.is_available() else 0
+        logger.info(f"MedGemma loaded. VRAM used: {vram_gb:.1f} GB")
+        return tokenizer, model
+
+
+def _cpu_threads() -> int:
+    return int(os.getenv("MEDGEMMA_CPU_THREADS", "0")) or (os.cpu_count() or 1)
+
+
+class CpuInt8Backend(InferenceBackend):
+    """
+    CPU-only deployments. Linear layers are dynamically quantised to int8;
+    MEDGEMMA_CPU_MODEL_ID can point at a smaller distilled triage model.
+    Requires: transformers, torch.
+    """
+
+    name = "cpu"
+    quantization = "int8 dynamic"
+
+    def __init__(self):
+        super().__init__()
+        self.model_id = os.getenv("MEDGEMMA_CPU_MODEL_ID") or self.model_id
+        self.threads = _cpu_threads()
+
+    def load(self):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+
+        torch.set_num_threads(self.threads)
+        logger.info(f"Loading {self.model_id} (cpu, int8 dynamic, {self.threads} threads)...")
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_id, token=self.hf_token)
+        model = AutoModelForCausalLM.from_pretrained(
+            self.model_id,
+            torch_dtype=torch.float32,
+            token=self.hf_token,
+            trust_remote_code=True,
+        )
+        model.eval()
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        logger.info("MedGemma loaded on CPU.")
+        return tokenizer, model
+
+    def info(self) -> dict:
+        return {**super().info(), "threads": self.threads}
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """
+    ONNX Runtime on CPU. MEDGEMMA_CPU_MODEL_ID may name an exported (optionally
+    int8-quantised) ONNX model; a plain checkpoint is exported on first load.
+    Requires: optimum[onnxruntime].
+    """
+
+    name = "onnx"
+    supports_kv_reuse = False
+
+    def __init__(self):
+        super().__init__()
+        self.model_id = os.getenv("MEDGEMMA_CPU_MODEL_ID") or self.model_id
+        self.threads = _cpu_threads()
+        self.quantization = os.getenv("MEDGEMMA_ONNX_QUANTIZATION", "none")
+
+    def load(self):
+        import onnxruntime as ort
+        from optimum.onnxruntime import ORTModelForCausalLM
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        logger.info(f"Loading {self.model_id} (onnxruntime, {self.threads} threads)...")
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_id, token=self.hf_token)
+        model = ORTModelForCausalLM.from_pretrained(
+            self.model_id,
+            export=not os.path.isdir(self.model_id),
+            provider="CPUExecutionProvider",
+            session_options=options,
+            token=self.hf_token,
+        )
+        logger.info("MedGemma loaded on ONNX Runtime.")
+        return tokenizer, model
+
+    def info(self) -> dict:
+        return {**super().info(), "threads": self.threads}
+
+
+BACKENDS = {
+    "cuda": CudaNF4Backend,
+    "cpu": CpuInt8Backend,
+    "onnx": OnnxRuntimeBackend,
+}
+
+
+@lru_cache(maxsize=1)
+def get_backend() -> InferenceBackend:
+    choice = os.getenv("MEDGEMMA_BACKEND", "auto").lower()
+    if choice == "auto":
+        try:
+            import torch
+            choice = "cuda" if torch.cuda.is_available() else "cpu"
+        except ImportError:
+            choice = "cuda"   # surfaces the missing dependency on load
+    if choice not in BACKENDS:
+        logger.warning(f"Unknown MEDGEMMA_BACKEND={choice!r}; using cuda")
+        choice = "cuda"
+    return BACKENDS[choice]()
@@ -0,0 +1,335 @@
+"""
+Background jobs for long-running pipelines (video generation).
+
+Submitting returns a job id at once. A fixed pool of VIDEO_JOB_WORKERS asyncio
+workers drains a bounded queue (VIDEO_JOB_QUEUE_SIZE) and runs each job's
+pipeline, so HTTP requests never stay open for the minutes a video takes.
+Cancelling a queued job takes it out of the queue, freeing its slot at once.
+
+Pipelines report real stage progress through job.progress(stage, done, total),
+which is safe to call from worker threads (asyncio.to_thread render code).
+Every update is pushed to SSE subscribers; every state change is written to
+VIDEO_JOB_DIR (one JSON file per job, write-then-rename), so results survive a
+restart. Jobs still queued or running when the process stopped come back as
+failed, since their pipeline state is gone.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import pathlib
+import threading
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+VIDEO_JOB_WORKERS    = int(os.getenv("VIDEO_JOB_WORKERS", "2"))
+VIDEO_JOB_QUEUE_SIZE = int(os.getenv("VIDEO_JOB_QUEUE_SIZE", "32"))
+VIDEO_JOB_RETENTION  = int(os.getenv("VIDEO_JOB_RETENTION", "500"))    # finished jobs kept
+VIDEO_JOB_DIR        = os.getenv("VIDEO_JOB_DIR") or str(pathlib.Path(__file__).parent / "generated_videos" / "jobs")
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+TERMINAL = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobQueueFull(Exception):
+    """Raised by submit() when the job queue is at VIDEO_JOB_QUEUE_SIZE."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Video job queue is full ({VIDEO_JOB_QUEUE_SIZE} waiting); retry later")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, kind: str, params: dict, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = QUEUED
+        self.stage = "queued"
+        self.done = None
+        self.total = None
+        self.message = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._manager = None
+        self._task = None
+
+    def progress(self, stage: str, done: Optional[int] = None, total: Optional[int] = None,
+                 message: Optional[str] = None):
+        """Report the current pipeline stage, e.g. progress("images", 2, 6). Thread-safe."""
+        self.stage, self.done, self.total, self.message = stage, done, total, message
+        if self._manager is not None:
+            self._manager._publish_threadsafe(self)
+
+    def snapshot(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def to_record(self) -> dict:
+        return {**self.snapshot(), "params": self.params}
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Job":
+        job = cls(record["kind"], record.get("params") or {}, job_id=record["job_id"])
+        for field in ("status", "stage", "done", "total", "message", "result", "error",
+                      "created_at", "started_at", "finished_at"):
+            setattr(job, field, record.get(field))
+        return job
+
+
+class JobManager:
+    def __init__(self, name: str, workers: int = VIDEO_JOB_WORKERS, queue_size: int = VIDEO_JOB_QUEUE_SIZE,
+                 store_dir: Optional[str] = VIDEO_JOB_DIR):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.store_dir = store_dir
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._runners = {}
+        self._subscribers = {}          # job id -> set of asyncio.Queue
+        self._queue = deque()           # queued jobs, oldest first
+        self._queued = None             # set while the queue is not empty
+        self._workers = []
+        self._loop = None
+        self._lock = threading.Lock()
+        self._counts = {"submitted": 0, "rejected": 0, SUCCEEDED: 0, FAILED: 0, CANCELLED: 0}
+        if store_dir:
+            self._load()
+
+    def register(self, kind: str, run: Callable[[Job], Awaitable[dict]]):
+        """Register the coroutine that executes jobs of `kind`; it returns the job's JSON result."""
+        self._runners[kind] = run
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._workers:
+            return
+        # Events and tasks belong to the loop that created them
+        self._loop = loop
+        self._queue = deque()
+        self._queued = asyncio.Event()
+        self._workers = [asyncio.ensure_future(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"[Jobs:{self.name}] Started {self.workers} workers")
+
+    def submit(self, kind: str, params: dict) -> Job:
+        """Queue a job and return it immediately. Raises JobQueueFull when the queue is full."""
+        if kind not in self._runners:
+            raise ValueError(f"Unknown job kind {kind!r}")
+        self._ensure_workers()
+        if len(self._queue) >= self.queue_size:
+            with self._lock:
+                self._counts["rejected"] += 1
+            raise JobQueueFull(retry_after=30)
+        job = Job(kind, params)
+        job._manager = self
+        self._queue.append(job)
+        self._queued.set()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._counts["submitted"] += 1
+        self._persist(job)
+        logger.info(f"[Jobs:{self.name}] Queued {kind} job {job.id} ({len(self._queue)} waiting)")
+        return job
+
+    async def aclose(self):
+        """Stop the workers; running jobs are recorded as interrupted."""
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued or running job. Finished jobs are returned unchanged."""
+        job = self.get(job_id)
+        if job is None or job.status in TERMINAL:
+            return job
+        if job.status == QUEUED:
+            try:
+                self._queue.remove(job)
+            except ValueError:      # a worker has just taken it
+                pass
+            self._finish(job, CANCELLED, error="Cancelled before it started")
+        elif job._task is not None:
+            job._task.cancel()
+        return job
+
+    async def _next(self) -> Job:
+        while not self._queue:
+            self._queued.clear()
+            await self._queued.wait()
+        return self._queue.popleft()
+
+    async def _worker(self, idx: int):
+        while True:
+            job = await self._next()
+            try:
+                if job.status == QUEUED:
+                    await self._run(job)
+            except asyncio.CancelledError:
+                if job._task is not None and not job._task.done():
+                    job._task.cancel()
+                    self._finish(job, FAILED, error="Interrupted by server shutdown")
+                raise
+            except Exception as e:
+                logger.error(f"[Jobs:{self.name}] Worker {idx} error on {job.id}: {e}", exc_info=True)
+
+    async def _run(self, job: Job):
+        job.status, job.stage, job.started_at = RUNNING, "starting", time.time()
+        self._persist(job)
+        self._publish(job)
+        logger.info(f"[Jobs:{self.name}] Running {job.kind} job {job.id}")
+
+        job._task = asyncio.ensure_future(self._runners[job.kind](job))
+        await asyncio.wait({job._task})
+        if job._task.cancelled():
+            self._finish(job, CANCELLED, error="Cancelled while running")
+        elif job._task.exception() is not None:
+            e = job._task.exception()
+            logger.error(f"[Jobs:{self.name}] {job.kind} job {job.id} failed: {e}")
+            self._finish(job, FAILED, error=str(e))
+        else:
+            self._finish(job, SUCCEEDED, result=job._task.result())
+        job._task = None
+
+    def _finish(self, job: Job, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        job.status, job.stage = status, status
+        job.result, job.error = result, error
+        job.finished_at = time.time()
+        with self._lock:
+            self._counts[status] += 1
+        took = job.finished_at - (job.started_at or job.created_at)
+        logger.info(f"[Jobs:{self.name}] {job.kind} job {job.id} {status} after {took:.1f}s")
+        self._persist(job)
+        self._publish(job)
+        self._prune()
+
+    # ── progress events ─────────────────────────
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def _publish(self, job: Job):
+        # Loop thread only
+        snapshot = job.snapshot()
+        for queue in self._subscribers.get(job.id, ()):
+            queue.put_nowait(snapshot)
+
+    def _publish_threadsafe(self, job: Job):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._publish(job)
+        else:
+            loop.call_soon_threadsafe(self._publish, job)
+
+    # ── persistence ─────────────────────────────
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.store_dir, f"{job_id}.json")
+
+    def _persist(self, job: Job):
+        if not self.store_dir:
+            return
+        path = self._path(job.id)
+        tmp = f"{path}.tmp"
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(job.to_record(), f)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning(f"[Jobs:{self.name}] Could not persist job {job.id}: {e}")
+
+    def _load(self):
+        try:
+            names = os.listdir(self.store_dir)
+        except FileNotFoundError:
+            return
+        jobs = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.store_dir, name), "r", encoding="utf-8") as f:
+                    jobs.append(Job.from_record(json.load(f)))
+            except Exception as e:
+                logger.warning(f"[Jobs:{self.name}] Skipping unreadable job file {name}: {e}")
+        interrupted = 0
+        for job in sorted(jobs, key=lambda j: j.created_at or 0):
+            if job.status not in TERMINAL:
+                job.status = job.stage = FAILED
+                job.error = "Interrupted by a server restart"
+                job.finished_at = time.time()
+                self._persist(job)
+                interrupted += 1
+            self._jobs[job.id] = job
+        self._prune()
+        logger.info(f"[Jobs:{self.name}] Restored {len(self._jobs)} jobs ({interrupted} interrupted)")
+
+    def _prune(self):
+        with self._lock:
+            finished = [j for j in self._jobs.values() if j.status in TERMINAL]
+            stale = finished[:max(0, len(finished) - VIDEO_JOB_RETENTION)]
+            for job in stale:
+                del self._jobs[job.id]
+        for job in stale:
+            if self.store_dir:
+                try:
+                    os.remove(self._path(job.id))
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = [j for j in self._jobs.values() if j.status not in TERMINAL]
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "queued": sum(j.status == QUEUED for j in active),
+                "running": sum(j.status == RUNNING for j in active),
+                "stored": len(self._jobs),
+                **self._counts,
+            }
+
+
+video_jobs = JobManager("video")
+
+
+def stats() -> dict:
+    return {"video": video_jobs.stats()}
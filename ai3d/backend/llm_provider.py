@@ -0,0 +1,226 @@
+"""
+Shared LLM provider for the Gemini-backed routes (mentor, explain, emergency,
+video narration / technique analysis / frame images).
+
+- One long-lived GenerativeModel per (model name, API key), each bound to its
+  own pooled async client, so routes never call genai.configure() (a global)
+  or rebuild clients per request.
+- generate() is awaitable (generate_content_async) and bounded by a per-call
+  timeout, so a slow upstream never blocks the event loop.
+- Circuit breaker and latency window are kept per (provider or circuit, API
+  key env var, call class), e.g. "gemini:GOOGLE_GENAI_API_KEY:emergency".
+  A bad mentor key or a run of failing video calls therefore never opens the
+  circuit /api/emergency relies on, and adaptive timeouts only learn from
+  like calls.
+- The rate-limit bucket is the real quota, one per (provider or circuit, API
+  key env var), e.g. "gemini:GOOGLE_GENAI_API_KEY". Every call class on a key
+  queues on it by priority (see rate_limiter.py), so emergency is served
+  ahead of video and keeps its reserve; a 429 pauses the whole key.
+
+LLM_PROVIDER:
+- gemini (default): google-generativeai
+- fake            : canned local responses after LLM_FAKE_LATENCY_MS, for tests and load runs
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from functools import lru_cache
+
+import circuit_breaker
+import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "30"))
+LLM_FAKE_LATENCY_MS = float(os.getenv("LLM_FAKE_LATENCY_MS", "50"))
+
+
+class LLMTimeout(Exception):
+    """Raised when a generate() call exceeds its timeout."""
+
+
+class _LatencyStats:
+    """Per-model call counters plus a window of recent latencies."""
+
+    def __init__(self, window: int = 200):
+        self._window = window
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, latency_s: float, outcome: str):
+        with self._lock:
+            entry = self._models.setdefault(model, {
+                "calls": 0, "errors": 0, "timeouts": 0, "latencies": deque(maxlen=self._window),
+            })
+            entry["calls"] += 1
+            if outcome == "error":
+                entry["errors"] += 1
+            elif outcome == "timeout":
+                entry["timeouts"] += 1
+            else:
+                entry["latencies"].append(latency_s)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = {}
+            for model, entry in self._models.items():
+                lat = sorted(entry["latencies"])
+                out[model] = {
+                    "calls": entry["calls"],
+                    "errors": entry["errors"],
+                    "timeouts": entry["timeouts"],
+                    "p50_s": round(lat[len(lat) // 2], 3) if lat else None,
+                    "p95_s": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 3) if lat else None,
+                }
+            return out
+
+
+class LLMProvider:
+    name = "base"
+
+    def __init__(self):
+        self._stats = _LatencyStats()
+
+    def available(self, key_env: str = "GEMINI_API_KEY") -> bool:
+        """Whether calls made with the API key in `key_env` can be attempted at all."""
+        return bool(os.getenv(key_env))
+
+    def quota(self, circuit: str = None, key_env: str = "GEMINI_API_KEY") -> str:
+        """Name of the rate-limit bucket for one (provider, key), shared by all call classes."""
+        return f"{circuit or self.name}:{key_env}"
+
+    def channel(self, circuit: str = None, key_env: str = "GEMINI_API_KEY", priority: str = "video") -> str:
+        """Name of the breaker / latency window for one (provider, key, call class)."""
+        return f"{self.quota(circuit, key_env)}:{priority}"
+
+    def circuit_open(self, circuit: str = None, key_env: str = "GEMINI_API_KEY", priority: str = "video") -> bool:
+        """Whether calls on this circuit, key and call class are currently short-circuited."""
+        return circuit_breaker.get(self.channel(circuit, key_env, priority), kind=circuit or self.name).is_open()
+
+    async def generate(self, model: str, contents, key_env: str = "GEMINI_API_KEY",
+                       timeout_s: float = LLM_TIMEOUT_S, circuit: str = None, priority: str = "video",
+                       **kwargs):
+        """
+        Await one generate_content call and return the provider's response
+        (`.text`, `.parts`). The call goes through the breaker for
+        (`circuit` or the provider name, `key_env`, `priority`) and its
+        adaptive timeout, capped at `timeout_s`, after queueing at `priority`
+        on the key's rate-limit bucket (see rate_limiter.PRIORITIES). Raises CircuitOpen without
+        calling out while the circuit is open, RateLimited if no token came
+        up within the class's queue-time limit, LLMTimeout on timeout, or
+        whatever the provider raised.
+        """
+        channel = self.channel(circuit, key_env, priority)
+        breaker = circuit_breaker.get(channel, kind=circuit or self.name)
+        breaker.check()
+        bucket = rate_limiter.get(self.quota(circuit, key_env), kind=circuit or self.name)
+        try:
+            await bucket.acquire(priority)
+        except BaseException:
+            breaker.release()
+            raise
+        timeout_s = breaker.timeout_s(timeout_s)
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(self._generate(model, contents, key_env, **kwargs), timeout_s)
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            self._stats.record(f"{model}@{channel}", time.perf_counter() - started, "timeout")
+            raise LLMTimeout(f"{self.name}:{model} did not answer within {timeout_s:.1f}s")
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            self._stats.record(f"{model}@{channel}", time.perf_counter() - started, "error")
+            if rate_limiter.is_rate_limit_error(e):
+                # Quota, not provider health: back off without counting against the circuit
+                bucket.throttle(rate_limiter.retry_after(e))
+                breaker.release()
+            else:
+                breaker.record_failure()
+            raise
+        latency = time.perf_counter() - started
+        breaker.record_success(latency)
+        self._stats.record(f"{model}@{channel}", latency, "ok")
+        return response
+
+    async def _generate(self, model: str, contents, key_env: str, **kwargs):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"provider": self.name, "models": self._stats.snapshot()}
+
+
+class GeminiProvider(LLMProvider):
+    """Requires: google-generativeai."""
+
+    name = "gemini"
+
+    def __init__(self):
+        super().__init__()
+        self._models = {}
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def _model(self, model: str, key_env: str):
+        import google.generativeai as genai
+        import google.ai.generativelanguage as glm
+
+        api_key = os.getenv(key_env, "")
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            # grpc.aio channels belong to the loop that created them
+            if self._loop is not loop:
+                self._models.clear()
+                self._loop = loop
+            cached = self._models.get((model, api_key))
+            if cached is None:
+                cached = genai.GenerativeModel(model)
+                # Bind a per-key client instead of the process-wide genai.configure() default,
+                # so routes using GEMINI_API_KEY and GOOGLE_GENAI_API_KEY never trample each other
+                cached._async_client = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+                self._models[(model, api_key)] = cached
+                logger.info(f"[LLM] Created client for {model} ({key_env})")
+            return cached
+
+    async def _generate(self, model: str, contents, key_env: str, **kwargs):
+        return await self._model(model, key_env).generate_content_async(contents, **kwargs)
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.parts = []
+
+
+class FakeProvider(LLMProvider):
+    """Deterministic local stand-in: every key counts as configured, answers echo the model."""
+
+    name = "fake"
+
+    def available(self, key_env: str = "GEMINI_API_KEY") -> bool:
+        return True
+
+    async def _generate(self, model: str, contents, key_env: str, **kwargs):
+        await asyncio.sleep(LLM_FAKE_LATENCY_MS / 1000)
+        prompt = contents if isinstance(contents, str) else " ".join(c for c in contents if isinstance(c, str))
+        first_line = prompt.strip().splitlines()[0] if prompt.strip() else ""
+        return _FakeResponse(f"[{model} (fake)] Response to: {first_line[:120]}")
+
+
+PROVIDERS = {
+    "gemini": GeminiProvider,
+    "fake": FakeProvider,
+}
+
+
+@lru_cache(maxsize=1)
+def get_provider() -> LLMProvider:
+    choice = os.getenv("LLM_PROVIDER", "gemini").lower()
+    if choice not in PROVIDERS:
+        logger.warning(f"Unknown LLM_PROVIDER={choice!r}; using gemini")
+        choice = "gemini"
+    return PROVIDERS[choice]()
@@ -2,13 +2,29 @@
 CardioSim AI — FastAPI Backend
 """
 import os
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+import medgemma_engine as engine
+import horde_client
+import llm_provider
+import guidance_cache
+import hedging
+import circuit_breaker
+import jobs
+import veo_poller
+import singleflight
+import rate_limiter
+import video_cache
+import render_farm
+import template_library
 from routes.analyze import router as analyze_router
 from routes.explain import router as explain_router
 from routes.mentor import router as mentor_router
 from routes.emergency import router as emergency_router
-from routes.video_generation import router as video_router
+from routes.video_generation import router as video_router, VIDEO_TEMPLATES
+from routes.jobs import router as jobs_router
 
 app = FastAPI(title="CardioSim AI API", version="2.2.0")
 
@@ -24,6 +40,34 @@ app.include_router(explain_router, prefix="/api")
 app.include_router(mentor_router, prefix="/api")
 app.include_router(emergency_router, prefix="/api")
 app.include_router(video_router, prefix="/api")
+app.include_router(jobs_router, prefix="/api")
+
+@app.on_event("startup")
+async def start_render_farm():
+    # Fork the render workers before the model loader starts, off the event loop
+    await asyncio.to_thread(render_farm.get_farm().start)
+
+
+@app.on_event("startup")
+async def prebuild_template_videos():
+    if template_library.VIDEO_PREBUILD_TEMPLATES:
+        template_library.start_prebuild(VIDEO_TEMPLATES)
+
+
+@app.on_event("startup")
+def load_model_in_background():
+    engine.start_background_load()
+
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    await jobs.video_jobs.aclose()
+    await horde_client.get_client().aclose()
+    await template_library.aclose()
+    # Waits for renders already running in the workers; keep the loop free meanwhile
+    await asyncio.to_thread(render_farm.get_farm().shutdown)
+    await asyncio.to_thread(video_cache.get_cache().flush)
+
 
 @app.get("/health")
 def health():
@@ -33,13 +77,37 @@ def health():
         "service": "CardioSim AI",
         "version": "2.2.0",
         "mock_mode": mock_mode,
-        "model_id": None if mock_mode else os.getenv("MEDGEMMA_MODEL_ID", "google/medgemma-4b-it"),
+        "model_id": None if mock_mode else engine.backend_info()["model_id"],
+        "backend": engine.backend_info(),
         "gemini_enabled": bool(os.getenv("GEMINI_API_KEY")),
         "genie_enabled": bool(os.getenv("GOOGLE_GENAI_API_KEY")),
         "video_generation_enabled": bool(os.getenv("VIDEO_GENERATION_ENABLED")),
+        "inference_queue": engine.stats(),
+        "result_cache": engine.cache_stats(),
+        "decode_stats": engine.decode_stats(),
+        "triage_prefilter": engine.prefilter_stats(),
+        "llm": llm_provider.get_provider().stats(),
+        "guidance_cache": guidance_cache.stats(),
+        "hedging": hedging.stats(),
+        "circuits": circuit_breaker.stats(),
+        "jobs": jobs.stats(),
+        "veo_poller": veo_poller.stats(),
+        "singleflight": singleflight.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "video_cache": video_cache.stats(),
+        "render_farm": render_farm.stats(),
+        "template_videos": template_library.stats(),
+        "model_status": engine.readiness()["status"],
     }
 
 
+@app.get("/ready")
+def ready():
+    """Readiness probe — 200 only once the model is loaded and warmed up."""
+    state = engine.readiness()
+    return JSONResponse(status_code=200 if state["status"] == "ready" else 503, content=state)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -1,13 +1,56 @@
 import os
 import re
+import copy
+import math
 import json
+import time
+import hashlib
+import queue
 import logging
-from functools import lru_cache
+import threading
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
 
 from schemas import ClinicalInput, DiagnosisOutput
+from ttl_cache import TTLCache
+import constrained_decoding
+import inference_backends
+import triage_scorer
 
 logger = logging.getLogger(__name__)
 
+# ─────────────────────────────────────────────
+#  Micro-batching settings (real inference only)
+# ─────────────────────────────────────────────
+MAX_BATCH_SIZE  = int(os.getenv("MEDGEMMA_MAX_BATCH_SIZE", "8"))
+BATCH_WINDOW_S  = float(os.getenv("MEDGEMMA_BATCH_WINDOW_MS", "25")) / 1000
+PREFIX_CACHE_ENABLED = os.getenv("MEDGEMMA_PREFIX_CACHE", "true").lower() == "true"
+CONSTRAINED_DECODING = os.getenv("MEDGEMMA_CONSTRAINED", "false").lower() == "true"
+MAX_QUEUE       = int(os.getenv("MEDGEMMA_MAX_QUEUE", "64"))
+REQUEST_TIMEOUT_S = float(os.getenv("MEDGEMMA_REQUEST_TIMEOUT_S", "120"))
+
+# ─────────────────────────────────────────────
+#  Result cache (real inference only)
+# ─────────────────────────────────────────────
+CACHE_SIZE      = int(os.getenv("MEDGEMMA_CACHE_SIZE", "1024"))     # 0 disables
+CACHE_TTL_S     = float(os.getenv("MEDGEMMA_CACHE_TTL_S", "3600"))
+CACHE_PATH      = os.getenv("MEDGEMMA_CACHE_PATH") or None        # e.g. cache/analyze.json
+TROPONIN_DECIMALS = int(os.getenv("MEDGEMMA_CACHE_TROPONIN_DECIMALS", "2"))
+
+# ─────────────────────────────────────────────
+#  Rule-based pre-filter (real inference only)
+# ─────────────────────────────────────────────
+PREFILTER_ENABLED   = os.getenv("MEDGEMMA_PREFILTER", "false").lower() == "true"
+PREFILTER_THRESHOLD = float(os.getenv("MEDGEMMA_PREFILTER_THRESHOLD", "0.9"))
+
+
+class EngineOverloaded(Exception):
+    """Raised by submit() when the inference queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"MedGemma inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
 # ─────────────────────────────────────────────
 #  Mock responses (offline / demo mode)
 # ─────────────────────────────────────────────
@@ -84,56 +127,26 @@ def _classify_mock(data: ClinicalInput) -> str:
     return "angina"
 
 
-@lru_cache(maxsize=1)
 def _load_model():
     """
-    Load MedGemma 4B-IT with 4-bit quantization.
-    Cached — only loads once per process.
-    Requires: transformers, accelerate, bitsandbytes, torch (GPU).
+    Load the model through the configured backend (see inference_backends.py).
+    A single attempt that raises on failure — ModelLoader owns caching and retries.
     """
-    try:
-        import torch
-        from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+    return inference_backends.get_backend().load()
 
-        model_id = os.getenv("MEDGEMMA_MODEL_ID", "google/medgemma-4b-it")
-        hf_token  = os.getenv("HF_TOKEN", None)
 
-        logger.info(f"Loading {model_id}...")
-
-        bnb_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_compute_dtype=torch.bfloat16,
-            bnb_4bit_use_double_quant=True,
-        )
-
-        tokenizer = AutoTokenizer.from_pretrained(model_id, token=hf_token)
-        model = AutoModelForCausalLM.from_pretrained(
-            model_id,
-            quantization_config=bnb_config,
-            device_map="auto",
-            torch_dtype=torch.bfloat16,
-            token=hf_token,
-            trust_remote_code=True,
-        )
-        model.eval()
-
-        vram_gb = torch.cuda.memory_allocated() / 1e9 if torch.cuda.is_available() else 0
-        logger.info(f"MedGemma loaded. VRAM used: {vram_gb:.1f} GB")
-        return tokenizer, model
-
-    except ImportError as e:
-        logger.warning(f"Cannot load MedGemma — missing dependency: {e}. Falling back to mock.")
-        return None
-    except Exception as e:
-        logger.error(f"Failed to load MedGemma: {e}. Falling back to mock.")
+def backend_info() -> dict:
+    """Backend, model id and quantisation serving real inference; None in mock mode."""
+    if os.getenv("MEDGEMMA_MOCK", "true").lower() == "true":
         return None
+    return inference_backends.get_backend().info()
 
 
-def _run_real_inference(data: ClinicalInput, tokenizer, model) -> DiagnosisOutput:
-    """Run actual MedGemma inference."""
-    import torch
+def _kv_reuse_supported() -> bool:
+    return inference_backends.get_backend().supports_kv_reuse
 
+
+def _build_messages(data: ClinicalInput) -> list:
     user_content = (
         f"Clinical Presentation for Cardiac Triage:\n"
         f"- Patient age: {data.age} years\n"
@@ -144,29 +157,14 @@ def _run_real_inference(data: ClinicalInput, tokenizer, model) -> DiagnosisOutpu
         f"- Risk factors: {', '.join(data.risk_factors or [])}\n\n"
         f"Provide your diagnostic assessment as JSON:"
     )
-
-    messages = [
+    return [
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user",   "content": user_content},
     ]
 
-    input_ids = tokenizer.apply_chat_template(
-        messages, return_tensors="pt", add_generation_prompt=True
-    ).to(model.device)
-
-    with torch.no_grad():
-        output_ids = model.generate(
-            input_ids,
-            max_new_tokens=512,
-            do_sample=False,
-            temperature=1.0,
-            pad_token_id=tokenizer.eos_token_id,
-        )
-
-    new_tokens = output_ids[0][input_ids.shape[-1]:]
-    raw = tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
-    logger.debug(f"MedGemma raw output: {raw}")
 
+def _parse_output(raw: str) -> DiagnosisOutput:
+    """Extract and normalise the JSON object from a raw MedGemma completion."""
     match = re.search(r'\{[\s\S]*\}', raw)
     if not match:
         raise ValueError("No JSON in MedGemma response")
@@ -181,29 +179,812 @@ def _run_real_inference(data: ClinicalInput, tokenizer, model) -> DiagnosisOutpu
     return DiagnosisOutput(**{k: v for k, v in obj.items() if k != '_model'})
 
 
-def infer(data: ClinicalInput) -> DiagnosisOutput:
+class _FirstTokenTimer:
+    """Minimal generate() streamer that only records time-to-first-token."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self._seen_prompt = False
+
+    def put(self, value):
+        # generate() pushes the prompt first, then each decoded step
+        if not self._seen_prompt:
+            self._seen_prompt = True
+        elif self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def end(self):
+        pass
+
+    @property
+    def ttft_s(self):
+        if self.first_token_at is None:
+            return None
+        return round(self.first_token_at - self.started, 3)
+
+
+class _TextStreamer(_FirstTokenTimer):
+    """Also decodes the single generated sequence incrementally and hands each text delta to `on_text`."""
+
+    def __init__(self, tokenizer, on_text):
+        super().__init__()
+        self.tokenizer = tokenizer
+        self.on_text = on_text
+        self._token_ids = []
+        self._emitted = 0
+
+    def put(self, value):
+        prompt = not self._seen_prompt
+        super().put(value)
+        if prompt:
+            return
+        self._token_ids.extend(value.reshape(-1).tolist())
+        text = self.tokenizer.decode(self._token_ids, skip_special_tokens=True)
+        # Hold back a trailing replacement char: a multi-byte character is still being assembled
+        if text.endswith("\ufffd"):
+            return
+        if len(text) > self._emitted:
+            self.on_text(text[self._emitted:])
+            self._emitted = len(text)
+
+
+class PartialJsonFieldParser:
     """
-    Main entry point.
-    - MEDGEMMA_MOCK=true  (default): instant mock response for demos
-    - MEDGEMMA_MOCK=false           : real MedGemma 4B-IT inference (requires GPU)
+    Consumes a JSON object as it streams in and yields each top-level
+    DiagnosisOutput field as soon as its value is complete.
     """
-    use_mock = os.getenv("MEDGEMMA_MOCK", "true").lower() == "true"
 
-    if not use_mock:
-        loaded = _load_model()
-        if loaded:
-            tokenizer, model = loaded
+    _FIELD = re.compile(
+        r'"(\w+)"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?=\s*[,}]))'
+    )
+
+    def __init__(self):
+        self.buffer = ""
+        self.fields = {}
+
+    def feed(self, chunk: str) -> List[Tuple[str, object]]:
+        self.buffer += chunk
+        closed = []
+        for match in self._FIELD.finditer(self.buffer):
+            key = match.group(1)
+            if key in self.fields or key not in DiagnosisOutput.model_fields:
+                continue
             try:
-                result = _run_real_inference(data, tokenizer, model)
-                logger.info(
-                    f"Real MedGemma inference: {result.diagnosis} "
-                    f"[{result.artery_id}, {result.urgency}] conf={result.confidence:.2f}"
-                )
-                return result
-            except Exception as e:
-                logger.error(f"Real inference failed: {e}. Falling back to mock.")
+                value = json.loads(match.group(2))
+            except ValueError:
+                continue
+            if key == "artery_id":
+                value = str(value).upper().strip()
+                if value not in ("LAD", "RCA", "LCX"):
+                    value = "LAD"
+            elif key == "confidence":
+                value = float(value)
+            self.fields[key] = value
+            closed.append((key, value))
+        return closed
 
-    # Mock path
+
+class _PrefixCache:
+    """
+    past_key_values for the part of the chat template that never changes
+    (system prompt + the fixed head of the user turn). Cloned per request so
+    prefill only has to cover the patient-specific suffix.
+    """
+
+    def __init__(self, tokenizer, model):
+        import torch
+
+        # Two probes that differ only in patient data: their common token prefix is the constant part
+        probes = [
+            ClinicalInput(chest_pain_duration=0, ecg_findings="", troponin_level=0.0, age=age)
+            for age in (1, 2)
+        ]
+        a, b = (
+            tokenizer(
+                tokenizer.apply_chat_template(_build_messages(p), tokenize=False, add_generation_prompt=True),
+                add_special_tokens=False,
+            )["input_ids"]
+            for p in probes
+        )
+        n = 0
+        while n < min(len(a), len(b)) and a[n] == b[n]:
+            n += 1
+
+        self.length = n
+        self.ids = torch.tensor([a[:n]], device=model.device)
+        t0 = time.perf_counter()
+        with torch.no_grad():
+            self.past_key_values = model(input_ids=self.ids, use_cache=True).past_key_values
+        logger.info(f"Prefix KV cache built: {n} tokens in {time.perf_counter() - t0:.2f}s")
+
+    def matches(self, input_ids) -> bool:
+        import torch
+        row = input_ids[0]
+        return row.shape[-1] > self.length and torch.equal(row[:self.length], self.ids[0])
+
+    def clone(self):
+        return copy.deepcopy(self.past_key_values)
+
+
+def _get_prefix_cache():
+    return _loader.prefix_cache
+
+
+class DecodeStats:
+    """Per-mode decode counters so free-form and constrained decoding can be compared."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._modes = {}
+
+    def record(self, mode: str, tokens: int, parsed: bool):
+        with self._lock:
+            m = self._modes.setdefault(mode, {"requests": 0, "parse_failures": 0, "tokens_generated": 0})
+            m["requests"] += 1
+            m["tokens_generated"] += tokens
+            if not parsed:
+                m["parse_failures"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                mode: {
+                    **m,
+                    "parse_failure_rate": round(m["parse_failures"] / m["requests"], 3),
+                    "avg_tokens_generated": round(m["tokens_generated"] / m["requests"], 1),
+                }
+                for mode, m in self._modes.items()
+            }
+
+
+_decode_stats = DecodeStats()
+
+
+def _parse_row(raw: str, mode: str, tokens: int, record_stats: bool = True):
+    logger.debug(f"MedGemma raw output ({mode}): {raw}")
+    try:
+        result = _parse_output(raw)
+    except Exception as e:
+        if record_stats:
+            _decode_stats.record(mode, tokens, parsed=False)
+        return e
+    if record_stats:
+        _decode_stats.record(mode, tokens, parsed=True)
+    return result
+
+
+def _run_real_inference_batch(
+    batch: List[ClinicalInput], tokenizer, model, max_new_tokens: int = 512, on_text=None,
+    constrained: bool = None, record_stats: bool = True,
+) -> Tuple[list, dict]:
+    """
+    Run MedGemma over several cases in one left-padded generate() call.
+    Returns one DiagnosisOutput or Exception per input (in input order) plus
+    batch-level timing info. `on_text` (single-case batches only) receives
+    decoded text deltas as they are generated.
+    With constrained decoding each case is decoded on its own against the
+    DiagnosisOutput skeleton instead (see constrained_decoding.py).
+    `record_stats=False` keeps the call out of decode_stats() (warm-up).
+    """
+    import torch
+
+    if constrained is None:
+        constrained = CONSTRAINED_DECODING and _kv_reuse_supported()
+
+    prompts = [
+        tokenizer.apply_chat_template(_build_messages(d), tokenize=False, add_generation_prompt=True)
+        for d in batch
+    ]
+
+    # Decoder-only models must be padded on the left so every row ends at the prompt boundary
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    if constrained:
+        return _run_constrained(prompts, tokenizer, model, on_text, record_stats)
+
+    # The chat template already emits <bos>
+    encoded = tokenizer(
+        prompts, return_tensors="pt", padding=True, add_special_tokens=False
+    ).to(model.device)
+
+    timer = _TextStreamer(tokenizer, on_text) if on_text else _FirstTokenTimer()
+    gen_kwargs = dict(
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        temperature=1.0,
+        pad_token_id=tokenizer.pad_token_id,
+        streamer=timer,
+    )
+
+    # Left padding shifts the shared prefix per row, so the cached prefix only applies to single-case batches
+    prefix_cached = False
+    if PREFIX_CACHE_ENABLED and len(batch) == 1 and _kv_reuse_supported():
+        prefix = _get_prefix_cache()
+        if prefix is not None and prefix.matches(encoded["input_ids"]):
+            gen_kwargs["past_key_values"] = prefix.clone()
+            prefix_cached = True
+
+    with torch.no_grad():
+        output_ids = model.generate(**encoded, **gen_kwargs)
+
+    prompt_len = encoded["input_ids"].shape[-1]
+    results, tokens = [], []
+    for row in output_ids:
+        new_tokens = row[prompt_len:]
+        n = int((new_tokens != tokenizer.pad_token_id).sum())
+        raw = tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+        tokens.append(n)
+        results.append(_parse_row(raw, "free", n, record_stats))
+    return results, {
+        "prefix_cached": prefix_cached,
+        "ttft_s": timer.ttft_s,
+        "constrained": False,
+        "tokens_generated": tokens,
+    }
+
+
+def _run_constrained(prompts: List[str], tokenizer, model, on_text=None,
+                     record_stats: bool = True) -> Tuple[list, dict]:
+    decoder = constrained_decoding.get_decoder(tokenizer)
+    prefix = _get_prefix_cache() if PREFIX_CACHE_ENABLED else None
+
+    results, tokens = [], []
+    prefix_cached = False
+    started = time.perf_counter()
+    ttft = None
+
+    def on_piece(text):
+        nonlocal ttft
+        if ttft is None:
+            ttft = round(time.perf_counter() - started, 3)
+        if on_text:
+            on_text(text)
+
+    for prompt in prompts:
+        input_ids = tokenizer(prompt, return_tensors="pt", add_special_tokens=False)["input_ids"].to(model.device)
+        past = None
+        if prefix is not None and prefix.matches(input_ids):
+            past = prefix.clone()
+            prefix_cached = True
+        raw, n = decoder.decode(model, input_ids, past_key_values=past, on_text=on_piece)
+        tokens.append(n)
+        results.append(_parse_row(raw, "constrained", n, record_stats))
+
+    return results, {
+        "prefix_cached": prefix_cached,
+        "ttft_s": ttft,
+        "constrained": True,
+        "tokens_generated": tokens,
+    }
+
+
+def _run_real_inference(data: ClinicalInput, tokenizer, model) -> DiagnosisOutput:
+    """Run actual MedGemma inference for a single case."""
+    result = _run_real_inference_batch([data], tokenizer, model)[0][0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def _mock_infer(data: ClinicalInput) -> DiagnosisOutput:
     key = _classify_mock(data)
     logger.info(f"Mock inference: key={key}")
     return MOCK_RESPONSES[key]
+
+
+def _rule_based(batch: List[ClinicalInput], scores: "triage_scorer.TriageScores" = None) -> List[DiagnosisOutput]:
+    """Deterministic diagnoses from triage_scorer, worded like the mock responses."""
+    if scores is None:
+        scores = triage_scorer.score_cases(batch)
+    outputs = []
+    for i in range(len(batch)):
+        row = scores.row(i)
+        template = MOCK_RESPONSES[row["class"]]
+        points = ", ".join(f"{k} {v}" for k, v in row["components"].items())
+        artery = row["artery_id"]
+        outputs.append(DiagnosisOutput(
+            diagnosis=template.diagnosis,
+            affected_region=triage_scorer.ARTERY_NAMES[artery],
+            artery_id=artery,
+            urgency=row["urgency"],
+            recommended_intervention=template.recommended_intervention,
+            reasoning=(
+                f"Rule-based triage: HEART score {row['heart_score']}/10 ({points}). "
+                f"ECG lead territory points to the {artery} (p={row['artery_probs'][artery]:.2f}); "
+                f"{row['class']} probability {row['class_probs'][row['class']]:.2f}. "
+                "MedGemma was not consulted for this case."
+            ),
+            confidence=row["confidence"],
+        ))
+    return outputs
+
+
+def _infer_batch(batch: List[ClinicalInput], on_text=None) -> Tuple[List[DiagnosisOutput], List[bool], dict]:
+    """
+    Real inference for a batch, falling back to the rule-based scorer per case on failure
+    or while the model is still loading. Returns outputs, a per-case flag telling whether the fallback was used, and batch info.
+    """
+    results = [None] * len(batch)
+    info = {"prefix_cached": False, "ttft_s": None, "constrained": False, "tokens_generated": [None] * len(batch)}
+
+    # Never wait for the loader here: this runs on the single batch worker, and
+    # blocking it would hold every queued request until the model is ready
+    loaded = _loader.get(timeout=0)
+    if loaded:
+        tokenizer, model = loaded
+        try:
+            outputs, info = _run_real_inference_batch(batch, tokenizer, model, on_text=on_text)
+        except Exception as e:
+            outputs = [e] * len(batch)
+        for i, out in enumerate(outputs):
+            if isinstance(out, Exception):
+                logger.error(f"Real inference failed: {out}. Falling back to rule-based triage.")
+                continue
+            logger.info(
+                f"Real MedGemma inference: {out.diagnosis} "
+                f"[{out.artery_id}, {out.urgency}] conf={out.confidence:.2f}"
+            )
+            results[i] = out
+
+    fallbacks = [r is None for r in results]
+    if any(fallbacks):
+        missing = [d for d, fb in zip(batch, fallbacks) if fb]
+        fallback_outputs = iter(_rule_based(missing))
+        results = [r if r is not None else next(fallback_outputs) for r in results]
+    return results, fallbacks, info
+
+
+# ─────────────────────────────────────────────
+#  Model lifecycle: background load, warm-up, retry
+# ─────────────────────────────────────────────
+LOAD_RETRY_BASE_S = float(os.getenv("MEDGEMMA_LOAD_RETRY_BASE_S", "5"))
+LOAD_RETRY_MAX_S  = float(os.getenv("MEDGEMMA_LOAD_RETRY_MAX_S", "300"))
+
+WARMUP_CASE = ClinicalInput(
+    chest_pain_duration=90,
+    ecg_findings="ST elevation V1-V4",
+    troponin_level=3.2,
+    age=58,
+    risk_factors=["hypertension", "smoker"],
+    symptoms="Crushing central chest pain radiating to left arm",
+)
+
+
+def _memory_used_gb() -> float:
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return torch.cuda.memory_allocated() / 1e9
+    except ImportError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e6   # KiB on Linux
+
+
+class ModelLoader:
+    """
+    Loads the model on a background thread, builds the prefix KV cache and runs
+    one short warm-up generation so kernels are compiled before real traffic.
+    Transient failures are retried with capped exponential backoff; a missing
+    dependency is permanent.
+
+    status: idle → loading → warming → ready
+                       ↘ failed (→ loading again after backoff)
+    """
+
+    def __init__(self):
+        self.status = "idle"
+        self.attempts = 0
+        self.last_error = None
+        self.load_duration_s = None
+        self.memory_gb = None
+        self.next_retry_at = None
+        self.prefix_cache = None
+        self._loaded = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._settled = threading.Condition(self._lock)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="medgemma-loader", daemon=True)
+            self._thread.start()
+
+    def get(self, timeout: float = None):
+        """Return (tokenizer, model) once ready; None if loading failed or timed out."""
+        self.start()
+        with self._settled:
+            self._settled.wait_for(lambda: self.status in ("ready", "failed"), timeout=timeout)
+            return self._loaded if self.status == "ready" else None
+
+    def _set(self, status: str):
+        with self._settled:
+            self.status = status
+            self._settled.notify_all()
+
+    def _run(self):
+        delay = LOAD_RETRY_BASE_S
+        while True:
+            self.attempts += 1
+            self._set("loading")
+            t0 = time.perf_counter()
+            try:
+                tokenizer, model = _load_model()
+                self._set("warming")
+                if PREFIX_CACHE_ENABLED and _kv_reuse_supported():
+                    try:
+                        self.prefix_cache = _PrefixCache(tokenizer, model)
+                    except Exception as e:
+                        logger.warning(f"Could not build prefix KV cache: {e}. Using cold prefill.")
+                if CONSTRAINED_DECODING and _kv_reuse_supported():
+                    constrained_decoding.get_decoder(tokenizer)   # builds the vocabulary masks
+                # 8 tokens never parse; keep the warm-up out of the constrained-vs-free comparison
+                _run_real_inference_batch([WARMUP_CASE], tokenizer, model, max_new_tokens=8,
+                                          constrained=False, record_stats=False)
+
+                self.load_duration_s = round(time.perf_counter() - t0, 2)
+                self.memory_gb = round(_memory_used_gb(), 2)
+                self.last_error = None
+                self.next_retry_at = None
+                self._loaded = (tokenizer, model)
+                self._set("ready")
+                logger.info(f"MedGemma ready in {self.load_duration_s}s ({self.memory_gb} GB)")
+                return
+            except ImportError as e:
+                self.last_error = f"missing dependency: {e}"
+                self._set("failed")
+                logger.warning(f"Cannot load MedGemma — {self.last_error}. Falling back to rule-based triage.")
+                return
+            except Exception as e:
+                self.last_error = str(e)
+                self.next_retry_at = time.time() + delay
+                self._set("failed")
+                logger.error(f"Failed to load MedGemma: {e}. Retrying in {delay:.0f}s; rule-based triage until then.")
+                time.sleep(delay)
+                delay = min(delay * 2, LOAD_RETRY_MAX_S)
+
+    def state(self) -> dict:
+        return {
+            "status": self.status,
+            "attempts": self.attempts,
+            "load_duration_s": self.load_duration_s,
+            "memory_gb": self.memory_gb,
+            "last_error": self.last_error,
+            "next_retry_at": (
+                time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.next_retry_at))
+                if self.next_retry_at else None
+            ),
+        }
+
+
+_loader = ModelLoader()
+
+
+def start_background_load():
+    """Kick off model loading + warm-up (no-op in mock mode)."""
+    if os.getenv("MEDGEMMA_MOCK", "true").lower() != "true":
+        _loader.start()
+
+
+def readiness() -> dict:
+    if os.getenv("MEDGEMMA_MOCK", "true").lower() == "true":
+        return {"status": "ready", "mock_mode": True}
+    return {"mock_mode": False, **_loader.state()}
+
+
+# ─────────────────────────────────────────────
+#  Micro-batching scheduler
+# ─────────────────────────────────────────────
+class _Pending:
+    __slots__ = ("data", "future", "enqueued_at", "deadline", "on_result", "on_text")
+
+    def __init__(self, data: ClinicalInput, timeout_s: float, on_result=None, on_text=None):
+        self.data = data
+        self.on_result = on_result
+        self.on_text = on_text
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.deadline = self.enqueued_at + timeout_s
+
+
+class BatchScheduler:
+    """
+    Collects concurrent requests for up to `window_s` (or until `max_batch_size`
+    are waiting) and decodes them together on a single worker thread.
+    Each future resolves to (DiagnosisOutput, meta).
+
+    At most `max_queue` requests may be outstanding (queued or decoding); a slot
+    is released as soon as its future completes or is cancelled, so callers that
+    disconnect free capacity immediately. Requests still queued past their
+    deadline are failed with TimeoutError instead of being decoded.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        window_s: float = BATCH_WINDOW_S,
+        max_queue: int = MAX_QUEUE,
+    ):
+        self.max_batch_size = max(1, max_batch_size)
+        self.window_s = max(0.0, window_s)
+        self.max_queue = max(1, max_queue)
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self._avg_batch_s = 20.0   # EWMA of batch decode time, seeds Retry-After
+
+    def submit(
+        self, data: ClinicalInput, timeout_s: float = REQUEST_TIMEOUT_S, on_result=None, on_text=None
+    ) -> Future:
+        """
+        `on_result(output, meta)` runs on the worker thread before the future resolves.
+        Requests with `on_text` are streamed, so they are decoded in a batch of their own.
+        """
+        with self._lock:
+            if self._outstanding >= self.max_queue:
+                raise EngineOverloaded(self.retry_after())
+            self._outstanding += 1
+
+        pending = _Pending(data, timeout_s, on_result, on_text)
+        pending.future.add_done_callback(self._release)
+        self._ensure_worker()
+        self._queue.put(pending)
+        return pending.future
+
+    def _release(self, _future: Future):
+        with self._lock:
+            self._outstanding -= 1
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog is expected to drain."""
+        batches_ahead = self._outstanding / self.max_batch_size
+        return max(1, math.ceil(batches_ahead * self._avg_batch_s))
+
+    def stats(self) -> dict:
+        return {
+            "outstanding": self._outstanding,
+            "max_queue": self.max_queue,
+            "max_batch_size": self.max_batch_size,
+            "batch_window_ms": round(self.window_s * 1000),
+            "avg_batch_s": round(self._avg_batch_s, 2),
+        }
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="medgemma-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def _collect(self) -> List[_Pending]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            collected = self._collect()
+            # _collect() blocks until work arrives, so read the clock afterwards
+            now = time.perf_counter()
+            batch = []
+            for p in collected:
+                # Drop requests whose callers already gave up
+                if not p.future.set_running_or_notify_cancel():
+                    continue
+                if now > p.deadline:
+                    p.future.set_exception(TimeoutError("Request expired while queued"))
+                    continue
+                batch.append(p)
+            if not batch:
+                continue
+
+            # Streamed requests go first, one per generate() call; the rest share one
+            for p in batch:
+                if p.on_text:
+                    self._decode([p])
+            rest = [p for p in batch if not p.on_text]
+            if rest:
+                self._decode(rest)
+
+    def _decode(self, batch: List[_Pending]):
+        started = time.perf_counter()
+        on_text = batch[0].on_text if len(batch) == 1 else None
+        try:
+            outputs, fallbacks, info = _infer_batch([p.data for p in batch], on_text=on_text)
+        except Exception as e:
+            logger.error(f"Batch inference crashed: {e}", exc_info=True)
+            for p in batch:
+                p.future.set_exception(e)
+            return
+
+        took = time.perf_counter() - started
+        self._avg_batch_s = 0.8 * self._avg_batch_s + 0.2 * took
+        tokens = info.pop("tokens_generated", None) or [None] * len(batch)
+        generated = sum(n for n in tokens if n)
+        tokens_per_s = round(generated / took, 1) if generated and took > 0 else None
+        logger.info(
+            f"MedGemma batch of {len(batch)} done in {took:.2f}s "
+            f"(ttft={info['ttft_s']}s, prefix_cached={info['prefix_cached']})"
+        )
+        for p, out, fallback, n in zip(batch, outputs, fallbacks, tokens):
+            meta = {
+                "queue_wait_s": round(started - p.enqueued_at, 3),
+                "batch_size": len(batch),
+                "rule_based_fallback": fallback,
+                "tokens_generated": n,
+                "tokens_per_s": tokens_per_s,
+                **info,
+            }
+            if p.on_result:
+                try:
+                    p.on_result(out, meta)
+                except Exception as e:
+                    logger.warning(f"on_result hook failed: {e}")
+            p.future.set_result((out, meta))
+
+
+_scheduler = BatchScheduler()
+_result_cache = TTLCache(max_entries=CACHE_SIZE, ttl_s=CACHE_TTL_S, persist_path=CACHE_PATH)
+
+
+def canonical_key(data: ClinicalInput) -> str:
+    """
+    Content address for a case. Inputs that differ only in risk-factor order/case,
+    ECG/symptom whitespace or troponin noise below TROPONIN_DECIMALS share a key.
+    """
+    canon = {
+        "model": inference_backends.get_backend().model_id,
+        "age": data.age,
+        "chest_pain_duration": data.chest_pain_duration,
+        "ecg_findings": " ".join((data.ecg_findings or "").split()),
+        "troponin_level": round(data.troponin_level or 0.0, TROPONIN_DECIMALS),
+        "risk_factors": sorted({r.strip().lower() for r in data.risk_factors or [] if r.strip()}),
+        "symptoms": " ".join((data.symptoms or "").split()),
+    }
+    return hashlib.sha256(json.dumps(canon, sort_keys=True).encode()).hexdigest()
+
+
+def _store_result(key: str, result: DiagnosisOutput, meta: dict):
+    # Never pin a rule-based fallback in place of a real answer
+    if not meta.get("rule_based_fallback"):
+        _result_cache.set(key, result.model_dump())
+
+
+class _PrefilterStats:
+    def __init__(self):
+        self.scored = 0
+        self.answered = 0
+        self._lock = threading.Lock()
+
+    def record(self, scored: int, answered: int):
+        with self._lock:
+            self.scored += scored
+            self.answered += answered
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": PREFILTER_ENABLED,
+            "threshold": PREFILTER_THRESHOLD,
+            "scored": self.scored,
+            "answered": self.answered,
+            "answered_ratio": round(self.answered / self.scored, 3) if self.scored else None,
+        }
+
+
+_prefilter_stats = _PrefilterStats()
+
+
+def prefilter(cases: List[ClinicalInput]) -> List[Optional[Tuple[DiagnosisOutput, dict]]]:
+    """
+    Score all cases in one vectorised pass and answer the unambiguous ones
+    (triage confidence >= MEDGEMMA_PREFILTER_THRESHOLD) without MedGemma.
+    Returns one (DiagnosisOutput, meta) per case, or None where the model is
+    still needed. All None when the pre-filter is off or in mock mode.
+    """
+    use_mock = os.getenv("MEDGEMMA_MOCK", "true").lower() == "true"
+    if not PREFILTER_ENABLED or use_mock or not cases:
+        return [None] * len(cases)
+
+    scores = triage_scorer.score_cases(cases)
+    confident = scores.confidence >= PREFILTER_THRESHOLD
+    picked = [i for i in range(len(cases)) if confident[i]]
+    answers = [None] * len(cases)
+    outputs = _rule_based([cases[i] for i in picked], scores.subset(picked))
+    for i, out in zip(picked, outputs):
+        answers[i] = (out, {"queue_wait_s": 0.0, "batch_size": None, "prefiltered": True})
+    _prefilter_stats.record(len(cases), len(picked))
+    return answers
+
+
+def submit(
+    data: ClinicalInput,
+    timeout_s: float = REQUEST_TIMEOUT_S,
+    on_text=None,
+    use_prefilter: bool = True,
+) -> Future:
+    """
+    Non-blocking entry point. The returned future resolves to (DiagnosisOutput, meta),
+    where meta carries `queue_wait_s`, `batch_size` and, for real inference,
+    `prefix_cached` / `ttft_s` / `rule_based_fallback` — or `cache_hit` when served
+    from the result cache, or `prefiltered` when the rule-based scorer was
+    confident enough to answer without MedGemma (pass use_prefilter=False
+    when the caller already ran prefilter() over the case).
+    `on_text(delta)` is called from the worker thread with raw model text as it
+    is generated (real inference only; cache hits and mock never call it).
+    - MEDGEMMA_MOCK=true  (default): resolved immediately with a mock response
+    - MEDGEMMA_MOCK=false           : queued for batched MedGemma 4B-IT inference (requires GPU)
+    Raises EngineOverloaded when the queue is full.
+    """
+    use_mock = os.getenv("MEDGEMMA_MOCK", "true").lower() == "true"
+
+    if not use_mock:
+        key = canonical_key(data)
+        cached = _result_cache.get(key)
+        if cached is not None:
+            future: Future = Future()
+            future.set_result((DiagnosisOutput(**cached), {
+                "queue_wait_s": 0.0, "batch_size": None, "cache_hit": True,
+            }))
+            return future
+
+        if use_prefilter:
+            answer = prefilter([data])[0]
+            if answer is not None:
+                future = Future()
+                future.set_result(answer)
+                return future
+
+        return _scheduler.submit(
+            data, timeout_s,
+            on_result=lambda result, meta: _store_result(key, result, meta),
+            on_text=on_text,
+        )
+
+    future: Future = Future()
+    future.set_result((_mock_infer(data), {"queue_wait_s": 0.0, "batch_size": 1}))
+    return future
+
+
+def stats() -> dict:
+    return _scheduler.stats()
+
+
+def cache_stats() -> dict:
+    return _result_cache.stats()
+
+
+def decode_stats() -> dict:
+    return _decode_stats.snapshot()
+
+
+def prefilter_stats() -> dict:
+    return _prefilter_stats.snapshot()
+
+
+def infer_with_meta(data: ClinicalInput) -> Tuple[DiagnosisOutput, dict]:
+    """Blocking variant of submit()."""
+    return submit(data).result()
+
+
+def infer(data: ClinicalInput) -> DiagnosisOutput:
+    """
+    Main blocking entry point.
+    - MEDGEMMA_MOCK=true  (default): instant mock response for demos
+    - MEDGEMMA_MOCK=false           : real MedGemma 4B-IT inference (requires GPU)
+    """
+    return infer_with_meta(data)[0]
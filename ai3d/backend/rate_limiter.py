@@ -0,0 +1,243 @@
+"""
+Priority-aware token-bucket scheduler for outbound AI calls.
+
+Each upstream quota (gemini, gemini_image, veo, huggingface, horde — the same
+names as the circuit breakers) has a token bucket refilled at RL_<NAME>_RPS
+up to RL_<NAME>_BURST. Callers acquire a token before calling out and state
+their priority class:
+
+    emergency > guidance (mentor/explain) > technique (analyze-technique) > video
+
+Waiters are served strictly by class, then arrival order, and every class but
+emergency leaves RL_<NAME>_RESERVE tokens untouched, so a burst of video
+frames can never drain the bucket that /api/emergency needs. Each class has a
+queue-time limit (RL_MAX_WAIT_<CLASS>_S); past it acquire() raises
+RateLimited and the route uses its fallback instead of waiting longer.
+
+Gemini quotas are per API key, so those calls use one bucket per (provider,
+API key) — see llm_provider.py — shared by every call class on that key.
+
+A 429 from upstream pauses the bucket for the server's Retry-After, or an
+exponential backoff when none is given (RL_BACKOFF_S doubling up to
+RL_BACKOFF_MAX_S).
+"""
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = {"emergency": 0, "guidance": 1, "technique": 2, "video": 3}
+
+_DEFAULT_MAX_WAIT_S = {"emergency": 5, "guidance": 10, "technique": 15, "video": 60}
+MAX_WAIT_S = {
+    cls: float(os.getenv(f"RL_MAX_WAIT_{cls.upper()}_S", default))
+    for cls, default in _DEFAULT_MAX_WAIT_S.items()
+}
+
+BACKOFF_S     = float(os.getenv("RL_BACKOFF_S", "2"))
+BACKOFF_MAX_S = float(os.getenv("RL_BACKOFF_MAX_S", "60"))
+
+# (requests per second, burst, tokens reserved for emergency)
+_DEFAULT_LIMITS = {
+    "gemini": (1.0, 5, 1),
+    "gemini_image": (0.2, 2, 0),
+    "veo": (0.05, 2, 0),
+    "huggingface": (0.5, 2, 0),
+    "horde": (2.0, 10, 0),
+}
+
+
+class RateLimited(Exception):
+    """Raised when a caller's queue-time limit passes before a token is free."""
+
+    def __init__(self, bucket: str, priority: str, waited_s: float):
+        super().__init__(f"{bucket} rate limit: no {priority} slot within {waited_s:.1f}s")
+        self.bucket = bucket
+        self.priority = priority
+        self.waited_s = waited_s
+
+
+class _ClassStats:
+    def __init__(self, window: int = 200):
+        self.granted = 0
+        self.rejected = 0
+        self.waits = deque(maxlen=window)
+
+    def snapshot(self) -> dict:
+        waits = sorted(self.waits)
+        return {
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "wait_p50_s": round(waits[len(waits) // 2], 3) if waits else None,
+            "wait_p95_s": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else None,
+            "wait_max_s": round(waits[-1], 3) if waits else None,
+        }
+
+
+class TokenBucket:
+    def __init__(self, name: str, rate: float, burst: int, reserve: int = 0, kind: str = None):
+        self.name = name
+        env = (kind or name).upper()
+        self.rate = float(os.getenv(f"RL_{env}_RPS", rate))
+        self.burst = int(os.getenv(f"RL_{env}_BURST", burst))
+        self.reserve = int(os.getenv(f"RL_{env}_RESERVE", reserve))
+        self.tokens = float(self.burst)
+        self.throttled = 0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._backoff_s = 0.0
+        self._last_throttle = 0.0
+        self._waiters = []              # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._timer = None
+        self._class_stats = {cls: _ClassStats() for cls in PRIORITIES}
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _needed(self, priority: int) -> float:
+        return 1.0 + (0 if priority == 0 else self.reserve)
+
+    def _try_take(self, priority: int, now: float) -> bool:
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= self._needed(priority):
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self, priority: str = "video", max_wait_s: Optional[float] = None):
+        """Wait for a token. Raises RateLimited once `max_wait_s` (default: the class limit) passes."""
+        rank = PRIORITIES[priority]
+        stats = self._class_stats[priority]
+        started = time.monotonic()
+        if not self._waiters and self._try_take(rank, started):
+            stats.granted += 1
+            stats.waits.append(0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (rank, next(self._seq), future))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, MAX_WAIT_S[priority] if max_wait_s is None else max_wait_s)
+        except asyncio.TimeoutError:
+            stats.rejected += 1
+            waited = time.monotonic() - started
+            logger.warning(f"[RateLimit:{self.name}] {priority} call gave up after {waited:.1f}s in queue")
+            raise RateLimited(self.name, priority, waited)
+        finally:
+            # A timed-out or cancelled waiter leaves a dead entry behind; let the queue move on
+            if not future.done() or future.cancelled():
+                self._dispatch()
+        waited = time.monotonic() - started
+        stats.granted += 1
+        stats.waits.append(waited)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            rank, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._try_take(rank, now):
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(None)
+
+        # Wake up again when the front waiter can be served
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        if self._waiters:
+            rank = self._waiters[0][0]
+            if now < self._paused_until:
+                delay = self._paused_until - now
+            else:
+                delay = max(0.0, (self._needed(rank) - self.tokens) / self.rate) if self.rate > 0 else 1.0
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def throttle(self, retry_after_s: Optional[float] = None):
+        """Upstream answered 429: stop handing out tokens for a while."""
+        now = time.monotonic()
+        if retry_after_s is None:
+            # Back-to-back 429s double the pause; a quiet minute resets it
+            if now - self._last_throttle > 60 or not self._backoff_s:
+                self._backoff_s = BACKOFF_S
+            else:
+                self._backoff_s = min(BACKOFF_MAX_S, self._backoff_s * 2)
+            retry_after_s = self._backoff_s
+        self._last_throttle = now
+        self._paused_until = max(self._paused_until, now + retry_after_s)
+        self.tokens = 0.0
+        self._updated = now
+        self.throttled += 1
+        logger.warning(f"[RateLimit:{self.name}] Upstream 429, pausing for {retry_after_s:.1f}s")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "rate_per_s": self.rate,
+            "burst": self.burst,
+            "reserve": self.reserve,
+            "tokens": round(self.tokens, 2),
+            "queued": sum(1 for _, _, f in self._waiters if not f.done()),
+            "throttled": self.throttled,
+            "paused_for_s": round(max(0.0, self._paused_until - now), 1),
+            "classes": {cls: s.snapshot() for cls, s in self._class_stats.items()},
+        }
+
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    """Whether an upstream exception is an HTTP 429 / quota-exhausted error."""
+    if getattr(e, "code", None) == 429:
+        return True
+    response = getattr(e, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+    return type(e).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+def retry_after(source) -> Optional[float]:
+    """Retry-After seconds from an HTTP response or an exception carrying one, if present."""
+    response = getattr(source, "response", source)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+_buckets = {}
+
+
+def get(name: str, kind: str = None) -> TokenBucket:
+    """
+    The bucket called `name`. `kind` (default: name) picks the limits from
+    _DEFAULT_LIMITS and RL_<KIND>_*, so one quota per API key can share a
+    provider's settings.
+    """
+    bucket = _buckets.get(name)
+    if bucket is None:
+        bucket = _buckets[name] = TokenBucket(name, *_DEFAULT_LIMITS.get(kind or name, (1.0, 5, 0)), kind=kind)
+    return bucket
+
+
+async def acquire(name: str, priority: str = "video"):
+    await get(name).acquire(priority)
+
+
+def stats() -> dict:
+    return {name: bucket.stats() for name, bucket in _buckets.items()}
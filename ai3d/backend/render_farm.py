@@ -0,0 +1,347 @@
+"""
+Process-pool render farm for local MP4 compositing and encoding.
+
+Rendering a video is CPU-bound (PIL, NumPy, x264 fed from Python). In the
+default thread pool it competed with the event loop for the GIL, so one
+classroom's render slowed every API response. Renders now run in a
+ProcessPoolExecutor sized to the cores this process may use
+(RENDER_WORKERS, default len(os.sched_getaffinity(0))), one whole video per
+task.
+
+The queue is bounded: at most RENDER_WORKERS + RENDER_QUEUE_SIZE renders are
+handed to the pool at once; beyond that a caller waits up to
+RENDER_QUEUE_TIMEOUT_S for a slot and then gets RenderFarmBusy, so a surge of
+requests degrades to the routes' fallbacks instead of an unbounded backlog.
+
+Render functions must be module-level (picklable) and take plain arguments
+plus an on_progress keyword; see video_compositor.render_ai_video. Progress
+from the workers comes back over one multiprocessing queue and is delivered
+to the caller's callback on a listener thread (jobs.Job.progress is
+thread-safe).
+
+Workers are forked once, at startup (start(), run in a worker thread while
+the event loop waits), before the model loader and the rest of the app start
+threads of their own; RENDER_START_METHOD=spawn/forkserver overrides.
+Forking a process that already runs threads can deadlock the child, so a
+pool created later — a restart after a worker died, or a first render when
+start() was never called — uses forkserver (or spawn) instead.
+
+Benchmark (videos per minute against worker count):
+    python render_farm.py [videos] [workers,...]
+"""
+import os
+import sys
+import time
+import uuid
+import signal
+import asyncio
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:          # macOS / Windows
+        return os.cpu_count() or 1
+
+
+RENDER_WORKERS         = int(os.getenv("RENDER_WORKERS", "0")) or _available_cores()
+RENDER_QUEUE_SIZE      = int(os.getenv("RENDER_QUEUE_SIZE", "8"))
+RENDER_QUEUE_TIMEOUT_S = float(os.getenv("RENDER_QUEUE_TIMEOUT_S", "30"))
+RENDER_START_METHOD    = os.getenv("RENDER_START_METHOD") or (
+    "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+class RenderFarmBusy(Exception):
+    """Raised when no render slot frees up within RENDER_QUEUE_TIMEOUT_S."""
+
+    def __init__(self, waited_s: float):
+        super().__init__(f"Render farm is full ({RENDER_WORKERS} rendering, {RENDER_QUEUE_SIZE} queued); "
+                         f"no slot within {waited_s:.0f}s")
+        self.waited_s = waited_s
+
+
+def _no_progress(stage: str, done: Optional[int] = None, total: Optional[int] = None, message: Optional[str] = None):
+    pass
+
+
+# ─────────────────────────────────────────────
+#  Worker side
+# ─────────────────────────────────────────────
+_worker_progress = None
+
+
+def _init_worker(progress_queue):
+    global _worker_progress
+    _worker_progress = progress_queue
+    # Ctrl-C goes to the whole process group; let the parent shut the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_render(render_id: str, fn: Callable, args: tuple, kwargs: dict):
+    def on_progress(stage, done=None, total=None, message=None):
+        _worker_progress.put((render_id, stage, done, total, message))
+
+    started = time.perf_counter()
+    result = fn(*args, on_progress=on_progress, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def _noop():
+    return os.getpid()
+
+
+# ─────────────────────────────────────────────
+#  Parent side
+# ─────────────────────────────────────────────
+class RenderFarm:
+    def __init__(self, workers: int = RENDER_WORKERS, queue_size: int = RENDER_QUEUE_SIZE,
+                 queue_timeout_s: float = RENDER_QUEUE_TIMEOUT_S, start_method: str = RENDER_START_METHOD):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout_s = queue_timeout_s
+        self._context = multiprocessing.get_context(start_method)
+        # For pools created after startup, when the process already has threads
+        self._late_context = self._context if start_method != "fork" else multiprocessing.get_context(
+            "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        )
+        self._pool = None
+        self._pool_context = self._context
+        self._progress = None
+        self._listener = None
+        self._callbacks = {}            # render id -> on_progress
+        self._lock = threading.Lock()
+        self._slots = None
+        self._slots_loop = None
+        self.waiting = 0
+        self.in_pool = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._render_s = deque(maxlen=200)
+        self._wait_s = deque(maxlen=200)
+
+    def start(self, late: bool = False):
+        """
+        Create the pool and fork its workers now rather than on the first render.
+        `late` marks a start from an already threaded process (lazy start or
+        restart), which never forks.
+        """
+        with self._lock:
+            if self._pool is not None:
+                return
+            context = self._late_context if late else self._context
+            self._progress = context.SimpleQueue()
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=context,
+                initializer=_init_worker, initargs=(self._progress,),
+            )
+            self._pool_context = context
+            self._listener = threading.Thread(target=self._listen, args=(self._progress,),
+                                              name="render-farm-progress", daemon=True)
+            self._listener.start()
+            pool = self._pool
+        # The first submit launches the workers (a fork pool starts all of them at once)
+        for future in [pool.submit(_noop) for _ in range(self.workers)]:
+            future.result()
+        logger.info(f"[RenderFarm] {self.workers} worker processes ({context.get_start_method()})")
+
+    def shutdown(self, pool: Optional[ProcessPoolExecutor] = None):
+        """Shut the pool down; with `pool`, only if that is still the current one."""
+        with self._lock:
+            if pool is not None and self._pool is not pool:
+                return
+            pool, progress, self._pool, self._progress = self._pool, self._progress, None, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+            progress.put(None)
+
+    def _listen(self, progress):
+        while True:
+            item = progress.get()
+            if item is None:
+                return
+            render_id, stage, done, total, message = item
+            callback = self._callbacks.get(render_id)
+            if callback is not None:
+                try:
+                    callback(stage, done, total, message)
+                except Exception as e:
+                    logger.warning(f"[RenderFarm] Progress callback failed: {e}")
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+            self._slots_loop = loop
+        return self._slots
+
+    async def render(self, fn: Callable, *args, on_progress: Callable = _no_progress, **kwargs):
+        """
+        Run fn(*args, on_progress=..., **kwargs) in a worker process and return its result.
+        Raises RenderFarmBusy when the queue stays full for queue_timeout_s.
+        """
+        slots = self._get_slots()
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(slots.acquire(), self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            waited = time.monotonic() - started
+            logger.warning(f"[RenderFarm] Rejected {fn.__name__} after {waited:.0f}s waiting for a slot")
+            raise RenderFarmBusy(waited)
+        finally:
+            self.waiting -= 1
+
+        render_id = uuid.uuid4().hex
+        self._callbacks[render_id] = on_progress
+        self.in_pool += 1
+        loop = asyncio.get_running_loop()
+        try:
+            if self._pool is None:
+                await asyncio.to_thread(self.start, True)
+            pool = self._pool
+            self._wait_s.append(time.monotonic() - started)
+            future = pool.submit(_run_render, render_id, fn, args, kwargs)
+        except BaseException:
+            self._release(slots)
+            self._callbacks.pop(render_id, None)
+            raise
+        # The slot is held until the worker is really done, even if this caller
+        # is cancelled (cancelling only stops a render that has not started)
+        future.add_done_callback(lambda _: self._release_threadsafe(loop, slots))
+        try:
+            result, render_s = await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            self.failed += 1
+            logger.error("[RenderFarm] A worker process died; restarting the pool")
+            # Other renders on the same pool fail too; only the first may retire it,
+            # never a pool that was restarted in the meantime
+            await asyncio.to_thread(self.shutdown, pool)
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._callbacks.pop(render_id, None)
+        self.completed += 1
+        self._render_s.append(render_s)
+        return result
+
+    def _release(self, slots: asyncio.Semaphore):
+        self.in_pool -= 1
+        slots.release()
+
+    def _release_threadsafe(self, loop, slots: asyncio.Semaphore):
+        try:
+            loop.call_soon_threadsafe(self._release, slots)
+        except RuntimeError:        # loop already closed
+            pass
+
+    def stats(self) -> dict:
+        render_s = sorted(self._render_s)
+        wait_s = sorted(self._wait_s)
+        return {
+            "workers": self.workers,
+            "start_method": self._pool_context.get_start_method(),
+            "capacity": self.workers + self.queue_size,
+            "in_pool": self.in_pool,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "render_p50_s": round(render_s[len(render_s) // 2], 2) if render_s else None,
+            "render_max_s": round(render_s[-1], 2) if render_s else None,
+            "queue_wait_p50_s": round(wait_s[len(wait_s) // 2], 2) if wait_s else None,
+            "queue_wait_max_s": round(wait_s[-1], 2) if wait_s else None,
+        }
+
+
+_farm = None
+
+
+def get_farm() -> RenderFarm:
+    global _farm
+    if _farm is None:
+        _farm = RenderFarm()
+    return _farm
+
+
+async def render(fn: Callable, *args, on_progress: Callable = _no_progress, **kwargs):
+    return await get_farm().render(fn, *args, on_progress=on_progress, **kwargs)
+
+
+def stats() -> dict:
+    return get_farm().stats()
+
+
+# ─────────────────────────────────────────────
+#  Benchmark: videos per minute against worker count
+# ─────────────────────────────────────────────
+async def _benchmark_run(videos: int, workers: Optional[int], output_dir: str):
+    """Render `videos` AI videos concurrently; returns (seconds, worst event-loop lag)."""
+    import io
+    import numpy as np
+    from PIL import Image
+    import video_compositor
+
+    buf = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (512, 512, 3), dtype=np.uint8)).save(buf, "PNG")
+    images = [buf.getvalue()] * 6
+    frames = [f"Frame {i + 1}: Step" for i in range(6)]
+
+    lag = 0.0
+    stop = asyncio.Event()
+
+    async def probe():
+        nonlocal lag
+        while not stop.is_set():
+            t = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag = max(lag, time.perf_counter() - t - 0.01)
+
+    if workers is None:
+        def run(i):
+            return asyncio.to_thread(video_compositor.render_ai_video,
+                                     os.path.join(output_dir, f"{i}.mp4"), "CPR", frames, images)
+    else:
+        farm = RenderFarm(workers=workers, queue_size=videos)
+        await asyncio.to_thread(farm.start)
+
+        def run(i):
+            return farm.render(video_compositor.render_ai_video,
+                               os.path.join(output_dir, f"{i}.mp4"), "CPR", frames, images)
+
+    prober = asyncio.ensure_future(probe())
+    t0 = time.perf_counter()
+    await asyncio.gather(*(run(i) for i in range(videos)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await prober
+    if workers is not None:
+        farm.shutdown()
+    return elapsed, lag
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    videos = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    cores = _available_cores()
+    counts = [int(n) for n in sys.argv[2].split(",")] if len(sys.argv) > 2 else sorted({1, 2, 4, cores})
+    print(f"{videos} AI videos (6 frames, 1280x720) rendered concurrently; {cores} core(s) available")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, workers in [("threads", None)] + [(f"{n} proc", n) for n in counts]:
+            elapsed, lag = asyncio.run(_benchmark_run(videos, workers, tmp))
+            print(f"  {label:<8}  {videos / elapsed * 60:6.1f} videos/min   worst loop lag {lag * 1000:7.1f} ms")
@@ -1,26 +1,334 @@
 import os, time
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
-from schemas import ClinicalInput
+import json
+import asyncio
+from typing import Union
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
+from pydantic import ValidationError
+from schemas import ClinicalInput, DiagnosisOutput, BatchClinicalInput
 import medgemma_engine as engine
 
 router = APIRouter()
 
-@router.post("/analyze")
-async def analyze(data: ClinicalInput):
-    t0 = time.perf_counter()
-    result = engine.infer(data)
-    elapsed = round(time.perf_counter() - t0, 3)
+DISCONNECT_POLL_S = 0.5
+BULK_MAX_IN_FLIGHT = int(os.getenv("MEDGEMMA_BULK_MAX_IN_FLIGHT", "32"))
+
 
-    is_mock = os.getenv("MEDGEMMA_MOCK", "true").lower() == "true"
-    model_id = None if is_mock else os.getenv("MEDGEMMA_MODEL_ID", "google/medgemma-4b-it")
+def _overloaded_response(e: "engine.EngineOverloaded") -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(e)},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def _build_payload(result, batch_meta: dict, elapsed: float) -> dict:
+    backend = engine.backend_info()
+    is_mock = backend is None
 
     payload = result.model_dump()
     payload["_meta"] = {
         "mock": is_mock,
-        "model_id": model_id,
+        "model_id": None if is_mock else backend["model_id"],
+        "backend": None if is_mock else backend["backend"],
         "inference_time_s": elapsed,
-        "quantization": None if is_mock else "4-bit NF4",
+        "quantization": None if is_mock else backend["quantization"],
         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "cache_hit": False,
+        **batch_meta,
     }
-    return JSONResponse(content=payload)
+    return payload
+
+
+async def _await_inference(request: Request, future, timeout_s: float):
+    """
+    Wait for an engine future without blocking the event loop.
+    Cancels the queued request if the client disconnects or the deadline passes,
+    which frees its slot in the inference queue.
+    """
+    task = asyncio.ensure_future(asyncio.wrap_future(future))
+    deadline = time.perf_counter() + timeout_s
+    try:
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            done, _ = await asyncio.wait({task}, timeout=min(DISCONNECT_POLL_S, remaining))
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                return None
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+@router.post("/analyze")
+async def analyze(data: ClinicalInput, request: Request):
+    t0 = time.perf_counter()
+    try:
+        future = engine.submit(data)
+    except engine.EngineOverloaded as e:
+        return _overloaded_response(e)
+
+    try:
+        outcome = await _await_inference(request, future, engine.REQUEST_TIMEOUT_S)
+    except (asyncio.TimeoutError, TimeoutError):
+        return JSONResponse(status_code=504, content={"detail": "MedGemma inference timed out"})
+    if outcome is None:
+        # Client went away — nobody is listening for the body
+        return JSONResponse(status_code=499, content={"detail": "Client closed request"})
+
+    result, batch_meta = outcome
+    elapsed = round(time.perf_counter() - t0, 3)
+    return JSONResponse(content=_build_payload(result, batch_meta, elapsed))
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/analyze/stream")
+async def analyze_stream(data: ClinicalInput):
+    """
+    Server-Sent Events variant of /analyze.
+    Emits `field` events ({"field", "value"}) as each DiagnosisOutput field closes
+    in the model's output, then one `result` event with the validated payload
+    (same shape as /analyze). Errors are reported as an `error` event.
+    """
+    t0 = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+
+    def on_text(delta: str):
+        loop.call_soon_threadsafe(chunks.put_nowait, delta)
+
+    try:
+        future = engine.submit(data, on_text=on_text)
+    except engine.EngineOverloaded as e:
+        return _overloaded_response(e)
+
+    async def events():
+        parser = engine.PartialJsonFieldParser()
+        result_task = asyncio.ensure_future(asyncio.wrap_future(future))
+        try:
+            while True:
+                chunk_task = asyncio.ensure_future(chunks.get())
+                done, _ = await asyncio.wait(
+                    {chunk_task, result_task},
+                    timeout=engine.REQUEST_TIMEOUT_S,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if chunk_task in done:
+                    for field, value in parser.feed(chunk_task.result()):
+                        yield _sse("field", {"field": field, "value": value})
+                    continue
+                chunk_task.cancel()
+                if not done:
+                    yield _sse("error", {"detail": "MedGemma inference timed out"})
+                    return
+                break
+
+            # Drain anything that arrived alongside the final result
+            while not chunks.empty():
+                parser.feed(chunks.get_nowait())
+
+            try:
+                result, batch_meta = result_task.result()
+            except Exception as e:
+                yield _sse("error", {"detail": f"Inference failed: {e}"})
+                return
+
+            # Cache hits, mock mode and fallbacks never streamed — emit their fields now
+            payload = _build_payload(result, batch_meta, round(time.perf_counter() - t0, 3))
+            for field in DiagnosisOutput.model_fields:
+                if parser.fields.get(field) != payload[field]:
+                    yield _sse("field", {"field": field, "value": payload[field]})
+            yield _sse("result", payload)
+        finally:
+            # Client disconnects cancel the generator; release the queue slot if still waiting
+            if not result_task.done():
+                result_task.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ─────────────────────────────────────────────
+#  Bulk triage
+# ─────────────────────────────────────────────
+async def _read_json_records(request: Request) -> list:
+    """
+    Raw records from a JSON array body (or {"items": [...]}). A body that is
+    malformed or not an array/object is a 400.
+    """
+    try:
+        body = await request.json()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Body is not valid JSON: {e}")
+    if isinstance(body, dict):
+        body = body.get("items", [])
+    if not isinstance(body, list):
+        raise HTTPException(
+            status_code=400,
+            detail='Body must be a JSON array of records, an object with an "items" array, or NDJSON',
+        )
+    return body
+
+
+async def _ndjson_chunks(request: Request):
+    """Lists of raw NDJSON lines, one per body chunk, as the upload arrives."""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        lines = [line for line in lines if line.strip()]
+        if lines:
+            yield lines
+    if buffer.strip():
+        yield [buffer]
+
+
+async def _wait_for_disconnect(request: Request):
+    # Only once the body has been read: until then the body iterator owns receive()
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+class _UploadStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that answers while the request body is still arriving.
+    Starlette's own disconnect listener would read receive() concurrently and
+    swallow body chunks, so it is not run; the route notices the client going
+    away itself (ClientDisconnect while reading, _wait_for_disconnect after).
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+
+
+def _parse_record(index: int, raw):
+    """(item_id, ClinicalInput) for one raw record, or an error line for it."""
+    item_id = str(index)
+    try:
+        record = json.loads(raw) if isinstance(raw, (bytes, str)) else raw
+        if isinstance(record, dict) and isinstance(record.get("id"), (str, int)):
+            item_id = record["id"]
+        item = BatchClinicalInput.model_validate(record)
+    except (ValueError, ValidationError) as e:
+        return None, {"id": item_id, "error": f"Invalid record: {e}"}
+    return (item_id, ClinicalInput(**item.model_dump(exclude={"id"}))), None
+
+
+async def _analyze_item(item_id: Union[str, int], data: ClinicalInput) -> dict:
+    t0 = time.perf_counter()
+    deadline = t0 + engine.REQUEST_TIMEOUT_S
+    try:
+        # Back off instead of failing when the shared inference queue is momentarily full
+        while True:
+            try:
+                future = engine.submit(data, use_prefilter=False)
+                break
+            except engine.EngineOverloaded as e:
+                if time.perf_counter() + 1 > deadline:
+                    raise
+                await asyncio.sleep(min(e.retry_after, 1))
+
+        result, batch_meta = await asyncio.wait_for(
+            asyncio.wrap_future(future), max(0.0, deadline - time.perf_counter())
+        )
+    except (asyncio.TimeoutError, TimeoutError):
+        return {"id": item_id, "error": "MedGemma inference timed out"}
+    except Exception as e:
+        return {"id": item_id, "error": str(e)}
+
+    return {"id": item_id, **_build_payload(result, batch_meta, round(time.perf_counter() - t0, 3))}
+
+
+@router.post("/analyze/batch")
+async def analyze_batch(request: Request):
+    """
+    Bulk triage. Accepts a JSON array of BatchClinicalInput records, or an
+    application/x-ndjson body of them, and streams one NDJSON line per record
+    in completion order — cache, mock and pre-filtered answers come back straight
+    away while real inference is batched on the GPU. Each line carries the client
+    `id` (or the record's index) plus either the /analyze payload or an `error`.
+    NDJSON uploads are processed as they arrive, one body chunk at a time, so
+    memory does not grow with the size of the upload.
+    """
+    content_type = request.headers.get("content-type", "")
+    streamed = "ndjson" in content_type or "jsonlines" in content_type
+    if streamed:
+        chunks = _ndjson_chunks(request)
+    else:
+        # A JSON array has to be parsed whole; a bad body is a 400 before streaming starts
+        records = await _read_json_records(request)
+
+        async def single_chunk():
+            yield records
+        chunks = single_chunk()
+
+    async def lines():
+        in_flight = set()
+        index = 0
+        gone = None
+        try:
+            async for raw_records in chunks:
+                items = []
+                for raw in raw_records:
+                    item, error = _parse_record(index, raw)
+                    index += 1
+                    if error is not None:
+                        yield json.dumps(error) + "\n"
+                    else:
+                        items.append(item)
+
+                # One vectorised triage pass per chunk; only ambiguous cases reach MedGemma
+                t0 = time.perf_counter()
+                answers = engine.prefilter([data for _, data in items])
+                elapsed = round(time.perf_counter() - t0, 3)
+
+                for (item_id, data), answer in zip(items, answers):
+                    if answer is not None:
+                        yield json.dumps({"id": item_id, **_build_payload(answer[0], answer[1], elapsed)}) + "\n"
+                        continue
+
+                    in_flight.add(asyncio.ensure_future(_analyze_item(item_id, data)))
+
+                    # Emit whatever has finished; block only when the window is full,
+                    # which also stops reading the upload until a slot frees up
+                    timeout = None if len(in_flight) >= BULK_MAX_IN_FLIGHT else 0
+                    done, in_flight = await asyncio.wait(
+                        in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        yield json.dumps(task.result()) + "\n"
+
+            if streamed:
+                gone = asyncio.ensure_future(_wait_for_disconnect(request))
+            while in_flight:
+                waiting = in_flight | {gone} if gone else in_flight
+                done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if gone in done:
+                    return
+                in_flight -= done
+                for task in done:
+                    yield json.dumps(task.result()) + "\n"
+        except ClientDisconnect:
+            pass
+        finally:
+            # Client went away: cancel queued work so it frees inference slots
+            for task in in_flight:
+                task.cancel()
+            if gone is not None:
+                gone.cancel()
+
+    response_class = _UploadStreamingResponse if streamed else StreamingResponse
+    return response_class(lines(), media_type="application/x-ndjson")
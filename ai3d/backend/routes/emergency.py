@@ -2,15 +2,17 @@
 Emergency AI Route — Google Genie-powered visual guidance for urgent cardiac cases.
 When no specialist is available, students get real-time visual assistance.
 """
-import os
 import base64
 import logging
 from fastapi import APIRouter, UploadFile, File
 from fastapi.responses import JSONResponse
 from schemas import EmergencyRequest, EmergencyResponse
+import llm_provider
+import singleflight
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
+_flights = singleflight.group("emergency")
 
 # ─────────────────────────────────────────────
 #  Mock Emergency Guidance (fallback)
@@ -135,7 +137,8 @@ async def emergency_guidance(req: EmergencyRequest):
     Emergency AI route for urgent cardiac cases.
     When no specialist available, Genie provides visual step-by-step guidance.
     """
-    use_genie = os.getenv("GOOGLE_GENAI_API_KEY", "") != ""
+    llm = llm_provider.get_provider()
+    use_genie = llm.available("GOOGLE_GENAI_API_KEY")
     
     # Fallback to protocols
     protocol_key = f"{req.urgency.lower()}_{req.diagnosis.lower().replace(' ', '_').replace('-', '_')}"
@@ -146,12 +149,12 @@ async def emergency_guidance(req: EmergencyRequest):
 
     if use_genie:
         try:
-            import google.generativeai as genai
-            genai.configure(api_key=os.getenv("GOOGLE_GENAI_API_KEY"))
-            model = genai.GenerativeModel("gemini-2.0-flash")
-            
             prompt = build_genie_visual_prompt(req)
-            response = model.generate_content(prompt)
+            # Every bedside on the same case and step gets the same prompt; share one call
+            response = await _flights.do(
+                _flights.key(model="gemini-2.0-flash", prompt=prompt),
+                lambda: llm.generate("gemini-2.0-flash", prompt, key_env="GOOGLE_GENAI_API_KEY", priority="emergency"),
+            )
             protocol = response.text.strip()
             
             return EmergencyResponse(
@@ -181,7 +184,10 @@ async def analyze_emergency_image(
     Analyze patient image/video during emergency.
     Genie analyzes visual situation and provides real-time guidance.
     """
-    use_genie = os.getenv("GOOGLE_GENAI_API_KEY", "") != ""
+    llm = llm_provider.get_provider()
+    use_genie = llm.available("GOOGLE_GENAI_API_KEY") and not llm.circuit_open(
+        key_env="GOOGLE_GENAI_API_KEY", priority="emergency"
+    )
     
     if not use_genie:
         return JSONResponse({
@@ -198,20 +204,16 @@ async def analyze_emergency_image(
         # Determine MIME type
         mime_type = image.content_type or "image/jpeg"
         
-        import google.generativeai as genai
-        genai.configure(api_key=os.getenv("GOOGLE_GENAI_API_KEY"))
-        model = genai.GenerativeModel("gemini-2.0-flash")
-        
         prompt = build_genie_image_analysis_prompt(diagnosis, urgency)
         
         # Send image to Genie
-        response = model.generate_content([
+        response = await llm.generate("gemini-2.0-flash", [
             {
                 "mime_type": mime_type,
                 "data": image_base64,
             },
             prompt,
-        ])
+        ], key_env="GOOGLE_GENAI_API_KEY", priority="emergency")
         
         guidance = response.text.strip()
         
@@ -1,9 +1,16 @@
 from fastapi import APIRouter
 from schemas import ExplainRequest, ExplainResponse
+from guidance_cache import explain_cache
+import llm_provider
+import singleflight
 import os
+import time
 
 router = APIRouter()
 
+EXPLAIN_MODEL = "gemini-1.5-flash"
+_flights = singleflight.group("explain")
+
 MOCK_PATIENT = (
     "Your heart had a blockage in one of its main blood vessels called the "
     "{artery}. This stopped blood reaching part of your heart muscle, which is "
@@ -25,9 +32,6 @@ async def explain(req: ExplainRequest):
 
     if not use_mock:
         try:
-            import google.generativeai as genai
-            genai.configure(api_key=os.getenv("GEMINI_API_KEY", ""))
-            model = genai.GenerativeModel("gemini-1.5-flash")
             audience_note = (
                 "for a patient with no medical background" if req.audience == "patient"
                 else "for a junior doctor"
@@ -39,8 +43,23 @@ async def explain(req: ExplainRequest):
                 f"Intervention: {req.recommended_intervention}\n"
                 f"Clinical reasoning: {req.reasoning}"
             )
-            response = model.generate_content(prompt)
-            return ExplainResponse(explanation=response.text)
+            llm = llm_provider.get_provider()
+            key = explain_cache.key(
+                provider=llm.name, model=EXPLAIN_MODEL, audience=req.audience,
+                diagnosis=req.diagnosis, affected_region=req.affected_region,
+                intervention=req.recommended_intervention, reasoning=req.reasoning,
+            )
+            text = explain_cache.get(key)
+
+            async def ask_gemini() -> str:
+                t0 = time.perf_counter()
+                response = await llm.generate(EXPLAIN_MODEL, prompt, priority="guidance")
+                explain_cache.set(key, response.text, time.perf_counter() - t0)
+                return response.text
+
+            if text is None:
+                text = await _flights.do(key, ask_gemini)
+            return ExplainResponse(explanation=text)
         except Exception as e:
             print(f"[Gemini] Error: {e}. Using mock explanation.")
 
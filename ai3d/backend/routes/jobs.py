@@ -0,0 +1,71 @@
+"""
+Background job status — poll, stream progress (SSE) and cancel jobs queued
+through POST /video-generation/jobs.
+"""
+import json
+import asyncio
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+import jobs
+
+router = APIRouter()
+
+KEEPALIVE_S = 15
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _get_job(job_id: str) -> jobs.Job:
+    job = jobs.video_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Current state of a job: status, stage, done/total, and the result once finished."""
+    return JSONResponse(_get_job(job_id).snapshot())
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-Sent Events for one job: a `progress` event with the full job
+    snapshot on every stage update, then one `done` event once the job
+    succeeds, fails or is cancelled. Finished jobs get their `done` event at once.
+    """
+    job = _get_job(job_id)
+    manager = jobs.video_jobs
+
+    async def events():
+        updates = manager.subscribe(job_id)
+        try:
+            snapshot = job.snapshot()
+            while snapshot["status"] not in jobs.TERMINAL:
+                yield _sse("progress", snapshot)
+                try:
+                    snapshot = await asyncio.wait_for(updates.get(), timeout=KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    # Re-send as a heartbeat so proxies keep the stream open during long stages
+                    snapshot = job.snapshot()
+            yield _sse("done", snapshot)
+        finally:
+            manager.unsubscribe(job_id, updates)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job. Finished jobs are returned unchanged."""
+    job = jobs.video_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(job.snapshot())
@@ -1,9 +1,15 @@
 from fastapi import APIRouter
+import time
 from schemas import MentorRequest, MentorResponse
-import os
+from guidance_cache import mentor_cache, normalise_question
+import llm_provider
+import singleflight
 
 router = APIRouter()
 
+MENTOR_MODEL = "gemini-1.5-flash"
+_flights = singleflight.group("mentor")
+
 # ── Rich mock guidance per simulation step ──────────────────────
 MOCK_GUIDANCE = {
     "blocked": {
@@ -182,16 +188,32 @@ def build_gemini_prompt(req: MentorRequest) -> str:
 
 @router.post("/mentor", response_model=MentorResponse)
 async def mentor(req: MentorRequest):
-    use_gemini = os.getenv("GEMINI_API_KEY", "") != ""
+    llm = llm_provider.get_provider()
+    use_gemini = llm.available("GEMINI_API_KEY")
     mock = MOCK_GUIDANCE.get(req.current_step, MOCK_GUIDANCE["blocked"])
 
     if use_gemini:
+        question = normalise_question(req.question)
+        key = mentor_cache.key(
+            provider=llm.name, model=MENTOR_MODEL,
+            diagnosis=req.diagnosis, affected_region=req.affected_region, artery_id=req.artery_id,
+            urgency=req.urgency, intervention=req.recommended_intervention,
+            step=req.current_step, question=question,
+        )
+        layer = "question" if question else "exact"
+        guidance = mentor_cache.get(key, layer)
+
+        async def ask_gemini() -> str:
+            t0 = time.perf_counter()
+            response = await llm.generate(MENTOR_MODEL, build_gemini_prompt(req), priority="guidance")
+            text = response.text.strip()
+            mentor_cache.set(key, text, time.perf_counter() - t0)
+            return text
+
         try:
-            import google.generativeai as genai
-            genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-            model = genai.GenerativeModel("gemini-1.5-flash")
-            response = model.generate_content(build_gemini_prompt(req))
-            guidance = response.text.strip()
+            if guidance is None:
+                # Same cache key = same prompt, so identical in-flight requests share one call
+                guidance = await _flights.do(key, ask_gemini)
             # If there's a question, use Gemini for guidance but keep mock safety checks
             return MentorResponse(
                 guidance=guidance,
@@ -9,14 +9,27 @@ import time
 import asyncio
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import JSONResponse, FileResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Callable, Optional, List
 import pathlib
 import sys
 
 # Add parent directory to path
 sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
-from video_providers import generate_video_fallback
+import horde_client
+import llm_provider
+import hedging
+import circuit_breaker
+import jobs
+import veo_poller
+import singleflight
+import rate_limiter
+import video_compositor
+import video_cache
+import render_farm
+import template_library
+from ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -25,6 +38,70 @@ router = APIRouter()
 VIDEO_STORAGE = pathlib.Path(__file__).parent.parent / "generated_videos"
 VIDEO_STORAGE.mkdir(exist_ok=True)
 
+# Finished videos are reused by content and evicted LRU (see video_cache.py)
+_video_cache = video_cache.get_cache()
+
+# Text videos of the built-in templates are prebuilt (see template_library.py)
+_template_library = template_library.get_library()
+
+# Image generation is slower than text; give it its own budget
+IMAGE_TIMEOUT_S = float(os.getenv("LLM_IMAGE_TIMEOUT_S", "60"))
+
+# Hedged provider race for /video-generation (seconds after the race starts)
+HEDGE_HF_DELAY_S    = float(os.getenv("VIDEO_HEDGE_HF_DELAY_S", "30"))
+HEDGE_LOCAL_DELAY_S = float(os.getenv("VIDEO_HEDGE_LOCAL_DELAY_S", "90"))
+HEDGE_DEADLINE_S    = float(os.getenv("VIDEO_HEDGE_DEADLINE_S", "330"))
+HF_TIMEOUT_S        = float(os.getenv("HF_VIDEO_TIMEOUT_S", "240"))
+
+# Veo reference images: generated concurrently, cached per (procedure, frame)
+REFERENCE_IMAGE_CONCURRENCY = int(os.getenv("VEO_REFERENCE_CONCURRENCY", "3"))
+_reference_images = TTLCache(
+    max_entries=int(os.getenv("VEO_REFERENCE_CACHE_SIZE", "64")),
+    ttl_s=float(os.getenv("VEO_REFERENCE_CACHE_TTL_S", "86400")),
+)
+_reference_slots = asyncio.Semaphore(REFERENCE_IMAGE_CONCURRENCY)
+
+# Identical concurrent requests share one pipeline run / narration call
+_video_flights = singleflight.group("video")
+_narration_flights = singleflight.group("narration")
+
+
+def _video_flight_key(pipeline: str, req: "VideoGenerationRequest") -> str:
+    return _video_flights.key(pipeline=pipeline, **req.model_dump())
+
+
+_video_race = hedging.get_race("video_generation", deadline_s=HEDGE_DEADLINE_S)
+
+
+def _render_settings() -> dict:
+    return {
+        "width": video_compositor.VIDEO_WIDTH,
+        "height": video_compositor.VIDEO_HEIGHT,
+        "font": video_compositor.VIDEO_FONT_PATH,
+        "revision": video_compositor.RENDER_REVISION,
+    }
+
+
+def _cached_video(key: str) -> Optional["VideoGenerationResponse"]:
+    entry = _video_cache.get(key)
+    if entry is None or not entry["meta"]:
+        return None
+    logger.info(f"[Video Cache] Reusing {entry['file']}")
+    return VideoGenerationResponse(**entry["meta"])
+
+
+async def _store_video(key: str, source: pathlib.Path, prefix: str, **fields) -> "VideoGenerationResponse":
+    """Move a finished render into the cache (off the event loop) and build its response."""
+    filename = _video_cache.filename(key, prefix)
+    response = VideoGenerationResponse(video_url=f"/api/video-generation/download?file={filename}", **fields)
+    await asyncio.to_thread(_video_cache.put, key, pathlib.Path(source), filename, response.model_dump())
+    return response
+
+
+def _no_progress(stage: str, done: Optional[int] = None, total: Optional[int] = None, message: Optional[str] = None):
+    """Progress sink for the synchronous endpoints; job runs pass Job.progress instead."""
+
+
 class VideoGenerationRequest(BaseModel):
     """Request to generate procedural video"""
     procedure: str  # e.g., "STEMI", "PCI", "Chest Compression"
@@ -33,6 +110,10 @@ class VideoGenerationRequest(BaseModel):
     duration: Optional[int] = 60  # seconds
     language: Optional[str] = "english"
 
+class VideoJobRequest(VideoGenerationRequest):
+    """Queue a video pipeline as a background job (see jobs.py)"""
+    pipeline: str = "ai_video"  # "ai_video" (/huggingface-simple) or "procedure_video" (/video-generation)
+
 class VideoGenerationResponse(BaseModel):
     """Response with video generation details"""
     status: str  # "pending", "generating", "ready"
@@ -148,260 +229,29 @@ IMAGE_PROMPTS = {
     ],
 }
 
-def generate_ai_images(prompts: List[str], procedure: str) -> List:
+async def generate_ai_images(prompts: List[str], procedure: str, on_progress: Callable = _no_progress) -> List[Optional[bytes]]:
     """
     Generate AI images using AI Horde (Stable Horde) - 100% free, no API key
-    Submits ALL jobs in parallel first, then polls all at once for faster total time.
-    Returns list of PIL Images (one per prompt).
+    All jobs are submitted and polled concurrently on the shared pooled client
+    (see horde_client.py); the batch is bounded by HORDE_DEADLINE_S.
+    Returns the encoded image bytes (None where a frame failed), one per prompt,
+    or an empty list when no image came back at all (Horde down or its circuit
+    open). They are decoded in the render worker (video_compositor.render_ai_video).
+    Reports ("images", finished, total) as each Horde job settles.
     """
-    import requests as req_lib
-    from PIL import Image
-    import io
-    import time as time_mod
-
     # Limit to 6 frames for speed (each takes ~30-60s on free tier)
     prompts = prompts[:6]
-    placeholder = Image.new('RGB', (512, 512), color=(20, 20, 50))
 
-    # Step 1: Submit ALL jobs at once
-    job_ids = []
-    for i, prompt in enumerate(prompts):
-        try:
-            r = req_lib.post("https://aihorde.net/api/v2/generate/async", json={
-                "prompt": prompt + ", high quality, detailed, professional",
-                "params": {
-                    "width": 512, "height": 512, "steps": 25,
-                    "n": 1, "cfg_scale": 7.5, "sampler_name": "k_euler_a",
-                },
-                "nsfw": False,
-                "models": ["Deliberate"],
-                "r2": True,
-            }, headers={"apikey": "0000000000"}, timeout=15)
-            if r.status_code == 202:
-                jid = r.json().get("id")
-                job_ids.append((i, jid))
-                logger.info(f"[AI Image] Frame {i+1} submitted: {jid}")
-            else:
-                logger.warning(f"[AI Image] Frame {i+1} submit failed: {r.status_code}")
-                job_ids.append((i, None))
-        except Exception as e:
-            logger.warning(f"[AI Image] Frame {i+1} submit error: {e}")
-            job_ids.append((i, None))
-
-    # Step 2: Poll all jobs in parallel until done (max 120s total)
-    images = [None] * len(prompts)
-    pending = {i: jid for i, jid in job_ids if jid}
-    start = time_mod.time()
-
-    while pending and (time_mod.time() - start) < 120:
-        time_mod.sleep(5)
-        done_keys = []
-        for idx, jid in list(pending.items()):
-            try:
-                check = req_lib.get(f"https://aihorde.net/api/v2/generate/check/{jid}", timeout=10)
-                if check.json().get("done"):
-                    result = req_lib.get(f"https://aihorde.net/api/v2/generate/status/{jid}", timeout=15)
-                    gens = result.json().get("generations", [])
-                    if gens:
-                        img_url = gens[0].get("img")
-                        img_r = req_lib.get(img_url, timeout=30)
-                        if img_r.status_code == 200:
-                            images[idx] = Image.open(io.BytesIO(img_r.content))
-                            logger.info(f"[AI Image] ✓ Frame {idx+1} done!")
-                    done_keys.append(idx)
-            except Exception as e:
-                logger.warning(f"[AI Image] Poll error frame {idx+1}: {e}")
-        for k in done_keys:
-            del pending[k]
-        elapsed = int(time_mod.time() - start)
-        logger.info(f"[AI Image] {elapsed}s elapsed, {len(pending)} pending")
-
-    # Fill missing with placeholder
-    for i in range(len(images)):
-        if images[i] is None:
-            images[i] = placeholder
-
-    return images
-
-
-def create_ai_video(frames: List[str], procedure: str, output_path: pathlib.Path) -> bool:
-    """
-    Create MP4 video with AI-generated images for each frame
-    Uses AI Horde free text-to-image, then overlays text and stitches into MP4
-    """
-    try:
-        from PIL import Image, ImageDraw, ImageFont
-        import imageio
-        import numpy as np
-        
-        # Limit to 6 frames for speed
-        frames = frames[:6]
-        logger.info(f"[AI Video] Creating AI video for {procedure} with {len(frames)} frames...")
-        
-        # Get AI image prompts for this procedure
-        prompts = IMAGE_PROMPTS.get(procedure, IMAGE_PROMPTS.get("CPR"))[:len(frames)]
-        
-        # Generate AI images (parallel batch)
-        ai_images = generate_ai_images(prompts, procedure)
-        
-        frame_images = []
-        frame_size = (1280, 720)
-        
-        for i, frame_text in enumerate(frames):
-            # Start with AI-generated image, resized to frame
-            if i < len(ai_images):
-                bg_img = ai_images[i].convert('RGB').resize(frame_size, Image.LANCZOS)
-            else:
-                bg_img = Image.new('RGB', frame_size, color=(15, 15, 45))
-            
-            # Efficient darkening using blend (instead of pixel-by-pixel)
-            dark_overlay = Image.new('RGB', frame_size, color=(0, 0, 0))
-            bg_img = Image.blend(bg_img, dark_overlay, alpha=0.3)
-            
-            draw = ImageDraw.Draw(bg_img)
-            
-            try:
-                font_title = ImageFont.truetype("arial.ttf", 36)
-                font_body = ImageFont.truetype("arial.ttf", 26)
-                font_small = ImageFont.truetype("arial.ttf", 20)
-            except:
-                font_title = ImageFont.load_default()
-                font_body = font_title
-                font_small = font_title
-            
-            # Top bar - gradient rectangle (fast)
-            top_bar = Image.new('RGBA', (1280, 70), (0, 0, 0, 180))
-            bg_img.paste(Image.new('RGB', (1280, 70), (0, 0, 0)),
-                         (0, 0),
-                         top_bar.split()[3])
-            draw = ImageDraw.Draw(bg_img)
-            
-            # Title and step counter
-            draw.text((20, 15), f"{procedure}", fill=(100, 200, 255), font=font_title)
-            draw.text((1050, 20), f"Step {i+1}/{len(frames)}", fill=(180, 180, 200), font=font_small)
-            
-            # Bottom bar (fast)
-            bottom_bar = Image.new('RGBA', (1280, 100), (0, 0, 0, 200))
-            bg_img.paste(Image.new('RGB', (1280, 100), (0, 0, 0)),
-                         (0, 620),
-                         bottom_bar.split()[3])
-            draw = ImageDraw.Draw(bg_img)
-            
-            # Frame description text at bottom
-            clean_text = frame_text
-            if clean_text.startswith("Frame "):
-                colon_idx = clean_text.find(":")
-                if colon_idx > 0:
-                    clean_text = clean_text[colon_idx + 2:]
-            
-            draw.text((30, 650), clean_text[:70], fill=(255, 255, 255), font=font_body)
-            draw.text((30, 690), f"CardioSim AI — {procedure}", fill=(80, 220, 130), font=font_small)
-            
-            # Progress bar at very bottom
-            progress = (i + 1) / len(frames)
-            draw.rectangle([(0, 714), (1280, 720)], fill=(30, 30, 60))
-            draw.rectangle([(0, 714), (int(1280 * progress), 720)], fill=(80, 220, 130))
-            
-            frame_images.append(np.array(bg_img))
-            logger.info(f"[AI Video] Frame {i+1}/{len(frames)} composited")
-        
-        # Encode MP4 (3 seconds per frame for 6 frames = 18 second video)
-        logger.info(f"[AI Video] Encoding MP4 to {output_path}...")
-        extended_frames = []
-        for f in frame_images:
-            for _ in range(3):  # 3 seconds per frame at 1fps
-                extended_frames.append(f)
-        
-        imageio.mimwrite(str(output_path), extended_frames, fps=1, codec='libx264')
-        
-        file_size = output_path.stat().st_size
-        logger.info(f"[AI Video] ✓ Video created! {file_size} bytes, {len(frames[:12])} frames")
-        return True
-        
-    except Exception as e:
-        logger.error(f"[AI Video] Error: {e}", exc_info=True)
-        return False
+    on_progress("images", 0, len(prompts))
+    raw = await horde_client.get_client().generate_images(
+        [prompt + ", high quality, detailed, professional" for prompt in prompts],
+        on_image=lambda finished, total: on_progress("images", finished, total),
+    )
+    if not any(raw):
+        return []
+    return [data or None for data in raw]
 
 
-def create_simple_video(frames: List[str], procedure: str, output_path: pathlib.Path) -> bool:
-    """
-    Create a text-only MP4 video (fallback if AI image generation fails)
-    """
-    try:
-        from PIL import Image, ImageDraw, ImageFont
-        import imageio
-        import numpy as np
-        
-        logger.info(f"[Text Video] Creating text video from {len(frames)} frames...")
-        
-        frame_images = []
-        frame_size = (1280, 720)
-        
-        bg_color = (15, 15, 45)
-        accent_blue = (80, 180, 255)
-        accent_green = (80, 220, 130)
-        text_white = (220, 220, 230)
-        dim_text = (140, 140, 160)
-        
-        for i, frame_text in enumerate(frames[:12]):
-            img = Image.new('RGB', frame_size, color=bg_color)
-            draw = ImageDraw.Draw(img)
-            
-            try:
-                font_title = ImageFont.truetype("arial.ttf", 48)
-                font_body = ImageFont.truetype("arial.ttf", 30)
-                font_small = ImageFont.truetype("arial.ttf", 22)
-            except:
-                font_title = ImageFont.load_default()
-                font_body = font_title
-                font_small = font_title
-            
-            draw.rectangle([(0, 0), (1280, 6)], fill=accent_blue)
-            draw.text((50, 30), f"{procedure} Procedure", fill=accent_blue, font=font_title)
-            draw.text((950, 40), f"Step {i+1} / {len(frames[:12])}", fill=dim_text, font=font_small)
-            draw.rectangle([(50, 100), (1230, 102)], fill=(40, 40, 80))
-            
-            clean_text = frame_text
-            if clean_text.startswith("Frame "):
-                colon_idx = clean_text.find(":")
-                if colon_idx > 0:
-                    clean_text = clean_text[colon_idx+2:]
-            
-            words = clean_text.split()
-            lines, current_line = [], ""
-            for word in words:
-                test_line = f"{current_line} {word}".strip()
-                if len(test_line) > 45:
-                    lines.append(current_line)
-                    current_line = word
-                else:
-                    current_line = test_line
-            if current_line:
-                lines.append(current_line)
-            
-            y_pos = 160
-            for line in lines[:4]:
-                draw.text((80, y_pos), line, fill=text_white, font=font_body)
-                y_pos += 55
-            
-            draw.rectangle([(0, 640), (1280, 720)], fill=(10, 10, 30))
-            draw.text((50, 660), f"CardioSim AI — {procedure}", fill=accent_green, font=font_small)
-            draw.text((900, 660), "AI-Generated Video", fill=dim_text, font=font_small)
-            
-            progress = (i + 1) / len(frames[:12])
-            draw.rectangle([(0, 714), (1280, 720)], fill=(30, 30, 60))
-            draw.rectangle([(0, 714), (int(1280 * progress), 720)], fill=accent_green)
-            
-            frame_images.append(np.array(img))
-        
-        imageio.mimwrite(str(output_path), frame_images, fps=1, codec='libx264')
-        logger.info(f"[Text Video] ✓ Created! {output_path.stat().st_size} bytes")
-        return True
-        
-    except Exception as e:
-        logger.error(f"[Text Video] Error: {e}", exc_info=True)
-        return False
-
 def build_video_generation_prompt(req: VideoGenerationRequest) -> str:
     """Build prompt for Genie video generation"""
     return f"""Generate a detailed visual description for an instructional medical video.
@@ -447,21 +297,21 @@ async def generate_frame_image(procedure: str, frame_description: str) -> Option
     Returns base64 image data or None if generation fails.
     """
     try:
-        import google.generativeai as genai
-        
-        api_key = os.getenv("GOOGLE_GENAI_API_KEY")
-        if not api_key:
+        llm = llm_provider.get_provider()
+        if not llm.available("GOOGLE_GENAI_API_KEY"):
             return None
         
-        genai.configure(api_key=api_key)
-        
         # Use Gemini 2.5 Flash Image (Nano Banana) for image generation
-        model = genai.GenerativeModel("gemini-2.5-flash-image")
         prompt = build_image_generation_prompt(procedure, frame_description)
         
-        response = model.generate_content(
+        response = await llm.generate(
+            "gemini-2.5-flash-image",
             prompt,
-            generation_config={"response_modalities": ["IMAGE"]}
+            key_env="GOOGLE_GENAI_API_KEY",
+            timeout_s=IMAGE_TIMEOUT_S,
+            circuit="gemini_image",
+            priority="video",
+            generation_config={"response_modalities": ["IMAGE"]},
         )
         
         if response and response.parts:
@@ -476,6 +326,38 @@ async def generate_frame_image(procedure: str, frame_description: str) -> Option
         return None
 
 
+async def generate_reference_images(procedure: str, frame_descriptions: List[str],
+                                    on_progress: Callable = _no_progress) -> List:
+    """
+    Generate Veo reference images for the given frames concurrently, at most
+    VEO_REFERENCE_CONCURRENCY in flight. Returns the images that succeeded, in
+    frame order (a partial set is fine for Veo). Successful images are cached
+    by (procedure, frame description), so repeat requests skip the calls.
+    """
+    total = len(frame_descriptions)
+    finished = 0
+
+    async def one(i: int, frame_desc: str):
+        nonlocal finished
+        key = f"{procedure}\x00{frame_desc}"
+        image = _reference_images.get(key)
+        if image is None:
+            async with _reference_slots:
+                logger.info(f"[Video Generation] Generating reference image {i + 1}/{total} for frame: {frame_desc[:50]}")
+                image = await generate_frame_image(procedure, frame_desc)
+            if image is not None:
+                _reference_images.set(key, image)
+        finished += 1
+        on_progress("reference_images", finished, total)
+        return image
+
+    on_progress("reference_images", 0, total)
+    images = await asyncio.gather(*(one(i, desc) for i, desc in enumerate(frame_descriptions)))
+    ok = [img for img in images if img is not None]
+    logger.info(f"[Video Generation] {len(ok)}/{total} reference images ready")
+    return ok
+
+
 async def generate_video_with_veo(
     procedure: str,
     prompt: str,
@@ -485,7 +367,7 @@ async def generate_video_with_veo(
     """
     Generate video using Veo 3.1 with reference images.
     Returns video file path or None if generation fails.
-    Handles async polling for completion.
+    Completion is tracked by the shared poller (see veo_poller.py).
     """
     try:
         import google.generativeai as genai
@@ -506,37 +388,41 @@ async def generate_video_with_veo(
             config["reference_images"] = reference_images
         
         # Generate video
-        operation = genai.models.generate_videos(
-            model="veo-3.1-generate-preview",
-            prompt=prompt,
-            config=types.GenerateVideosConfig(**config) if config else None,
-        )
+        await rate_limiter.acquire("veo", "video")
+        try:
+            operation = await asyncio.to_thread(
+                genai.models.generate_videos,
+                model="veo-3.1-generate-preview",
+                prompt=prompt,
+                config=types.GenerateVideosConfig(**config) if config else None,
+            )
+        except Exception as e:
+            if rate_limiter.is_rate_limit_error(e):
+                rate_limiter.get("veo").throttle(rate_limiter.retry_after(e))
+            raise
         
         logger.info(f"[Veo Generation] Video generation started, operation: {operation.name}")
         
-        # Poll for completion (max 5 minutes)
-        max_attempts = 30
-        attempt = 0
-        while not operation.done and attempt < max_attempts:
-            logger.info(f"[Veo Generation] Polling... attempt {attempt + 1}/{max_attempts}")
-            await asyncio.sleep(10)  # Wait 10 seconds between polls
-            operation = genai.operations.get(operation.name)
-            attempt += 1
-        
-        if not operation.done:
-            logger.error(f"[Veo Generation] Video generation timeout after {max_attempts * 10}s")
+        # Wait for completion (max VEO_POLL_TIMEOUT_S)
+        try:
+            operation = await veo_poller.get_poller().wait(operation)
+        except asyncio.TimeoutError:
+            logger.error(f"[Veo Generation] Video generation timeout after {veo_poller.VEO_POLL_TIMEOUT_S:.0f}s")
             return None
         
         # Extract video from response
         if operation.response and hasattr(operation.response, 'generated_videos'):
             generated_video = operation.response.generated_videos[0]
             
-            # Download and save video
-            video_path = VIDEO_STORAGE / f"{procedure}_{int(time.time())}.mp4"
+            # Download and save video (the caller moves it into the video cache)
+            video_path = _video_cache.temp_path()
             logger.info(f"[Veo Generation] Downloading video to {video_path}")
             
-            # Save video file
-            genai.files.download(file=generated_video.video, destination=str(video_path))
+            # Save video file off the event loop
+            await veo_poller.download(
+                lambda path: genai.files.download(file=generated_video.video, destination=path),
+                str(video_path),
+            )
             logger.info(f"[Veo Generation] Video saved to {video_path}")
             
             return str(video_path)
@@ -549,19 +435,208 @@ async def generate_video_with_veo(
         return None
 
 
+async def _veo_contender(req: VideoGenerationRequest, template: dict,
+                        on_progress: Callable = _no_progress) -> Optional[VideoGenerationResponse]:
+    breaker = circuit_breaker.get("veo")
+    breaker.check()
+    started = time.perf_counter()
+    try:
+        response = await _run_veo_pipeline(req, template, on_progress)
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    if response is None:
+        breaker.record_failure()
+    else:
+        breaker.record_success(time.perf_counter() - started)
+    return response
+
+
+async def _run_veo_pipeline(req: VideoGenerationRequest, template: dict,
+                            on_progress: Callable = _no_progress) -> Optional[VideoGenerationResponse]:
+    # Step 1: Generate frame images for reference using Gemini 2.5 Flash Image
+    logger.info("[Video Generation] Step 1: Generating frame images with Gemini 2.5 Flash Image (Nano Banana)...")
+    # Generate images for first 3 frames only (Veo accepts up to 3 references)
+    reference_images = await generate_reference_images(req.procedure, template["frames"][:3], on_progress)
+    
+    # Step 2: Build comprehensive video prompt
+    video_prompt = _veo_prompt(req, template)
+    
+    logger.info("[Video Generation] Step 2: Starting Veo 3.1 video generation...")
+    on_progress("veo_render", message="Rendering with Veo 3.1")
+    
+    # Step 3: Generate video with Veo 3.1 using reference images
+    video_path = await generate_video_with_veo(
+        procedure=req.procedure,
+        prompt=video_prompt,
+        reference_images=reference_images if reference_images else None,
+        duration=req.duration or 60
+    )
+    if not video_path:
+        return None
+    
+    logger.info(f"[Video Generation] ✓ SUCCESS! Video saved to {video_path}")
+    return await _store_video(
+        _veo_cache_key(req, template), video_path, f"veo_{req.procedure}",
+        status="ready",
+        preview_image="/api/video-generation/preview",
+        description=f"AI-generated instructional video for {req.procedure} using Veo 3.1 with Gemini image references",
+        frames=template["frames"],
+        estimated_duration=req.duration or 60,
+    )
+
+
+def _veo_prompt(req: VideoGenerationRequest, template: dict) -> str:
+    return f"""Generate a professional medical instructional video for {req.procedure}.
+
+Procedure Steps:
+{chr(10).join([f"{i+1}. {frame}" for i, frame in enumerate(template["frames"])])}
+
+Requirements:
+- Professional medical education video
+- Clear visualization of each step
+- Show proper hand positioning and technique
+- Include anatomical landmarks
+- Realistic clinical setting
+- Duration: {req.duration or 60} seconds
+- High quality suitable for medical training
+
+Create a comprehensive, realistic, and educational video that students can follow to learn this critical lifesaving procedure."""
+
+
+def _veo_cache_key(req: VideoGenerationRequest, template: dict) -> str:
+    return _video_cache.key(provider="veo", model="veo-3.1-generate-preview",
+                            procedure=req.procedure, prompt=_veo_prompt(req, template))
+
+
+def _hf_prompt(req: VideoGenerationRequest, template: dict) -> str:
+    return f"Professional medical instructional video for {req.procedure}: {' '.join(template['frames'][:3])}"
+
+
+def _hf_cache_key(req: VideoGenerationRequest, template: dict) -> str:
+    return _video_cache.key(provider="huggingface", procedure=req.procedure, prompt=_hf_prompt(req, template))
+
+
+def _text_cache_key(procedure: str, frames: List[str]) -> str:
+    return _video_cache.key(provider="text", procedure=procedure, frames=frames, render=_render_settings())
+
+
+async def _huggingface_contender(req: VideoGenerationRequest, template: dict,
+                                 on_progress: Callable = _no_progress) -> Optional[VideoGenerationResponse]:
+    from huggingface_hub import AsyncInferenceClient
+    
+    breaker = circuit_breaker.get("huggingface")
+    breaker.check()
+    hf_client = AsyncInferenceClient()
+    hf_prompt = _hf_prompt(req, template)
+    
+    logger.info("[Video Generation] Calling Hugging Face text-to-video...")
+    on_progress("huggingface_render", message="Rendering with Hugging Face text-to-video")
+    try:
+        await rate_limiter.acquire("huggingface", "video")
+        started = time.perf_counter()
+        video_result = await asyncio.wait_for(
+            hf_client.text_to_video(prompt=hf_prompt), breaker.timeout_s(HF_TIMEOUT_S)
+        )
+    except (asyncio.CancelledError, rate_limiter.RateLimited):
+        breaker.release()
+        raise
+    except Exception as e:
+        if rate_limiter.is_rate_limit_error(e):
+            rate_limiter.get("huggingface").throttle(rate_limiter.retry_after(e))
+            breaker.release()
+        else:
+            breaker.record_failure()
+        raise
+    if not video_result:
+        breaker.record_failure()
+        return None
+    breaker.record_success(time.perf_counter() - started)
+    
+    # Save video to disk
+    hf_video_path = _video_cache.temp_path()
+    await asyncio.to_thread(hf_video_path.write_bytes, video_result)
+    
+    logger.info(f"[Video Generation] ✓ Hugging Face SUCCESS! Video saved to {hf_video_path}")
+    return await _store_video(
+        _hf_cache_key(req, template), hf_video_path, f"hf_video_{req.procedure}",
+        status="ready_huggingface",
+        preview_image=None,
+        description=f"AI-generated video for {req.procedure} using Hugging Face",
+        frames=template["frames"],
+        estimated_duration=req.duration or 60,
+    )
+
+
+async def _local_render_contender(req: VideoGenerationRequest, template: dict,
+                                  on_progress: Callable = _no_progress) -> Optional[VideoGenerationResponse]:
+    frames = template["frames"][:12]
+    return await _text_video(req.procedure, frames, on_progress)
+
+
+async def _text_video(procedure: str, frames: List[str],
+                      on_progress: Callable = _no_progress) -> Optional[VideoGenerationResponse]:
+    """The text-only render: prebuilt for the templates, else cached or rendered."""
+    resolution = f"{video_compositor.VIDEO_WIDTH}x{video_compositor.VIDEO_HEIGHT}"
+    if _template_library.lookup(procedure, frames, resolution):
+        return VideoGenerationResponse(
+            status="ready_video_text",
+            video_url=_template_video_url(procedure, resolution),
+            preview_image=None,
+            description=f"Instructional video for {procedure}",
+            frames=frames,
+            estimated_duration=12,
+        )
+    key = _text_cache_key(procedure, frames)
+    cached = _cached_video(key)
+    if cached is not None:
+        return cached
+    video_path = _video_cache.temp_path()
+    try:
+        await render_farm.render(video_compositor.render_text_video, str(video_path), procedure, frames[:12],
+                                 on_progress=on_progress)
+        return await _store_video(
+            key, video_path, f"text_{procedure}",
+            status="ready_video_text",
+            preview_image=None,
+            description=f"Instructional video for {procedure}",
+            frames=frames,
+            estimated_duration=12,
+        )
+    except Exception as e:
+        logger.error(f"[Text Video] Error: {e}")
+        return None
+    finally:
+        video_path.unlink(missing_ok=True)
+
+
 @router.post("/video-generation", response_model=VideoGenerationResponse)
 async def generate_procedure_video(req: VideoGenerationRequest):
     """
     Generate instructional video for medical procedure.
     
-    Pipeline:
+    Providers are hedged (see hedging.py): Veo 3.1 starts at once, Hugging Face
+    after VIDEO_HEDGE_HF_DELAY_S and the local text render after
+    VIDEO_HEDGE_LOCAL_DELAY_S (sooner if everything running has failed). The
+    first video wins and the rest are cancelled.
+    
+    Veo pipeline:
     1. Generate frame images using Gemini 2.5 Flash Image (Nano Banana)
     2. Use images as references for Veo 3.1 video generation
     3. Poll for video completion
     4. Return video URL and frame descriptions
     
     This is a comprehensive AI-powered video generation system per Google's official guide.
+    Holds the request open for minutes; POST /video-generation/jobs runs the
+    same pipeline in the background with progress events.
     """
+    return await _video_flights.do(_video_flight_key("procedure_video", req), lambda: _procedure_video(req))
+
+
+async def _procedure_video(req: VideoGenerationRequest, on_progress: Callable = _no_progress) -> VideoGenerationResponse:
     use_genie = os.getenv("GOOGLE_GENAI_API_KEY", "") != ""
     template = VIDEO_TEMPLATES.get(req.procedure, VIDEO_TEMPLATES.get("STEMI"))
     
@@ -576,112 +651,42 @@ async def generate_procedure_video(req: VideoGenerationRequest):
             estimated_duration=req.duration or 60,
         )
     
+    # A provider video for this exact prompt is already on disk
+    for key in (_veo_cache_key(req, template), _hf_cache_key(req, template)):
+        cached = _cached_video(key)
+        if cached is not None:
+            return cached
+    
     try:
-        import google.generativeai as genai
-        genai.configure(api_key=os.getenv("GOOGLE_GENAI_API_KEY"))
-        
-        logger.info(f"[Video Generation] Starting full pipeline for {req.procedure}")
-        
-        # Step 1: Generate frame images for reference using Gemini 2.5 Flash Image
-        logger.info("[Video Generation] Step 1: Generating frame images with Gemini 2.5 Flash Image (Nano Banana)...")
-        reference_images = []
-        
-        # Generate images for first 3 frames only (Veo accepts up to 3 references)
-        for i in range(min(3, len(template["frames"]))):
-            frame_desc = template["frames"][i]
-            logger.info(f"[Video Generation] Generating reference image {i + 1}/3 for frame: {frame_desc[:50]}")
-            image = await generate_frame_image(req.procedure, frame_desc)
-            if image:
-                reference_images.append(image)
-                logger.info(f"[Video Generation] ✓ Generated reference image {i + 1}/3")
-            else:
-                logger.warning(f"[Video Generation] ✗ Failed to generate reference image {i + 1}/3")
+        logger.info(f"[Video Generation] Starting hedged pipeline for {req.procedure}")
         
-        # Step 2: Build comprehensive video prompt
-        video_prompt = f"""Generate a professional medical instructional video for {req.procedure}.
-
-Procedure Steps:
-{chr(10).join([f"{i+1}. {frame}" for i, frame in enumerate(template["frames"])])}
-
-Requirements:
-- Professional medical education video
-- Clear visualization of each step
-- Show proper hand positioning and technique
-- Include anatomical landmarks
-- Realistic clinical setting
-- Duration: {req.duration or 60} seconds
-- High quality suitable for medical training
-
-Create a comprehensive, realistic, and educational video that students can follow to learn this critical lifesaving procedure."""
+        winner, response = await _video_race.run([
+            hedging.Contender("veo", lambda: _veo_contender(req, template, on_progress)),
+            hedging.Contender("huggingface", lambda: _huggingface_contender(req, template, on_progress), HEDGE_HF_DELAY_S),
+            hedging.Contender("local_render", lambda: _local_render_contender(req, template, on_progress), HEDGE_LOCAL_DELAY_S),
+        ])
+        if response is not None:
+            return response
         
-        logger.info("[Video Generation] Step 2: Starting Veo 3.1 video generation...")
+        # If every provider fails, show template description
+        logger.warning("[Video Generation] All video providers failed, returning enhanced template")
         
-        # Step 3: Generate video with Veo 3.1 using reference images
-        video_path = await generate_video_with_veo(
-            procedure=req.procedure,
-            prompt=video_prompt,
-            reference_images=reference_images if reference_images else None,
-            duration=req.duration or 60
+        # Fallback: Generate enhanced description instead
+        on_progress("enhanced_description")
+        prompt = build_video_generation_prompt(req)
+        response = await llm_provider.get_provider().generate(
+            "gemini-2.5-flash", prompt, key_env="GOOGLE_GENAI_API_KEY", priority="video"
         )
+        enhanced_description = response.text.strip()
         
-        if video_path:
-            logger.info(f"[Video Generation] ✓ SUCCESS! Video saved to {video_path}")
-            return VideoGenerationResponse(
-                status="ready",
-                video_url=f"/api/video-generation/download?file={os.path.basename(video_path)}",
-                preview_image="/api/video-generation/preview",
-                description=f"AI-generated instructional video for {req.procedure} using Veo 3.1 with Gemini image references",
-                frames=template["frames"],
-                estimated_duration=req.duration or 60,
-            )
-        else:
-            logger.warning("[Video Generation] Veo 3.1 generation failed, trying Hugging Face...")
-            
-            # Step 4: Try Hugging Face directly
-            try:
-                from huggingface_hub import InferenceClient
-                
-                hf_client = InferenceClient()
-                hf_prompt = f"Professional medical instructional video for {req.procedure}: {' '.join(template['frames'][:3])}"
-                
-                logger.info("[Video Generation] Calling Hugging Face text-to-video...")
-                video_result = hf_client.text_to_video(prompt=hf_prompt)
-                
-                if video_result:
-                    # Save video to disk
-                    hf_video_path = VIDEO_STORAGE / f"hf_video_{req.procedure}_{int(time.time())}.mp4"
-                    with open(hf_video_path, "wb") as f:
-                        f.write(video_result)
-                    
-                    logger.info(f"[Video Generation] ✓ Hugging Face SUCCESS! Video saved to {hf_video_path}")
-                    return VideoGenerationResponse(
-                        status="ready_huggingface",
-                        video_url=f"/api/video-generation/download?file={os.path.basename(hf_video_path)}",
-                        preview_image=None,
-                        description=f"AI-generated video for {req.procedure} using Hugging Face",
-                        frames=template["frames"],
-                        estimated_duration=req.duration or 60,
-                    )
-            except Exception as hf_error:
-                logger.warning(f"[Video Generation] Hugging Face failed: {hf_error}")
-            
-            # Step 5: If Hugging Face fails, show template description
-            logger.warning("[Video Generation] All video providers failed, returning enhanced template")
-            
-            # Fallback: Generate enhanced description instead
-            model = genai.GenerativeModel("gemini-2.5-flash")
-            prompt = build_video_generation_prompt(req)
-            response = model.generate_content(prompt)
-            enhanced_description = response.text.strip()
-            
-            return VideoGenerationResponse(
-                status="template_enhanced",
-                video_url=None,
-                preview_image=None,
-                description=enhanced_description if len(enhanced_description) > 20 else template["description"],
-                frames=template["frames"],
-                estimated_duration=req.duration or 60,
-            )
+        return VideoGenerationResponse(
+            status="template_enhanced",
+            video_url=None,
+            preview_image=None,
+            description=enhanced_description if len(enhanced_description) > 20 else template["description"],
+            frames=template["frames"],
+            estimated_duration=req.duration or 60,
+        )
         
     except Exception as e:
         logger.error(f"[Video Generation] Critical error: {e}", exc_info=True)
@@ -701,13 +706,16 @@ async def download_generated_video(file: str):
     """Download a previously generated video file"""
     try:
         file_path = VIDEO_STORAGE / file
+        # Pinned until the response is sent, so eviction never deletes it mid-download
+        _video_cache.pin(file)
         if not file_path.exists():
+            _video_cache.unpin(file)
             raise HTTPException(status_code=404, detail="Video not found")
-        
         return FileResponse(
             path=file_path,
             media_type="video/mp4",
-            filename=f"{file}"
+            filename=f"{file}",
+            background=BackgroundTask(_video_cache.unpin, file),
         )
     except Exception as e:
         logger.error(f"[Video Download] Error: {e}")
@@ -725,7 +733,8 @@ async def stream_procedure_video_frame(
     Each frame includes visual description, audio, and annotations.
     Uses Gemini 2.5 Flash for narration generation.
     """
-    use_genie = os.getenv("GOOGLE_GENAI_API_KEY", "") != ""
+    llm = llm_provider.get_provider()
+    use_genie = llm.available("GOOGLE_GENAI_API_KEY")
     
     template = VIDEO_TEMPLATES.get(procedure, VIDEO_TEMPLATES.get("STEMI"))
     
@@ -736,10 +745,6 @@ async def stream_procedure_video_frame(
     
     if use_genie:
         try:
-            import google.generativeai as genai
-            genai.configure(api_key=os.getenv("GOOGLE_GENAI_API_KEY"))
-            model = genai.GenerativeModel("gemini-2.5-flash")
-            
             prompt = f"""For this medical procedure frame, provide:
 1. Visual narration (what to look for)
 2. Anatomical landmarks (point to on screen)
@@ -753,7 +758,10 @@ Urgency: {urgency}
 
 Keep response concise for real-time educational use."""
             
-            response = model.generate_content(prompt)
+            response = await _narration_flights.do(
+                _narration_flights.key(procedure=procedure, frame_number=frame_number, urgency=urgency),
+                lambda: llm.generate("gemini-2.5-flash", prompt, key_env="GOOGLE_GENAI_API_KEY", priority="video"),
+            )
             narration = response.text.strip()
             
             return JSONResponse({
@@ -784,10 +792,31 @@ Keep response concise for real-time educational use."""
     })
 
 
+def _template_video_url(procedure: str, resolution: str) -> str:
+    return f"/api/video-generation/template-videos/{procedure}/{resolution}"
+
+
+def _template_videos(procedure: str) -> dict:
+    """Resolution -> URL of the prebuilt videos for a template (empty until built)."""
+    template = VIDEO_TEMPLATES.get(procedure)
+    if template is None:
+        return {}
+    return {
+        resolution: _template_video_url(procedure, resolution)
+        for resolution in template_library.TEMPLATE_VIDEO_RESOLUTIONS
+        if _template_library.lookup(procedure, template["frames"], resolution)
+    }
+
+
 @router.get("/video-generation/fallback-video")
-async def get_fallback_video(procedure: str = "STEMI"):
-    """Fallback endpoint for video template data"""
+async def get_fallback_video(procedure: str = "STEMI", resolution: Optional[str] = None):
+    """
+    Fallback endpoint for video template data
+    video_url is the prebuilt text video (at `resolution`, default the first
+    TEMPLATE_VIDEO_RESOLUTIONS entry) when the library has it.
+    """
     template = VIDEO_TEMPLATES.get(procedure, VIDEO_TEMPLATES.get("STEMI"))
+    videos = _template_videos(procedure if procedure in VIDEO_TEMPLATES else "STEMI")
     
     return JSONResponse({
         "procedure": procedure,
@@ -795,31 +824,63 @@ async def get_fallback_video(procedure: str = "STEMI"):
         "frames_count": len(template["frames"]),
         "frames": template["frames"],
         "description": template["description"],
+        "video_url": videos.get(resolution) if resolution else next(iter(videos.values()), None),
+        "videos": videos,
         "status": "template_mode"
     })
 
 
+@router.get("/video-generation/template-videos/{procedure}/{resolution}")
+async def get_template_video(procedure: str, resolution: str):
+    """Serve a prebuilt template video (see template_library.py)"""
+    template = VIDEO_TEMPLATES.get(procedure)
+    path = template and _template_library.lookup(procedure, template["frames"], resolution)
+    if not path:
+        raise HTTPException(status_code=404, detail="Template video not built")
+    return FileResponse(
+        path=path,
+        media_type="video/mp4",
+        filename=f"{procedure}_{resolution}.mp4",
+        headers={"Cache-Control": "public, max-age=3600"},
+    )
+
+
 @router.post("/video-generation/huggingface-simple")
 async def generate_video_huggingface_simple(req: VideoGenerationRequest):
     """
     AI Video Generation - Creates MP4 with AI-generated images showing procedures
-    Pipeline: HuggingFace text-to-image → composite frames → MP4 video
+    Pipeline: AI Horde text-to-image → composite frames → MP4 video
+    POST /video-generation/jobs (pipeline "ai_video") runs it in the background.
     """
+    return await _video_flights.do(_video_flight_key("ai_video", req), lambda: _ai_video(req))
+
+
+async def _ai_video(req: VideoGenerationRequest, on_progress: Callable = _no_progress) -> VideoGenerationResponse:
     template = VIDEO_TEMPLATES.get(req.procedure, VIDEO_TEMPLATES.get("STEMI"))
     frames = template["frames"][:12]
-    video_filename = f"ai_{req.procedure}_{int(time.time())}.mp4"
-    video_path = VIDEO_STORAGE / video_filename
+    # Get AI image prompts for this procedure (parallel batch on AI Horde)
+    prompts = IMAGE_PROMPTS.get(req.procedure, IMAGE_PROMPTS.get("CPR"))[:6]
+    key = _video_cache.key(provider="horde", model=horde_client.HORDE_MODEL, procedure=req.procedure,
+                           frames=frames, prompts=prompts, render=_render_settings())
+    cached = _cached_video(key)
+    if cached is not None:
+        return cached
     
     # Try AI image generation first (HuggingFace free API)
     logger.info(f"[AI Video] Starting AI video generation for {req.procedure}...")
     
+    video_path = _video_cache.temp_path()
     try:
-        success = await asyncio.to_thread(create_ai_video, frames, req.procedure, video_path)
-        if success and video_path.exists():
+        ai_images = await generate_ai_images(prompts, req.procedure, on_progress)
+        if ai_images:
+            # Limit to 6 frames for speed; 3 seconds each = 18 second video
+            await render_farm.render(video_compositor.render_ai_video, str(video_path), req.procedure,
+                                     frames[:6], ai_images, on_progress=on_progress)
+        if ai_images and video_path.exists():
             logger.info(f"[AI Video] ✓ AI video ready!")
-            return VideoGenerationResponse(
+            return await _store_video(
+                key, video_path, f"ai_{req.procedure}",
                 status="ready_ai_video",
-                video_url=f"/api/video-generation/download?file={video_filename}",
                 preview_image=None,
                 description=f"AI-generated medical video for {req.procedure}",
                 frames=frames,
@@ -827,18 +888,15 @@ async def generate_video_huggingface_simple(req: VideoGenerationRequest):
             )
     except Exception as e:
         logger.warning(f"[AI Video] AI generation failed: {e}")
+    finally:
+        video_path.unlink(missing_ok=True)
     
     # Fallback: text-only video
     logger.info(f"[AI Video] Falling back to text video for {req.procedure}...")
-    if create_simple_video(frames, req.procedure, video_path):
-        return VideoGenerationResponse(
-            status="ready_video_text",
-            video_url=f"/api/video-generation/download?file={video_filename}",
-            preview_image=None,
-            description=f"Instructional video for {req.procedure}",
-            frames=frames,
-            estimated_duration=12,
-        )
+    on_progress("text_video", message="AI images unavailable, rendering text video")
+    response = await _text_video(req.procedure, frames, on_progress)
+    if response is not None:
+        return response
     
     # Final fallback
     return VideoGenerationResponse(
@@ -851,6 +909,71 @@ async def generate_video_huggingface_simple(req: VideoGenerationRequest):
     )
 
 
+# ─────────────────────────────────────────────
+#  Background jobs (see jobs.py, routes/jobs.py)
+# ─────────────────────────────────────────────
+_JOB_PIPELINES = {
+    "procedure_video": _procedure_video,
+    "ai_video": _ai_video,
+}
+
+
+# Jobs sharing one in-flight pipeline run, leader first; the run's progress goes to all of them.
+# Tuples are replaced, never mutated, so render-farm threads can read them without a lock.
+_flight_jobs = {}
+
+
+def _job_runner(kind: str, pipeline: Callable):
+    async def run(job: jobs.Job) -> dict:
+        req = VideoGenerationRequest(**job.params)
+        key = _video_flight_key(kind, req)
+        sharing = _flight_jobs.get(key, ()) if _video_flights.in_flight(key) else ()
+        if sharing:
+            leader = sharing[0]
+            job.progress(leader.stage, leader.done, leader.total,
+                         "Sharing an identical video that is already being generated")
+        _flight_jobs[key] = sharing + (job,)
+
+        def progress(stage, done=None, total=None, message=None):
+            for shared in _flight_jobs.get(key, ()):
+                shared.progress(stage, done, total, message)
+
+        try:
+            return (await _video_flights.do(key, lambda: pipeline(req, progress))).model_dump()
+        finally:
+            remaining = tuple(j for j in _flight_jobs.get(key, ()) if j is not job)
+            if remaining:
+                _flight_jobs[key] = remaining
+            else:
+                _flight_jobs.pop(key, None)
+    return run
+
+
+for _kind, _pipeline in _JOB_PIPELINES.items():
+    jobs.video_jobs.register(_kind, _job_runner(_kind, _pipeline))
+
+
+@router.post("/video-generation/jobs", status_code=202)
+async def submit_video_job(req: VideoJobRequest):
+    """
+    Queue a video pipeline and return its job id at once.
+    Follow progress with GET /jobs/{id} or the SSE stream at /jobs/{id}/events;
+    the finished job's `result` has the same shape as the synchronous endpoints.
+    """
+    if req.pipeline not in _JOB_PIPELINES:
+        raise HTTPException(status_code=422, detail=f"pipeline must be one of {sorted(_JOB_PIPELINES)}")
+    try:
+        job = jobs.video_jobs.submit(req.pipeline, req.model_dump(exclude={"pipeline"}))
+    except jobs.JobQueueFull as e:
+        return JSONResponse(status_code=503, content={"detail": str(e)},
+                            headers={"Retry-After": str(e.retry_after)})
+    return JSONResponse(status_code=202, content={
+        **job.snapshot(),
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+    })
+
+
 @router.get("/video-generation/templates")
 async def list_video_templates():
     """List available video procedure templates"""
@@ -860,7 +983,8 @@ async def list_video_templates():
             proc: {
                 "title": data["title"],
                 "frames_count": len(data["frames"]),
-                "description": data["description"]
+                "description": data["description"],
+                "videos": _template_videos(proc),
             }
             for proc, data in VIDEO_TEMPLATES.items()
         }
@@ -877,7 +1001,10 @@ async def analyze_student_technique(
     Analyze student's procedure technique from video/image.
     Genie (Gemini 2.5 Flash) provides real-time feedback on hand positioning, depth, rate, etc.
     """
-    use_genie = os.getenv("GOOGLE_GENAI_API_KEY", "") != ""
+    llm = llm_provider.get_provider()
+    use_genie = llm.available("GOOGLE_GENAI_API_KEY") and not llm.circuit_open(
+        key_env="GOOGLE_GENAI_API_KEY", priority="technique"
+    )
     
     if not use_genie:
         return JSONResponse({
@@ -891,10 +1018,6 @@ async def analyze_student_technique(
         })
     
     try:
-        import google.generativeai as genai
-        genai.configure(api_key=os.getenv("GOOGLE_GENAI_API_KEY"))
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        
         prompt = f"""Analyze this {procedure} technique performance:
 
 Procedure: {procedure}
@@ -908,7 +1031,7 @@ Evaluate and provide:
 
 Format as actionable feedback for immediate improvement."""
         
-        response = model.generate_content(prompt)
+        response = await llm.generate("gemini-2.5-flash", prompt, key_env="GOOGLE_GENAI_API_KEY", priority="technique")
         feedback = response.text.strip()
         
         return JSONResponse({
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Union
 
 class ClinicalInput(BaseModel):
     chest_pain_duration: int          # minutes
@@ -9,6 +9,9 @@ class ClinicalInput(BaseModel):
     risk_factors: List[str] = []      # e.g. ["hypertension", "diabetes"]
     symptoms: Optional[str] = ""
 
+class BatchClinicalInput(ClinicalInput):
+    id: Optional[Union[str, int]] = None   # client-supplied, echoed back unchanged on the result line
+
 class DiagnosisOutput(BaseModel):
     diagnosis: str
     affected_region: str
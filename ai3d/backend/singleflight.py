@@ -0,0 +1,88 @@
+"""
+Single-flight request coalescing for identical in-flight upstream calls.
+
+When a lecture hall clicks "Generate Video" for STEMI at once, or a class
+asks the mentor about the same step, only the first request (the leader)
+calls upstream; identical requests that arrive while it is running attach
+to the same task and get its result (or its exception). Nothing is kept once
+the call finishes — that is the caches' job; this only covers the window
+while the call is in flight.
+
+The shared task is independent of any one caller: a caller that disconnects
+stops waiting, and the upstream call is cancelled only when every caller
+waiting on it has gone.
+"""
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}          # key -> _Flight
+        self.calls = 0
+        self.upstream = 0
+        self.deduplicated = 0
+
+    @staticmethod
+    def key(**fields) -> str:
+        return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Return fn()'s result, sharing one call among concurrent callers with the same key."""
+        self.calls += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            self.upstream += 1
+            flight = self._flights[key] = _Flight(asyncio.ensure_future(fn()))
+            flight.task.add_done_callback(lambda _: self._flights.pop(key, None))
+        else:
+            self.deduplicated += 1
+            logger.info(f"[SingleFlight:{self.name}] Joined in-flight call ({flight.waiters} already waiting)")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "upstream": self.upstream,
+            "deduplicated": self.deduplicated,
+            "dedup_ratio": round(self.deduplicated / self.calls, 3) if self.calls else None,
+            "in_flight": len(self._flights),
+        }
+
+
+_groups = {}
+
+
+def group(name: str) -> SingleFlight:
+    flights = _groups.get(name)
+    if flights is None:
+        flights = _groups[name] = SingleFlight(name)
+    return flights
+
+
+def stats() -> dict:
+    return {name: flights.stats() for name, flights in _groups.items()}
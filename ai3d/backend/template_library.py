@@ -0,0 +1,231 @@
+"""
+Pre-rendered text videos for the built-in procedure templates (VIDEO_TEMPLATES).
+
+The templates are static, so their text-only videos are rendered once per
+resolution (TEMPLATE_VIDEO_RESOLUTIONS) instead of on demand. Each template's
+videos live in a versioned directory named after a hash of everything that
+shows up in them (procedure, frames, compositor revision, font):
+
+    <TEMPLATE_VIDEO_DIR>/<procedure>-<hash>/<W>x<H>.mp4
+    <TEMPLATE_VIDEO_DIR>/manifest.json
+
+A build renders only what the manifest does not already have for the
+current hash, so editing one template re-renders just that template; older
+version directories are removed afterwards. The manifest is written with
+write-then-rename.
+
+Builds run at startup in the background when VIDEO_PREBUILD_TEMPLATES is on
+(renders go through render_farm.py, one at a time), or offline:
+    python template_library.py [--force] [--resolutions 1280x720,640x360]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+import pathlib
+from typing import Dict, List, Optional, Tuple
+
+import render_farm
+import video_compositor
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_VIDEO_DIR = pathlib.Path(
+    os.getenv("TEMPLATE_VIDEO_DIR") or pathlib.Path(__file__).parent / "generated_videos" / "templates"
+)
+TEMPLATE_VIDEO_RESOLUTIONS = [
+    r.strip() for r in os.getenv("TEMPLATE_VIDEO_RESOLUTIONS", "1280x720,854x480,640x360").split(",") if r.strip()
+]
+VIDEO_PREBUILD_TEMPLATES = os.getenv("VIDEO_PREBUILD_TEMPLATES", "true").lower() == "true"
+
+TEMPLATE_FRAMES = 12        # the local text render shows the first 12 frames
+
+
+def parse_resolution(resolution: str) -> Tuple[int, int]:
+    width, height = (int(v) for v in resolution.lower().split("x"))
+    if width <= 0 or height <= 0 or width % 2 or height % 2:
+        raise ValueError(f"resolution must be two positive even numbers like 1280x720, got {resolution!r}")
+    return width, height
+
+
+def template_hash(procedure: str, frames: List[str]) -> str:
+    content = {
+        "procedure": procedure,
+        "frames": frames[:TEMPLATE_FRAMES],
+        "revision": video_compositor.RENDER_REVISION,
+        "font": video_compositor.VIDEO_FONT_PATH,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class TemplateLibrary:
+    def __init__(self, directory: pathlib.Path = TEMPLATE_VIDEO_DIR):
+        self.directory = pathlib.Path(directory)
+        self.manifest_path = self.directory / "manifest.json"
+        self._manifest = self._load()
+        self.built = 0
+        self.reused = 0
+
+    def _load(self) -> dict:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("templates", {})
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"[Templates] Could not read {self.manifest_path}: {e}. Rebuilding.")
+            return {}
+
+    def _save(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"templates": self._manifest}, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    def lookup(self, procedure: str, frames: List[str], resolution: str) -> Optional[pathlib.Path]:
+        """The prebuilt video for these frames at `resolution`, or None if it is missing or stale."""
+        entry = self._manifest.get(procedure)
+        if not entry or entry["hash"] != template_hash(procedure, frames):
+            return None
+        rendition = entry["files"].get(resolution)
+        if not rendition:
+            return None
+        path = self.directory / rendition["file"]
+        return path if path.exists() else None
+
+    def available(self, templates: Dict[str, dict]) -> Dict[str, List[str]]:
+        """Procedure -> resolutions with an up-to-date prebuilt video."""
+        return {
+            procedure: [r for r in TEMPLATE_VIDEO_RESOLUTIONS if self.lookup(procedure, template["frames"], r)]
+            for procedure, template in templates.items()
+        }
+
+    async def build(self, templates: Dict[str, dict], resolutions: List[str] = TEMPLATE_VIDEO_RESOLUTIONS,
+                    force: bool = False) -> dict:
+        """
+        Render every template at every resolution that is not already current,
+        one render at a time on the render farm. Returns {"built": n, "reused": n}.
+        """
+        sizes = [(r, parse_resolution(r)) for r in resolutions]
+        built = reused = 0
+        for procedure, template in templates.items():
+            frames = template["frames"][:TEMPLATE_FRAMES]
+            digest = template_hash(procedure, frames)
+            entry = self._manifest.get(procedure)
+            if force or not entry or entry["hash"] != digest:
+                entry = {"hash": digest, "files": {}}
+            version_dir = self.directory / f"{procedure}-{digest}"
+            version_dir.mkdir(parents=True, exist_ok=True)
+
+            for resolution, (width, height) in sizes:
+                if not force and self.lookup(procedure, frames, resolution):
+                    reused += 1
+                    continue
+                final = version_dir / f"{resolution}.mp4"
+                tmp = version_dir / f".{resolution}.part.mp4"      # ffmpeg picks the container by extension
+                started = time.perf_counter()
+                try:
+                    await render_farm.render(video_compositor.render_text_video, str(tmp), procedure, frames,
+                                             width=width, height=height)
+                    os.replace(tmp, final)
+                finally:
+                    tmp.unlink(missing_ok=True)
+                entry["files"][resolution] = {
+                    "file": f"{version_dir.name}/{final.name}",
+                    "size": final.stat().st_size,
+                    "built_at": time.time(),
+                }
+                self._manifest[procedure] = entry
+                self._save()
+                built += 1
+                logger.info(f"[Templates] Built {procedure} {resolution} in {time.perf_counter() - started:.1f}s")
+
+            self._manifest[procedure] = entry
+            self._save()
+            self._remove_stale(procedure, version_dir.name)
+
+        self.built += built
+        self.reused += reused
+        logger.info(f"[Templates] Library ready: {built} rendered, {reused} already current")
+        return {"built": built, "reused": reused}
+
+    def _remove_stale(self, procedure: str, current: str):
+        for path in self.directory.glob(f"{procedure}-*"):
+            if path.is_dir() and path.name != current and path.name.rsplit("-", 1)[0] == procedure:
+                shutil.rmtree(path, ignore_errors=True)
+                logger.info(f"[Templates] Removed old version {path.name}")
+
+    def stats(self) -> dict:
+        return {
+            "templates": len(self._manifest),
+            "videos": sum(len(e["files"]) for e in self._manifest.values()),
+            "bytes": sum(f["size"] for e in self._manifest.values() for f in e["files"].values()),
+            "built": self.built,
+            "reused": self.reused,
+        }
+
+
+_library = None
+_prebuild_task = None
+
+
+def get_library() -> TemplateLibrary:
+    global _library
+    if _library is None:
+        _library = TemplateLibrary()
+    return _library
+
+
+def start_prebuild(templates: Dict[str, dict]):
+    """Build the library in the background; requests render on demand until it is ready."""
+    global _prebuild_task
+
+    async def run():
+        try:
+            await get_library().build(templates)
+        except Exception as e:
+            logger.error(f"[Templates] Prebuild failed: {e}", exc_info=True)
+
+    _prebuild_task = asyncio.ensure_future(run())
+
+
+async def aclose():
+    if _prebuild_task is not None and not _prebuild_task.done():
+        _prebuild_task.cancel()
+        try:
+            await _prebuild_task
+        except asyncio.CancelledError:
+            pass
+
+
+def stats() -> dict:
+    return get_library().stats()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pre-render the template videos")
+    parser.add_argument("--force", action="store_true", help="re-render even if the videos are current")
+    parser.add_argument("--resolutions", default=",".join(TEMPLATE_VIDEO_RESOLUTIONS),
+                        help="comma-separated WxH list (default: %(default)s)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from routes.video_generation import VIDEO_TEMPLATES
+
+    async def main():
+        render_farm.get_farm().start()
+        try:
+            result = await get_library().build(VIDEO_TEMPLATES, args.resolutions.split(","), force=args.force)
+        finally:
+            render_farm.get_farm().shutdown()
+        print(f"{result['built']} rendered, {result['reused']} already current -> {TEMPLATE_VIDEO_DIR}")
+
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+"""
+horde_client against devtools/fake_horde.py served on a local port.
+"""
+import socket
+import asyncio
+import logging
+import threading
+
+import pytest
+import uvicorn
+
+import circuit_breaker
+import horde_client
+import rate_limiter
+from devtools import fake_horde
+
+
+@pytest.fixture(scope="module")
+def horde_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(fake_horde.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            pytest.fail("fake Horde did not start")
+        threading.Event().wait(0.05)
+    yield f"http://127.0.0.1:{port}/api/v2"
+    server.should_exit = True
+    thread.join(10)
+
+
+@pytest.fixture
+def horde(horde_url, monkeypatch):
+    """A fresh client, breaker and bucket per test; fast jobs and polling unless a test says otherwise."""
+    monkeypatch.setattr(circuit_breaker, "_breakers", {})
+    monkeypatch.setattr(rate_limiter, "_buckets", {})
+    monkeypatch.setattr(horde_client, "HORDE_POLL_MIN_S", 0.05)
+    monkeypatch.setattr(horde_client, "HORDE_POLL_MAX_S", 0.2)
+    monkeypatch.setattr(fake_horde, "MIN_S", 0.1)
+    monkeypatch.setattr(fake_horde, "MAX_S", 0.3)
+    monkeypatch.setattr(fake_horde, "FAIL_RATE", 0.0)
+    monkeypatch.setattr(fake_horde, "NO_ID_RATE", 0.0)
+    fake_horde._jobs.clear()
+    for k in fake_horde._stats:
+        fake_horde._stats[k] = 0
+    return horde_client.HordeClient(base_url=horde_url)
+
+
+def _run(client, coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await client.aclose()
+    return asyncio.run(main())
+
+
+def test_submit_poll_and_download(horde):
+    progress = []
+    images = _run(horde, horde.generate_images(
+        ["frame a", "frame b", "frame c"], deadline_s=10, width=64, height=32,
+        on_image=lambda done, total: progress.append((done, total)),
+    ))
+
+    assert all(img and img.startswith(b"\x89PNG") for img in images)
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+    stats = fake_horde._stats
+    assert stats["submitted"] == 3 and stats["downloads"] == 3 and stats["cancelled"] == 0
+    assert stats["checks"] >= 3
+    assert circuit_breaker.get("horde").consecutive_failures == 0
+
+
+def test_faulted_job_is_none(horde, monkeypatch):
+    monkeypatch.setattr(fake_horde, "FAIL_RATE", 1.0)
+    assert _run(horde, horde.generate_images(["frame"], deadline_s=10)) == [None]
+    assert fake_horde._stats["downloads"] == 0
+    assert circuit_breaker.get("horde").consecutive_failures == 1
+
+
+def test_deadline_cancels_unfinished_jobs(horde, monkeypatch):
+    monkeypatch.setattr(fake_horde, "MIN_S", 30)
+    monkeypatch.setattr(fake_horde, "MAX_S", 30)
+    images = _run(horde, horde.generate_images(["frame a", "frame b"], deadline_s=0.5))
+
+    assert images == [None, None]
+    assert fake_horde._stats["cancelled"] == 2
+    assert all(job["cancelled"] for job in fake_horde._jobs.values())
+
+
+def test_caller_cancellation_frees_horde_slots(horde, monkeypatch):
+    monkeypatch.setattr(fake_horde, "MIN_S", 30)
+    monkeypatch.setattr(fake_horde, "MAX_S", 30)
+
+    async def cancel_midway():
+        task = asyncio.ensure_future(horde.generate_images(["frame a", "frame b"], deadline_s=60))
+        while fake_horde._stats["checks"] < 2:
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The cancels are sent in the background so the caller is not held up
+        for _ in range(100):
+            if fake_horde._stats["cancelled"] == 2:
+                break
+            await asyncio.sleep(0.05)
+
+    _run(horde, cancel_midway())
+    assert fake_horde._stats["cancelled"] == 2
+
+
+def test_submit_without_id_fails_the_frame(horde, monkeypatch, caplog):
+    monkeypatch.setattr(fake_horde, "NO_ID_RATE", 1.0)
+    with caplog.at_level(logging.WARNING, logger="horde_client"):
+        images = _run(horde, horde.generate_images(["frame"], deadline_s=10))
+
+    assert images == [None]
+    assert fake_horde._stats["submitted"] == 1
+    assert fake_horde._stats["checks"] == 0      # never polls /check/None
+    assert "no job id" in caplog.text
+
+
+def test_client_is_replaced_when_the_loop_changes(horde, caplog):
+    async def open_client():
+        return horde._http()
+
+    first = asyncio.run(open_client())
+    with caplog.at_level(logging.WARNING, logger="horde_client"):
+        second = _run(horde, open_client())
+    assert second is not first
+    assert "Event loop changed" in caplog.text
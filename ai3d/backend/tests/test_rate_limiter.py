@@ -0,0 +1,68 @@
+"""
+Priority scheduling on a shared per-key bucket (rate_limiter.py).
+"""
+import asyncio
+
+import pytest
+
+import rate_limiter
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_buckets", {})
+    bucket = rate_limiter.get("gemini:GOOGLE_GENAI_API_KEY", kind="gemini")
+    assert (bucket.burst, bucket.reserve) == (5, 1)
+    bucket.rate = 0.001         # no refill while the test inspects the queue
+    return bucket
+
+
+def test_emergency_jumps_video_queue_and_uses_reserve(bucket):
+    async def main():
+        served = []
+
+        async def call(priority, tag):
+            await bucket.acquire(priority)
+            served.append(tag)
+
+        # Video takes the burst down to the reserved token, then the rest queue
+        for i in range(4):
+            await call("video", f"video{i}")
+        assert bucket.tokens == pytest.approx(1, abs=0.01)
+        queued = [asyncio.ensure_future(call("video", f"queued{i}")) for i in range(3)]
+        await asyncio.sleep(0.1)
+        assert served == [f"video{i}" for i in range(4)]       # the reserve is not theirs
+        assert bucket.stats()["queued"] == 3
+
+        # Emergency arrives last but is served at once, from the reserve
+        await asyncio.wait_for(call("emergency", "emergency"), 0.5)
+        assert served[-1] == "emergency"
+        assert bucket.tokens < 1
+
+        # Once tokens come back the video waiters drain in arrival order
+        bucket.rate = 50
+        bucket._dispatch()
+        await asyncio.wait_for(asyncio.gather(*queued), 2)
+        assert served[5:] == ["queued0", "queued1", "queued2"]
+
+    asyncio.run(main())
+
+
+def test_classes_are_served_by_priority(bucket):
+    async def main():
+        bucket.tokens = 0
+        served = []
+
+        async def call(priority):
+            await bucket.acquire(priority)
+            served.append(priority)
+
+        tasks = [asyncio.ensure_future(call(p)) for p in ("video", "technique", "guidance", "emergency")]
+        await asyncio.sleep(0.05)
+        assert served == []
+        bucket.rate = 50
+        bucket._dispatch()
+        await asyncio.wait_for(asyncio.gather(*tasks), 2)
+        assert served == ["emergency", "guidance", "technique", "video"]
+
+    asyncio.run(main())
@@ -0,0 +1,142 @@
+"""
+Small thread-safe LRU cache with per-entry TTL and optional JSON persistence.
+Values must be JSON-serialisable when a persist_path is given.
+
+Writes never touch the disk on the caller's thread: set() marks the cache
+dirty and a timer thread writes it at most every CACHE_FLUSH_S, plus once
+more at interpreter exit (flush()).
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_FLUSH_S = float(os.getenv("CACHE_FLUSH_S", "5"))
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 3600, persist_path: Optional[str] = None,
+                 flush_s: float = CACHE_FLUSH_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.persist_path = persist_path
+        self.flush_s = flush_s
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()     # one file write at a time
+        self._dirty = False
+        self._timer = None
+        if persist_path:
+            self._load()
+            atexit.register(self.flush)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if not self.enabled:
+            return default
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[0] < time.time():
+                if entry is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl_s, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            if self.persist_path:
+                self._mark_dirty()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            if self.persist_path:
+                self._mark_dirty()
+
+    def flush(self):
+        """Write pending changes to persist_path now."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            entries = [[k, exp, v] for k, (exp, v) in self._data.items()]
+        with self._write_lock:
+            self._save(entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "persistent": bool(self.persist_path),
+        }
+
+    # ── persistence ─────────────────────────────
+    def _load(self):
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"[Cache] Could not read {self.persist_path}: {e}. Starting empty.")
+            return
+
+        now = time.time()
+        for key, expires_at, value in entries:
+            if expires_at > now:
+                self._data[key] = (expires_at, value)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+        logger.info(f"[Cache] Restored {len(self._data)} entries from {self.persist_path}")
+
+    def _mark_dirty(self):
+        # Called with the lock held; the first change after a write schedules the next one
+        self._dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_s, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _save(self, entries: list):
+        # Write-then-rename so a crash never leaves a torn file
+        tmp = f"{self.persist_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.persist_path)), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.persist_path)
+        except Exception as e:
+            logger.warning(f"[Cache] Could not persist to {self.persist_path}: {e}")
@@ -0,0 +1,206 @@
+"""
+One background poller for every outstanding Veo long-running operation.
+
+Requests register their operation with wait() and await a future instead of
+each running its own sleep-and-get loop. A single task sweeps all operations
+that are due, refreshing them concurrently in worker threads (at most
+VEO_POLL_BATCH at a time, since the SDK call is blocking), and resolves
+the waiting futures as operations finish.
+
+Polling follows the observed completion times: nothing is checked before the
+p10 of recent render durations, checks run every VEO_POLL_MIN_S between p10
+and p90, and slower outliers back off exponentially up to VEO_POLL_MAX_S.
+Until enough renders have been seen, a plain MIN→MAX backoff is used.
+
+download() saves a finished video from a worker thread, writing to a temp
+file and then renaming it, so the loop never blocks on file I/O and readers
+never see a half-written MP4.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+VEO_POLL_MIN_S     = float(os.getenv("VEO_POLL_MIN_S", "5"))
+VEO_POLL_MAX_S     = float(os.getenv("VEO_POLL_MAX_S", "30"))
+VEO_POLL_BATCH     = int(os.getenv("VEO_POLL_BATCH", "8"))
+VEO_POLL_TIMEOUT_S = float(os.getenv("VEO_POLL_TIMEOUT_S", "300"))
+
+_MIN_SAMPLES = 5
+
+
+def _percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class _Tracked:
+    def __init__(self, operation, future: asyncio.Future):
+        self.operation = operation
+        self.future = future
+        self.submitted_at = time.monotonic()
+        self.next_check = self.submitted_at
+        self.delay = VEO_POLL_MIN_S
+        self.checks = 0
+        self.waiters = 0                    # wait() calls sharing the future
+
+
+class VeoPoller:
+    def __init__(self, refresh: Callable[[Any], Any]):
+        self._refresh = refresh             # blocking: operation -> refreshed operation
+        self._ops = {}                      # operation name -> _Tracked
+        self._durations = deque(maxlen=100)
+        self._wakeup = None
+        self._task = None
+        self._loop = None
+        self.sweeps = 0
+        self.checks = 0
+        self.completed = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def _ensure_task(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def wait(self, operation, timeout_s: float = VEO_POLL_TIMEOUT_S):
+        """
+        Track `operation` until it reports done and return the final
+        operation. Raises asyncio.TimeoutError after timeout_s. Callers waiting
+        on the same operation share one tracked entry; it is dropped early only
+        when the last of them gives up.
+        """
+        if getattr(operation, "done", False):
+            return operation
+        self._ensure_task()
+        name = operation.name
+        tracked = self._ops.get(name)
+        if tracked is None:
+            tracked = self._ops[name] = _Tracked(operation, self._loop.create_future())
+            tracked.next_check = tracked.submitted_at + self._first_delay()
+            self._wakeup.set()
+        tracked.waiters += 1
+        try:
+            # shield: one caller timing out must not cancel the shared future
+            return await asyncio.wait_for(asyncio.shield(tracked.future), timeout_s)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.error(f"[Veo Poller] {name} not done after {timeout_s:.0f}s")
+            raise
+        finally:
+            tracked.waiters -= 1
+            # Stop polling only once nobody is waiting for the operation any more
+            if not tracked.waiters and self._ops.get(name) is tracked:
+                self._ops.pop(name)
+
+    def _first_delay(self) -> float:
+        if len(self._durations) < _MIN_SAMPLES:
+            return VEO_POLL_MIN_S
+        return max(VEO_POLL_MIN_S, _percentile(self._durations, 0.10))
+
+    def _next_delay(self, tracked: _Tracked, now: float) -> float:
+        age = now - tracked.submitted_at
+        if len(self._durations) >= _MIN_SAMPLES:
+            p10 = _percentile(self._durations, 0.10)
+            p90 = _percentile(self._durations, 0.90)
+            if age < p10:
+                return min(VEO_POLL_MAX_S, max(VEO_POLL_MIN_S, p10 - age))
+            if age < p90:
+                return VEO_POLL_MIN_S
+        tracked.delay = min(VEO_POLL_MAX_S, tracked.delay * 2)
+        return tracked.delay
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            due = [t for t in list(self._ops.values()) if t.next_check <= now]
+            if due:
+                await self._sweep(due)
+                continue
+            self._wakeup.clear()
+            if not self._ops:
+                await self._wakeup.wait()
+                continue
+            sleep_s = min(t.next_check for t in self._ops.values()) - now
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, sleep_s))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _sweep(self, due):
+        self.sweeps += 1
+        slots = asyncio.Semaphore(VEO_POLL_BATCH)
+
+        async def check(tracked: _Tracked):
+            async with slots:
+                tracked.checks += 1
+                self.checks += 1
+                try:
+                    operation = await asyncio.to_thread(self._refresh, tracked.operation)
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning(f"[Veo Poller] Status check for {tracked.operation.name} failed: {e}")
+                    operation = tracked.operation
+            now = time.monotonic()
+            tracked.operation = operation
+            if getattr(operation, "done", False):
+                took = now - tracked.submitted_at
+                self._durations.append(took)
+                self.completed += 1
+                self._ops.pop(operation.name, None)
+                logger.info(f"[Veo Poller] {operation.name} done after {took:.0f}s ({tracked.checks} checks)")
+                if not tracked.future.done():
+                    tracked.future.set_result(operation)
+            else:
+                tracked.next_check = now + self._next_delay(tracked, now)
+
+        await asyncio.gather(*(check(t) for t in due))
+
+    def stats(self) -> dict:
+        durations = list(self._durations)
+        return {
+            "outstanding": len(self._ops),
+            "sweeps": self.sweeps,
+            "checks": self.checks,
+            "completed": self.completed,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "checks_per_operation": round(self.checks / self.completed, 1) if self.completed else None,
+            "completion_p10_s": round(_percentile(durations, 0.10), 1) if durations else None,
+            "completion_p50_s": round(_percentile(durations, 0.50), 1) if durations else None,
+            "completion_p90_s": round(_percentile(durations, 0.90), 1) if durations else None,
+        }
+
+
+async def download(save: Callable[[str], None], destination: str):
+    """Run the blocking `save(path)` in a worker thread, then move the file into place."""
+    tmp = f"{destination}.part"
+    try:
+        await asyncio.to_thread(save, tmp)
+        os.replace(tmp, destination)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _refresh_operation(operation):
+    import google.generativeai as genai
+    return genai.operations.get(operation.name)
+
+
+_poller = VeoPoller(_refresh_operation)
+
+
+def get_poller() -> VeoPoller:
+    return _poller
+
+
+def stats() -> dict:
+    return _poller.stats()
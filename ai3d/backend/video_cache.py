@@ -0,0 +1,241 @@
+"""
+Content-addressed cache for generated videos in generated_videos/.
+
+A video's key hashes everything that determines its content — procedure,
+frame captions, provider (and its model/prompt), render settings — so a
+repeat request is answered with the existing file instead of a new render.
+Files are named <prefix>_<hash>.mp4; renders go to a temp file first and are
+moved into place, so concurrent renders never overwrite a file being served.
+
+The directory is kept under VIDEO_CACHE_MAX_MB by evicting least-recently
+used videos. The index (key -> file, size, last use, response metadata) is
+written to VIDEO_CACHE_INDEX with write-then-rename when videos are added or
+evicted and at shutdown (flush()) — hits only update recency in memory, so a
+crash loses at most some LRU ordering — and reloaded at startup;
+stray .mp4 files from older builds are adopted so they count toward the
+budget and age out like everything else.
+
+put() moves files, evicts and writes the index, so async callers run it in a
+worker thread. Files being downloaded are pinned (pin()/unpin()) and never
+evicted mid-response; the budget is enforced again once they are released.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import logging
+import pathlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+VIDEO_CACHE_DIR    = pathlib.Path(__file__).parent / "generated_videos"
+VIDEO_CACHE_MAX_MB = float(os.getenv("VIDEO_CACHE_MAX_MB", "2048"))
+VIDEO_CACHE_INDEX  = os.getenv("VIDEO_CACHE_INDEX") or None     # default: <directory>/.video_index.json
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_-]")
+
+
+class VideoCache:
+    def __init__(self, directory: pathlib.Path, max_bytes: int, index_path: Optional[str] = None):
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.index_path = index_path or str(self.directory / ".video_index.json")
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()    # key -> entry, LRU first
+        self._by_file = {}
+        self._serving = {}              # filename -> responses currently streaming it
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._dirty = False             # recency changed since the index was last written
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def key(**fields) -> str:
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def filename(key: str, prefix: str) -> str:
+        return f"{_UNSAFE.sub('_', prefix)}_{key[:20]}.mp4"
+
+    def temp_path(self) -> pathlib.Path:
+        """A private path to render into before put()."""
+        return self.directory / f".render_{uuid.uuid4().hex}.mp4"
+
+    def get(self, key: str) -> Optional[dict]:
+        """The cached entry (file, size, meta) for `key`, or None. Counts as a use."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not (self.directory / entry["file"]).exists():
+                self._drop(key)
+                self._dirty = True
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_used"] = time.time()
+            self._entries.move_to_end(key)
+            self._dirty = True
+            return dict(entry)
+
+    def pin(self, filename: str):
+        """A response started streaming `filename`: count it as a use and keep it until unpin()."""
+        with self._lock:
+            self._serving[filename] = self._serving.get(filename, 0) + 1
+            key = self._by_file.get(filename)
+            if key is not None:
+                self._entries[key]["last_used"] = time.time()
+                self._entries.move_to_end(key)
+                self._dirty = True
+
+    def unpin(self, filename: str):
+        """The response for `filename` finished; evict anything that was held over budget for it."""
+        with self._lock:
+            left = self._serving.get(filename, 0) - 1
+            if left > 0:
+                self._serving[filename] = left
+                return
+            self._serving.pop(filename, None)
+            if self._bytes > self.max_bytes and self._evict():
+                self._save()
+
+    def flush(self):
+        """Write the index if recency changed since the last write (called at shutdown)."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def put(self, key: str, source: pathlib.Path, filename: str, meta: Optional[dict] = None) -> dict:
+        """Move a finished render into the cache as `filename` and evict down to the byte budget."""
+        final = self.directory / filename
+        os.replace(source, final)
+        size = final.stat().st_size
+        with self._lock:
+            if key in self._entries:
+                self._drop(key, delete=False)
+            entry = {"file": filename, "size": size, "last_used": time.time(), "meta": meta}
+            self._entries[key] = entry
+            self._by_file[filename] = key
+            self._bytes += size
+            self._evict(keep=key)
+            self._save()
+            return dict(entry)
+
+    def _drop(self, key: str, delete: bool = True):
+        # Called with the lock held
+        entry = self._entries.pop(key)
+        self._by_file.pop(entry["file"], None)
+        self._bytes -= entry["size"]
+        if delete:
+            try:
+                (self.directory / entry["file"]).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _evict(self, keep: Optional[str] = None) -> int:
+        # Called with the lock held; returns the number of videos evicted
+        evicted = 0
+        for key in list(self._entries):
+            if self._bytes <= self.max_bytes:
+                break
+            if key == keep or self._entries[key]["file"] in self._serving:
+                continue
+            size = self._entries[key]["size"]
+            logger.info(f"[VideoCache] Evicting {self._entries[key]['file']} ({size / 1e6:.1f} MB)")
+            self._drop(key)
+            self.evictions += 1
+            self.evicted_bytes += size
+            evicted += 1
+        return evicted
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+                "serving": sum(self._serving.values()),
+            }
+
+    # ── persistence ─────────────────────────────
+    def _load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            saved = []
+        except Exception as e:
+            logger.warning(f"[VideoCache] Could not read {self.index_path}: {e}. Rebuilding from the directory.")
+            saved = []
+
+        for key, entry in sorted(saved, key=lambda kv: kv[1].get("last_used", 0)):
+            path = self.directory / entry["file"]
+            if path.exists():
+                entry["size"] = path.stat().st_size
+                self._entries[key] = entry
+                self._by_file[entry["file"]] = key
+                self._bytes += entry["size"]
+
+        # Renders interrupted by a crash or restart; pathlib's glob matches dotfiles too,
+        # so these have to go before strays are adopted
+        for path in self.directory.glob(".render_*.mp4"):
+            path.unlink(missing_ok=True)
+
+        # Videos written before the cache existed, or by other code paths
+        stray = [p for p in self.directory.glob("*.mp4")
+                 if p.name not in self._by_file and not p.name.startswith(".")]
+        for path in sorted(stray, key=lambda p: p.stat().st_mtime):
+            stat = path.stat()
+            key = f"file:{path.name}"
+            self._entries[key] = {"file": path.name, "size": stat.st_size, "last_used": stat.st_mtime, "meta": None}
+            self._entries.move_to_end(key, last=False)
+            self._by_file[path.name] = key
+            self._bytes += stat.st_size
+
+        with self._lock:
+            self._evict()
+            self._save()
+        logger.info(
+            f"[VideoCache] {len(self._entries)} videos, {self._bytes / 1e6:.1f} of "
+            f"{self.max_bytes / 1e6:.0f} MB ({len(stray)} adopted)"
+        )
+
+    def _save(self):
+        # Called with the lock held; write-then-rename so a crash never leaves a torn index
+        tmp = f"{self.index_path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(list(self._entries.items()), f)
+            os.replace(tmp, self.index_path)
+            self._dirty = False
+        except Exception as e:
+            logger.warning(f"[VideoCache] Could not persist index to {self.index_path}: {e}")
+
+
+_cache = None
+
+
+def get_cache() -> VideoCache:
+    global _cache
+    if _cache is None:
+        _cache = VideoCache(VIDEO_CACHE_DIR, int(VIDEO_CACHE_MAX_MB * 1024 * 1024), VIDEO_CACHE_INDEX)
+    return _cache
+
+
+def stats() -> dict:
+    return get_cache().stats()
@@ -0,0 +1,402 @@
+"""
+Frame compositor for the locally rendered procedure videos.
+
+Built once per process and frame size (get_compositor()):
+- fonts are loaded once from VIDEO_FONT_PATH, falling back to DejaVu Sans
+  (ships with most Linux images), Arial, then Pillow's bundled font;
+- the darkening of AI backgrounds and the translucent top/bottom bars are
+  folded into one per-row shade mask, applied in place with a single
+  vectorised multiply;
+- the static parts of text-only frames (background, rules, title, footer)
+  are rendered once per procedure and copied per frame;
+- text is rasterised once per (string, font) into an alpha sprite and
+  blended into the frame array, so frames never round-trip through PIL.
+
+Layout matches the original 1280x720 design and scales with VIDEO_WIDTH /
+VIDEO_HEIGHT.
+
+encode_video() streams frames into the MP4 as they are composited, so a
+render holds one frame at a time whatever the video length. How long each
+frame stays on screen is the stream's frame rate, not repeated frames.
+render_ai_video() / render_text_video() are the whole-video renders run by
+render_farm.py; they take only plain, picklable arguments.
+
+Benchmark against the previous per-frame PIL code:
+    python video_compositor.py [frames]
+Peak RSS of buffered vs streaming encoding (12 and 120 frames):
+    python video_compositor.py --memory
+"""
+import os
+import sys
+import time
+import logging
+import threading
+import subprocess
+from fractions import Fraction
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+VIDEO_WIDTH     = int(os.getenv("VIDEO_WIDTH", "1280"))
+VIDEO_HEIGHT    = int(os.getenv("VIDEO_HEIGHT", "720"))
+VIDEO_FONT_PATH = os.getenv("VIDEO_FONT_PATH") or None
+
+# Part of the video cache key (see video_cache.py): bump when the frame layout changes
+RENDER_REVISION = 1
+
+_FONT_FALLBACKS = ("DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "arial.ttf")
+
+BG_COLOR     = (15, 15, 45)
+ACCENT_BLUE  = (80, 180, 255)
+ACCENT_GREEN = (80, 220, 130)
+TITLE_BLUE   = (100, 200, 255)
+TEXT_WHITE   = (220, 220, 230)
+DIM_TEXT     = (140, 140, 160)
+BAR_TRACK    = (30, 30, 60)
+
+
+@lru_cache(maxsize=None)
+def load_font(size: int, font_path: Optional[str] = VIDEO_FONT_PATH):
+    for candidate in ((font_path,) if font_path else ()) + _FONT_FALLBACKS:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    logger.warning(f"[Compositor] No TrueType font found (VIDEO_FONT_PATH={font_path!r}); using Pillow's default")
+    return ImageFont.load_default(size)
+
+
+def clean_caption(frame_text: str) -> str:
+    """'Frame 3: Hand placement' -> 'Hand placement'."""
+    if frame_text.startswith("Frame "):
+        colon_idx = frame_text.find(":")
+        if colon_idx > 0:
+            return frame_text[colon_idx + 2:]
+    return frame_text
+
+
+def wrap_words(text: str, width: int = 45) -> list:
+    lines, current_line = [], ""
+    for word in text.split():
+        test_line = f"{current_line} {word}".strip()
+        if len(test_line) > width:
+            lines.append(current_line)
+            current_line = word
+        else:
+            current_line = test_line
+    if current_line:
+        lines.append(current_line)
+    return lines
+
+
+class FrameCompositor:
+    def __init__(self, width: int = VIDEO_WIDTH, height: int = VIDEO_HEIGHT, font_path: Optional[str] = VIDEO_FONT_PATH):
+        self.width, self.height = width, height
+        self.size = (width, height)
+        sx, sy = width / 1280, height / 720
+        self._x = lambda v: int(round(v * sx))
+        self._y = lambda v: int(round(v * sy))
+
+        fs = lambda pt: max(8, self._y(pt))
+        self.font_title, self.font_body, self.font_small = (load_font(fs(p), font_path) for p in (36, 26, 20))
+        self.text_title, self.text_body, self.text_small = (load_font(fs(p), font_path) for p in (48, 30, 22))
+
+        # AI frames: 30% darkening everywhere, plus the black bars (alpha 180 top, 200 bottom)
+        shade = np.full((height, 1, 1), 0.7, dtype=np.float32)
+        shade[:self._y(70)] *= 1 - 180 / 255
+        shade[self._y(620):] *= 1 - 200 / 255
+        self._shade = shade
+        self._bar_top = self._y(714)
+
+        self._text_bases = {}
+        self._sprites = {}
+        self._lock = threading.Lock()
+
+    def _sprite(self, text: str, font) -> np.ndarray:
+        key = (text, id(font))
+        sprite = self._sprites.get(key)
+        if sprite is None:
+            left, top, right, bottom = font.getbbox(text)
+            mask = Image.new("L", (max(1, right), max(1, bottom)))
+            ImageDraw.Draw(mask).text((0, 0), text, fill=255, font=font)
+            sprite = (np.asarray(mask, dtype=np.float32) / 255)[:, :, None]
+            with self._lock:
+                if len(self._sprites) > 4096:
+                    self._sprites.clear()
+                self._sprites[key] = sprite
+        return sprite
+
+    def _text(self, frame: np.ndarray, xy: tuple, text: str, fill: tuple, font):
+        """Blend `text` into frame at xy (same anchor as ImageDraw.text)."""
+        alpha = self._sprite(text, font)
+        x, y = xy
+        h = min(alpha.shape[0], self.height - y)
+        w = min(alpha.shape[1], self.width - x)
+        if h <= 0 or w <= 0:
+            return
+        region = frame[y:y + h, x:x + w]
+        a = alpha[:h, :w]
+        region[:] = region + (np.asarray(fill, dtype=np.float32) - region) * a
+
+    def _progress_bar(self, frame: np.ndarray, index: int, total: int):
+        frame[self._bar_top:] = BAR_TRACK
+        frame[self._bar_top:, :int(self.width * (index + 1) / total)] = ACCENT_GREEN
+
+    def ai_frame(self, image: Optional[Image.Image], procedure: str, frame_text: str, index: int, total: int) -> np.ndarray:
+        """Composite one AI-background frame: returns an HxWx3 uint8 array."""
+        if image is not None:
+            # Upscaling a 512px image that is then darkened: bicubic is indistinguishable from Lanczos here
+            frame = np.array(image.convert("RGB").resize(self.size, Image.BICUBIC))
+        else:
+            frame = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            frame[:] = BG_COLOR
+        np.multiply(frame, self._shade, out=frame, casting="unsafe")
+        self._progress_bar(frame, index, total)
+
+        x, y = self._x, self._y
+        self._text(frame, (x(20), y(15)), procedure, TITLE_BLUE, self.font_title)
+        self._text(frame, (x(1050), y(20)), f"Step {index + 1}/{total}", (180, 180, 200), self.font_small)
+        self._text(frame, (x(30), y(650)), clean_caption(frame_text)[:70], (255, 255, 255), self.font_body)
+        self._text(frame, (x(30), y(690)), f"CardioSim AI — {procedure}", ACCENT_GREEN, self.font_small)
+        return frame
+
+    def _text_base(self, procedure: str) -> np.ndarray:
+        with self._lock:
+            base = self._text_bases.get(procedure)
+            if base is None:
+                x, y = self._x, self._y
+                img = Image.new("RGB", self.size, color=BG_COLOR)
+                draw = ImageDraw.Draw(img)
+                draw.rectangle([(0, 0), (self.width, y(6))], fill=ACCENT_BLUE)
+                draw.text((x(50), y(30)), f"{procedure} Procedure", fill=ACCENT_BLUE, font=self.text_title)
+                draw.rectangle([(x(50), y(100)), (x(1230), y(102))], fill=(40, 40, 80))
+                draw.rectangle([(0, y(640)), (self.width, self.height)], fill=(10, 10, 30))
+                draw.text((x(50), y(660)), f"CardioSim AI — {procedure}", fill=ACCENT_GREEN, font=self.text_small)
+                draw.text((x(900), y(660)), "AI-Generated Video", fill=DIM_TEXT, font=self.text_small)
+                base = self._text_bases[procedure] = np.asarray(img)
+            return base
+
+    def text_frame(self, procedure: str, frame_text: str, index: int, total: int) -> np.ndarray:
+        """Composite one text-only frame: returns an HxWx3 uint8 array."""
+        frame = self._text_base(procedure).copy()
+        self._progress_bar(frame, index, total)
+
+        x, y = self._x, self._y
+        self._text(frame, (x(950), y(40)), f"Step {index + 1} / {total}", DIM_TEXT, self.text_small)
+        for i, line in enumerate(wrap_words(clean_caption(frame_text))[:4]):
+            self._text(frame, (x(80), y(160 + 55 * i)), line, TEXT_WHITE, self.text_body)
+        return frame
+
+
+_compositors = {}
+_compositors_lock = threading.Lock()
+
+
+def get_compositor(width: int = VIDEO_WIDTH, height: int = VIDEO_HEIGHT) -> FrameCompositor:
+    with _compositors_lock:
+        compositor = _compositors.get((width, height))
+        if compositor is None:
+            compositor = _compositors[(width, height)] = FrameCompositor(width, height)
+        return compositor
+
+
+# ─────────────────────────────────────────────
+#  Encoding
+# ─────────────────────────────────────────────
+def encode_video(output_path, frames: Iterable[np.ndarray], hold_s: float = 1.0) -> int:
+    """
+    Encode `frames` (HxWx3 uint8, typically a generator) to H.264 MP4 as they
+    arrive, each held on screen for hold_s seconds. Returns the frame count.
+    """
+    import imageio
+
+    # imageio-ffmpeg rounds fps to two decimals (1/3 -> 0.33); the trailing
+    # input -r overrides it with the exact rational rate
+    rate = 1 / Fraction(hold_s).limit_denominator(1000)
+    count = 0
+    with imageio.get_writer(str(output_path), format="FFMPEG", mode="I", fps=float(rate), codec="libx264",
+                            input_params=["-r", f"{rate.numerator}/{rate.denominator}"],
+                            macro_block_size=2,     # yuv420p only needs even sizes (854x480 stays 854x480)
+                            ffmpeg_log_level="error") as writer:
+        for frame in frames:
+            writer.append_data(frame)
+            count += 1
+    return count
+
+
+def _no_progress(stage: str, done: Optional[int] = None, total: Optional[int] = None, message: Optional[str] = None):
+    pass
+
+
+def render_ai_video(output_path: str, procedure: str, frames: List[str], images: List[Optional[bytes]],
+                    on_progress: Callable = _no_progress, hold_s: float = 3) -> int:
+    """
+    Render the AI-image video: each caption over its (encoded) Horde image,
+    hold_s seconds per frame. Missing or unreadable images get the plain
+    background. Reports ("compositing", i, n) then ("encoding"); returns the file size.
+    """
+    import io
+
+    logger.info(f"[AI Video] Creating AI video for {procedure} with {len(frames)} frames...")
+    compositor = get_compositor()
+
+    def composited():
+        for i, frame_text in enumerate(frames):
+            data = images[i] if i < len(images) else None
+            image = None
+            if data:
+                try:
+                    image = Image.open(io.BytesIO(data))
+                except Exception as e:
+                    logger.warning(f"[AI Video] Frame {i+1} is not a readable image: {e}")
+            yield compositor.ai_frame(image, procedure, frame_text, i, len(frames))
+            logger.info(f"[AI Video] Frame {i+1}/{len(frames)} encoded")
+            on_progress("compositing", i + 1, len(frames))
+        on_progress("encoding")
+
+    logger.info(f"[AI Video] Encoding MP4 to {output_path}...")
+    encode_video(output_path, composited(), hold_s=hold_s)
+    file_size = os.path.getsize(output_path)
+    logger.info(f"[AI Video] ✓ Video created! {file_size} bytes, {len(frames)} frames")
+    return file_size
+
+
+def render_text_video(output_path: str, procedure: str, frames: List[str],
+                      on_progress: Callable = _no_progress, hold_s: float = 1,
+                      width: int = VIDEO_WIDTH, height: int = VIDEO_HEIGHT) -> int:
+    """Render the text-only video, hold_s seconds per caption. Returns the file size."""
+    logger.info(f"[Text Video] Creating {width}x{height} text video from {len(frames)} frames...")
+    compositor = get_compositor(width, height)
+
+    def composited():
+        for i, frame_text in enumerate(frames):
+            yield compositor.text_frame(procedure, frame_text, i, len(frames))
+            on_progress("compositing", i + 1, len(frames))
+        on_progress("encoding")
+
+    encode_video(output_path, composited(), hold_s=hold_s)
+    file_size = os.path.getsize(output_path)
+    logger.info(f"[Text Video] ✓ Created! {file_size} bytes")
+    return file_size
+
+
+# ─────────────────────────────────────────────
+#  Benchmark: previous per-frame PIL code vs FrameCompositor
+# ─────────────────────────────────────────────
+def _legacy_ai_frame(bg_source, procedure, frame_text, i, total):
+    frame_size = (1280, 720)
+    bg_img = bg_source.convert('RGB').resize(frame_size, Image.LANCZOS)
+    dark_overlay = Image.new('RGB', frame_size, color=(0, 0, 0))
+    bg_img = Image.blend(bg_img, dark_overlay, alpha=0.3)
+    try:
+        font_title = ImageFont.truetype("arial.ttf", 36)
+        font_body = ImageFont.truetype("arial.ttf", 26)
+        font_small = ImageFont.truetype("arial.ttf", 20)
+    except OSError:
+        font_title = ImageFont.load_default()
+        font_body = font_small = font_title
+    top_bar = Image.new('RGBA', (1280, 70), (0, 0, 0, 180))
+    bg_img.paste(Image.new('RGB', (1280, 70), (0, 0, 0)), (0, 0), top_bar.split()[3])
+    draw = ImageDraw.Draw(bg_img)
+    draw.text((20, 15), f"{procedure}", fill=(100, 200, 255), font=font_title)
+    draw.text((1050, 20), f"Step {i+1}/{total}", fill=(180, 180, 200), font=font_small)
+    bottom_bar = Image.new('RGBA', (1280, 100), (0, 0, 0, 200))
+    bg_img.paste(Image.new('RGB', (1280, 100), (0, 0, 0)), (0, 620), bottom_bar.split()[3])
+    draw = ImageDraw.Draw(bg_img)
+    draw.text((30, 650), clean_caption(frame_text)[:70], fill=(255, 255, 255), font=font_body)
+    draw.text((30, 690), f"CardioSim AI — {procedure}", fill=(80, 220, 130), font=font_small)
+    draw.rectangle([(0, 714), (1280, 720)], fill=(30, 30, 60))
+    draw.rectangle([(0, 714), (int(1280 * (i + 1) / total), 720)], fill=(80, 220, 130))
+    return np.array(bg_img)
+
+
+def _legacy_text_frame(procedure, frame_text, i, total):
+    img = Image.new('RGB', (1280, 720), color=BG_COLOR)
+    draw = ImageDraw.Draw(img)
+    try:
+        font_title = ImageFont.truetype("arial.ttf", 48)
+        font_body = ImageFont.truetype("arial.ttf", 30)
+        font_small = ImageFont.truetype("arial.ttf", 22)
+    except OSError:
+        font_title = ImageFont.load_default()
+        font_body = font_small = font_title
+    draw.rectangle([(0, 0), (1280, 6)], fill=ACCENT_BLUE)
+    draw.text((50, 30), f"{procedure} Procedure", fill=ACCENT_BLUE, font=font_title)
+    draw.text((950, 40), f"Step {i+1} / {total}", fill=DIM_TEXT, font=font_small)
+    draw.rectangle([(50, 100), (1230, 102)], fill=(40, 40, 80))
+    for n, line in enumerate(wrap_words(clean_caption(frame_text))[:4]):
+        draw.text((80, 160 + 55 * n), line, fill=TEXT_WHITE, font=font_body)
+    draw.rectangle([(0, 640), (1280, 720)], fill=(10, 10, 30))
+    draw.text((50, 660), f"CardioSim AI — {procedure}", fill=ACCENT_GREEN, font=font_small)
+    draw.text((900, 660), "AI-Generated Video", fill=DIM_TEXT, font=font_small)
+    draw.rectangle([(0, 714), (1280, 720)], fill=(30, 30, 60))
+    draw.rectangle([(0, 714), (int(1280 * (i + 1) / total), 720)], fill=ACCENT_GREEN)
+    return np.array(img)
+
+
+def _fps(fn, n: int) -> float:
+    fn(0)  # warm-up (font loading, cached layers)
+    t0 = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return n / (time.perf_counter() - t0)
+
+
+def _render_for_rss(mode: str, n: int, output_path: str):
+    """One AI-frame render (3s per frame) in this process; prints peak RSS in MB."""
+    import resource
+    import imageio
+    source = Image.fromarray(np.random.default_rng(0).integers(0, 255, (512, 512, 3), dtype=np.uint8))
+    comp = get_compositor(1280, 720)
+    frames = (comp.ai_frame(source, "CPR", f"Frame {i + 1}: Step", i, n) for i in range(n))
+    if mode == "buffered":
+        # The previous create_ai_video: every frame kept, each repeated 3x at 1 fps
+        extended = [f for f in frames for _ in range(3)]
+        imageio.mimwrite(output_path, extended, fps=1, codec="libx264")
+    else:
+        encode_video(output_path, frames, hold_s=3)
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def _memory_benchmark():
+    import tempfile
+    print("Peak RSS, AI-frame video at 1280x720, 3s per frame")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in (12, 120):
+            row = []
+            for mode in ("buffered", "streaming"):
+                out = subprocess.run(
+                    [sys.executable, __file__, "--rss-child", mode, str(n), os.path.join(tmp, f"{mode}.mp4")],
+                    capture_output=True, text=True, check=True,
+                ).stdout.split()[-1]
+                row.append(float(out))
+            print(f"  {n:>4} frames  buffered {row[0]:7.1f} MB   streaming {row[1]:7.1f} MB")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--rss-child"]:
+        _render_for_rss(sys.argv[2], int(sys.argv[3]), sys.argv[4])
+        sys.exit(0)
+    if sys.argv[1:2] == ["--memory"]:
+        _memory_benchmark()
+        sys.exit(0)
+    logging.basicConfig(level=logging.INFO)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    caption = "Frame 4: Compression depth demonstration - 5-6cm"
+    source = Image.fromarray(np.random.default_rng(0).integers(0, 255, (512, 512, 3), dtype=np.uint8))
+    comp = get_compositor(1280, 720)
+
+    rows = [
+        ("ai frame", lambda i: _legacy_ai_frame(source, "CPR", caption, i % 6, 6),
+                     lambda i: comp.ai_frame(source, "CPR", caption, i % 6, 6)),
+        ("text frame", lambda i: _legacy_text_frame("CPR", caption, i % 12, 12),
+                       lambda i: comp.text_frame("CPR", caption, i % 12, 12)),
+    ]
+    print(f"{n} frames at 1280x720")
+    for name, before, after in rows:
+        fps_before, fps_after = _fps(before, n), _fps(after, n)
+        print(f"  {name:<10}  before {fps_before:7.1f} fps   after {fps_after:7.1f} fps   x{fps_after / fps_before:.1f}")
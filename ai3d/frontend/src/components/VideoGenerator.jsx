@@ -21,6 +21,7 @@ export default function VideoGenerator({ diagnosis, visible }) {
     const [narration, setNarration] = useState("");
     const [templates, setTemplates] = useState([]);
     const videoRef = useRef(null);
+    const jobRef = useRef(null);
 
     if (!visible) return null;
 
@@ -40,35 +41,96 @@ export default function VideoGenerator({ diagnosis, visible }) {
         }
     }
 
+    // Human-readable text for the stages reported by /api/jobs/{id}/events
+    const STAGE_MESSAGES = {
+        queued: "⏳ Waiting for a free video worker...",
+        starting: "🚀 Starting video pipeline...",
+        images: "🖼️ Generating AI frame images",
+        reference_images: "🎨 Generating reference images",
+        veo_render: "🎬 Rendering video with Veo 3.1...",
+        huggingface_render: "🎬 Rendering video with Hugging Face...",
+        compositing: "📸 Compositing frames",
+        encoding: "🎞️ Encoding MP4...",
+        text_video: "📝 AI images unavailable, building text video...",
+        enhanced_description: "✨ Writing enhanced procedure description...",
+    };
+
+    function describeProgress(job) {
+        const base = STAGE_MESSAGES[job.stage] || `⏳ ${job.stage}...`;
+        return job.total ? `${base} (${job.done}/${job.total})` : base;
+    }
+
+    /**
+     * Queue a video pipeline on the backend and follow its progress events.
+     * Resolves with the job result (same shape as the synchronous endpoints).
+     */
+    async function runVideoJob(pipeline, request) {
+        const res = await fetch(`${BACKEND_URL}/api/video-generation/jobs`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ ...request, pipeline }),
+        });
+        if (!res.ok) {
+            throw new Error(`Generation failed: ${res.status}`);
+        }
+        const job = await res.json();
+        jobRef.current = job.job_id;
+        setGenerationStatus(describeProgress(job));
+
+        return new Promise((resolve, reject) => {
+            const events = new EventSource(`${BACKEND_URL}${job.events_url}`);
+            events.addEventListener("progress", (e) => {
+                setGenerationStatus(describeProgress(JSON.parse(e.data)));
+            });
+            events.addEventListener("done", (e) => {
+                events.close();
+                jobRef.current = null;
+                const finished = JSON.parse(e.data);
+                if (finished.status === "succeeded") {
+                    resolve(finished.result);
+                } else {
+                    reject(new Error(finished.error || `Job ${finished.status}`));
+                }
+            });
+            events.onerror = () => {
+                // The browser retries dropped streams on its own; give up only once it stops
+                if (events.readyState === EventSource.CLOSED) {
+                    jobRef.current = null;
+                    reject(new Error("Lost connection to the video job"));
+                }
+            };
+        });
+    }
+
+    async function cancelVideoJob() {
+        if (!jobRef.current) return;
+        try {
+            await fetch(`${BACKEND_URL}/api/jobs/${jobRef.current}`, { method: "DELETE" });
+        } catch (e) {
+            console.error("Cancel error:", e);
+        }
+    }
+
     async function generateVideo() {
         if (!procedure) return;
         setLoading(true);
         setGenerationStatus("🎨 Generating frame images with AI...");
         
         try {
-            const res = await fetch(`${BACKEND_URL}/api/video-generation`, {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({
-                    procedure,
-                    urgency: diagnosis?.urgency || "Urgent",
-                    steps: [
-                        "Patient assessment",
-                        "Monitoring setup",
-                        "Intervention preparation",
-                        "Procedure execution",
-                        "Post-procedure care"
-                    ],
-                    duration: 60,
-                    language: "english"
-                }),
+            const data = await runVideoJob("procedure_video", {
+                procedure,
+                urgency: diagnosis?.urgency || "Urgent",
+                steps: [
+                    "Patient assessment",
+                    "Monitoring setup",
+                    "Intervention preparation",
+                    "Procedure execution",
+                    "Post-procedure care"
+                ],
+                duration: 60,
+                language: "english"
             });
             
-            if (!res.ok) {
-                throw new Error(`Generation failed: ${res.status}`);
-            }
-            
-            const data = await res.json();
             setGenerationStatus(`✓ Video generation complete (${data.status})`);
             setVideoData(data);
             setCurrentFrame(1);
@@ -89,39 +151,15 @@ export default function VideoGenerator({ diagnosis, visible }) {
         setLoading(true);
         setGenerationStatus("🎨 Generating AI images for each step... (takes 2-5 min, using free AI)");
         
-        // Progress simulation
-        const progressMsgs = [
-            "🖼️ Submitting image jobs to AI Horde (free GPUs)...",
-            "⏳ AI generating frame images... (queued on community GPUs)",
-            "🎬 Still generating... AI is drawing realistic medical scenes...",
-            "📸 Almost there... compositing frames into video...",
-        ];
-        let msgIdx = 0;
-        const progressInterval = setInterval(() => {
-            msgIdx = Math.min(msgIdx + 1, progressMsgs.length - 1);
-            setGenerationStatus(progressMsgs[msgIdx]);
-        }, 30000);
-        
         try {
-            const res = await fetch(`${BACKEND_URL}/api/video-generation/huggingface-simple`, {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({
-                    procedure,
-                    urgency: diagnosis?.urgency || "Urgent",
-                    steps: ["AI video generation"],
-                    duration: 30,
-                    language: "english"
-                }),
+            const data = await runVideoJob("ai_video", {
+                procedure,
+                urgency: diagnosis?.urgency || "Urgent",
+                steps: ["AI video generation"],
+                duration: 30,
+                language: "english"
             });
             
-            clearInterval(progressInterval);
-            
-            if (!res.ok) {
-                throw new Error(`Generation failed: ${res.status}`);
-            }
-            
-            const data = await res.json();
             setGenerationStatus(data.video_url ? "✓ AI Video Ready! 🎬" : "✓ Generated (text frames)");
             setVideoData(data);
             setCurrentFrame(1);
@@ -129,7 +167,6 @@ export default function VideoGenerator({ diagnosis, visible }) {
             
             setTimeout(() => setGenerationStatus(""), 5000);
         } catch (e) {
-            clearInterval(progressInterval);
             console.error("AI video error:", e);
             setGenerationStatus(`✗ Error: ${e.message}`);
         } finally {
@@ -253,6 +290,12 @@ export default function VideoGenerator({ diagnosis, visible }) {
                                     {loading && (
                                         <div style={{ marginTop: "16px", textAlign: "center" }}>
                                             <p style={{ color: "#4ade80", fontWeight: "600", marginBottom: "8px" }}>{generationStatus || "🎬 Generating video..."}</p>
+                                            <button
+                                                onClick={cancelVideoJob}
+                                                style={{ marginTop: "4px", background: "none", border: "1px solid #334155", borderRadius: "6px", color: "#94a3b8", padding: "4px 12px", cursor: "pointer" }}
+                                            >
+                                                Cancel
+                                            </button>
                                             <div style={{ marginTop: "12px", display: "flex", gap: "4px", justifyContent: "center" }}>
                                                 <span style={{ animation: "pulse 0.6s infinite" }}>●</span>
                                                 <span style={{ animation: "pulse 0.6s infinite 0.2s" }}>●</span>